@@ -1,18 +1,28 @@
-from functools import partial
 import structlog
 import json
-import gspread_asyncio
+import asyncio
+import operator
+from collections import OrderedDict
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import ToolMessage, AIMessage
+from langgraph.graph.message import add_messages
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from typing import Annotated, Dict, List, Optional, Sequence, TypedDict
+from pydantic import ValidationError
+from langchain_core.messages import ToolMessage, AIMessage, BaseMessage
 from langchain_core.tools import tool
-from langchain_core.runnables import RunnableConfig # Import RunnableConfig
 
 from app.core.config import settings
-from app.schemas import AgentState
+from app.core.checkpointer import build_checkpointer
+from app.core.context_cache import is_cached_content_error
+from app.core.metrics import record_llm_usage, span
+from app.schemas import ReceiptExtraction, ToolOutcome
 # Import the tools directly
-from app.tools.gspread_tool import get_creds_for_user,  batch_append_to_sheet
+from app.tools.gspread_tool import batch_append_to_sheet, classify_error
+from app.tools.gspread_client_pool import GspreadClientPool
+from app.tools.gspread_handle_cache import WorksheetHandleCache
+from app.tools.gspread_writer import SheetsWriter
+from app.tools.sheets_write_behind import WriteBehindAppender
 
 log = structlog.get_logger()
 
@@ -20,17 +30,56 @@ log = structlog.get_logger()
 tools = [batch_append_to_sheet] # These are the @tool decorated functions
 tool_map = {tool.name: tool for tool in tools}
 
+# The graph's state; kept here rather than in app.schemas, which must stay importable without LangChain
+class AgentState(TypedDict):
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+    spreadsheet_id: str
+    worksheet_name: str
+    google_refresh_token: str 
+    # Whose rows these are; the write-behind journal keys pending appends by it
+    user_auth_id: str
+    # Typed outcomes of every tool call in the run, in order; success is decided from these
+    result: Annotated[List[ToolOutcome], operator.add]
+    # Name of the cached prompt prefix (system prompt, summary, tools) the run uses, if any
+    context_cache: Optional[str]
+    # What the cached prefix stands for (system prompt, summary), sent instead if Gemini rejects the prefix
+    inline_prefix: List[BaseMessage]
+    # Batch mode: the append tool call is recorded here instead of executed,
+    # so the rows of many receipts can be written together
+    defer_writes: bool
+    pending_appends: Annotated[List[Dict], operator.add]
+
+def _turn(state: AgentState) -> int:
+    """How many times the model has asked for tools in this run, the current request included."""
+    return sum(1 for message in state["messages"] if isinstance(message, AIMessage) and message.tool_calls)
+
 class ReceiptAgent:
-    def __init__(self):
+    def __init__(
+        self,
+        checkpointer: BaseCheckpointSaver = None,
+        gspread_pool: GspreadClientPool = None,
+        worksheet_cache: WorksheetHandleCache = None,
+        sheets_writer: SheetsWriter = None,
+        write_behind: WriteBehindAppender = None,
+    ):
+        self.gspread_pool = gspread_pool or GspreadClientPool()
+        self.worksheet_cache = worksheet_cache or WorksheetHandleCache()
+        self.sheets_writer = sheets_writer or SheetsWriter(self.gspread_pool, self.worksheet_cache)
+        # Optional: appends are journaled and acknowledged, then written in the background
+        self.write_behind = write_behind
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash", 
             google_api_key=settings.GOOGLE_API_KEY, 
             temperature=0,
-            convert_system_message_to_human=True
         )
         
         # Bind tools to LLM once during initialization
         self.llm_with_tools = self.llm.bind_tools(tools)
+        # Single-call extraction: JSON constrained to the ReceiptExtraction schema
+        self.extraction_llm = self.llm.bind(
+            response_mime_type="application/json",
+            response_json_schema=ReceiptExtraction.model_json_schema(),
+        )
         
         # Define the graph
         workflow = StateGraph(AgentState)
@@ -46,88 +95,197 @@ class ReceiptAgent:
             lambda state: "action" if state["messages"][-1].tool_calls else END,
             {"action": "action", END: END}
         )
-        workflow.add_edge('action', 'agent')
+        # A deferred write is the last step of a batch run: no need for another LLM turn
+        workflow.add_conditional_edges(
+            "action",
+            lambda state: END if state.get("defer_writes") and state.get("pending_appends") else "agent",
+            {"agent": "agent", END: END}
+        )
 
-        memory = MemorySaver()
-        self.graph = workflow.compile(checkpointer=memory)
+        # Bounded by default; a long-lived shared agent must not retain every receipt forever
+        self.checkpointer = checkpointer if checkpointer is not None else build_checkpointer()
+        self.graph = workflow.compile(checkpointer=self.checkpointer)
 
     async def agent_node(self, state: AgentState) -> dict:
         """Agent node that handles LLM interactions with pre-bound tools."""
-        # The tools are already bound in __init__ (self.llm_with_tools)
-        response = await self.llm_with_tools.ainvoke(state["messages"])
-        return {"messages": [response]}
+        context_cache = state.get("context_cache")
+        update = {}
+        with span("llm_agent"):
+            response = None
+            if context_cache:
+                try:
+                    # The cached prefix carries the system prompt, summary and tool declarations;
+                    # Gemini rejects requests that also send a system instruction or tools
+                    response = await self.llm.ainvoke(state["messages"], cached_content=context_cache)
+                except Exception as e:
+                    if not is_cached_content_error(e):
+                        raise
+                    await log.awarning("Cached prompt prefix rejected, sending it inline", error=str(e))
+                    # The rest of the run sends the prefix inline as well
+                    update["context_cache"] = None
+            if response is None:
+                # The tools are already bound in __init__ (self.llm_with_tools); an inline prefix
+                # is only set for runs that started with a cached one
+                response = await self.llm_with_tools.ainvoke(list(state.get("inline_prefix") or []) + list(state["messages"]))
+        record_llm_usage("agent", response)
+        return {"messages": [response], **update}
+
+    async def extract(self, messages: List[BaseMessage], cached_content: Optional[str] = None) -> Optional[ReceiptExtraction]:
+        """One structured-output call for the destination worksheet and rows; None if the output does not validate."""
+        llm = self.extraction_llm.bind(cached_content=cached_content) if cached_content else self.extraction_llm
+        with span("llm_extract"):
+            response = await llm.ainvoke(messages)
+        record_llm_usage("extract", response)
+        try:
+            return ReceiptExtraction.model_validate_json(response.text)
+        except ValidationError as e:
+            await log.awarning("Structured extraction did not validate", error=str(e))
+            return None
 
     async def execute_tools(self, state: AgentState) -> dict:
-        """Execute tool calls from the last message"""
+        """Execute tool calls from the last message, concurrently, merging appends to the same worksheet"""
+        with span("tools"):
+            return await self._execute_tools(state)
+
+    async def _execute_tools(self, state: AgentState) -> dict:
         last_message = state["messages"][-1]
         if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
             return {"messages": []}
 
+        if state.get("defer_writes"):
+            return self.defer_tool_calls(state, last_message)
+
         refresh_token = state.get("google_refresh_token")
         if not refresh_token:
             # This check is crucial for catching missing tokens early
-            tool_messages = [ToolMessage(
-                content="Error: Google account not linked or token is missing. Please reconnect your Google account.",
-                tool_call_id=last_message.tool_calls[0].get("id") if last_message.tool_calls else "error"
-            )]
             await log.awarning("Google refresh token missing from state for tool execution.")
-            return {"messages": tool_messages}
+            return self._fail_all(
+                state,
+                "Google account not linked or token is missing. Please reconnect your Google account.",
+                error_class="MissingGoogleToken",
+                retryable=False,
+            )
 
-        # Authorize the gspread client once for this execution step
-        agc = None # Initialize to None
+        # Get the pooled, already-authorized gspread client for this account
         try:
-            user_creds_func = partial(get_creds_for_user, refresh_token=refresh_token)
-            user_agcm = gspread_asyncio.AsyncioGspreadClientManager(user_creds_func)
-            agc = await user_agcm.authorize() # This is the authorized gspread client
+            run_config = await self.sheets_writer.tool_config(refresh_token)
         except Exception as e:
             # Catch authentication errors here so the tool execution doesn't proceed
-            tool_messages = [ToolMessage(
-                content=f"Authentication error with Google Sheets: {str(e)}. Please ensure your Google account is properly linked and has access.",
-                tool_call_id=last_message.tool_calls[0].get("id") if last_message.tool_calls else "error"
-            )]
             await log.aerror("Failed to authorize gspread client", error=str(e), refresh_token_present=bool(refresh_token))
-            return {"messages": tool_messages}
+            error_class, retryable = classify_error(e)
+            return self._fail_all(
+                state,
+                f"Authentication error with Google Sheets: {str(e)}. Please ensure your Google account is properly linked and has access.",
+                error_class=error_class,
+                retryable=retryable,
+            )
 
-        tool_messages = []
-        
-        for tool_call in last_message.tool_calls:
-            tool_name = tool_call.get("name")
+        # Calls appending to the same worksheet become one append; the groups run concurrently
+        tool_calls = last_message.tool_calls
+        turn = _turn(state)
+        groups: "OrderedDict[tuple, List[int]]" = OrderedDict()
+        for index, tool_call in enumerate(tool_calls):
             tool_args = tool_call.get("args", {})
-            tool_call_id = tool_call.get("id")
-            
-            # Create a RunnableConfig for this tool call, injecting the client
-            run_config = RunnableConfig(configurable={"gspread_client": agc}) # Only client is needed by tool, not raw token
-            
+            if tool_call.get("name") == batch_append_to_sheet.name and tool_args.get("worksheet_name"):
+                key = (tool_args.get("spreadsheet_id"), tool_args["worksheet_name"])
+            else:
+                key = ("call", index)
+            groups.setdefault(key, []).append(index)
+
+        async def run_group(indices: List[int]):
+            first = tool_calls[indices[0]]
+            tool_name, tool_args = first.get("name"), dict(first.get("args", {}))
+            if len(indices) > 1:
+                tool_args["data_rows"] = [row for i in indices for row in tool_calls[i].get("args", {}).get("data_rows") or []]
+            spreadsheet_id = tool_args.get("spreadsheet_id") or state.get("spreadsheet_id")
             try:
+                if self.write_behind is not None and tool_name == batch_append_to_sheet.name and state.get("user_auth_id"):
+                    result = await self.write_behind.enqueue(
+                        state["user_auth_id"], refresh_token, spreadsheet_id, tool_args.get("worksheet_name"), tool_args.get("data_rows") or []
+                    )
+                    return indices, result, None
+
                 # Retrieve the actual tool function by name from the global tool_map
                 tool_function = tool_map[tool_name]
                 
                 # Invoke the tool function, passing tool_args from LLM and our custom run_config
-                result = await tool_function.ainvoke(tool_args, config=run_config)
-                
-                tool_messages.append(
-                    ToolMessage(
-                        content=json.dumps(result),
-                        tool_call_id=tool_call_id,
-                    )
-                )
-                
+                async with self.sheets_writer.spreadsheet_slot(spreadsheet_id):
+                    return indices, await tool_function.ainvoke(tool_args, config=run_config), None
             except Exception as e:
                 # This exception handler catches errors *within* the tool function
                 await log.aerror(
                     f"Error executing tool {tool_name}", 
                     error=str(e), 
                     tool_args=tool_args, 
-                    tool_call_id=tool_call_id
+                    tool_call_ids=[tool_calls[i].get("id") for i in indices]
                 )
-                tool_messages.append(
-                    ToolMessage(
-                        content=f"Error executing tool {tool_name}: {str(e)}",
-                        tool_call_id=tool_call_id,
+                return indices, None, e
+
+        tool_messages: List[ToolMessage] = [None] * len(tool_calls)
+        outcomes: List[ToolOutcome] = [None] * len(tool_calls)
+        for indices, result, error in await asyncio.gather(*(run_group(indices) for indices in groups.values())):
+            for i in indices:
+                tool_name, tool_args = tool_calls[i].get("name"), tool_calls[i].get("args", {})
+                if error is None:
+                    # Every merged call gets the shared result; rows are attributed to the call that sent them
+                    content, outcome = json.dumps(result), ToolOutcome(
+                        tool=tool_name,
+                        status="queued" if result.get("queued") else "appended",
+                        worksheet_name=tool_args.get("worksheet_name"),
+                        rows_appended=len(tool_args.get("data_rows") or []),
+                        message=result.get("message", ""),
+                        turn=turn,
                     )
-                )
+                else:
+                    error_class, retryable = classify_error(error)
+                    content = f"Error executing tool {tool_name}: {str(error)}"
+                    outcome = ToolOutcome(
+                        tool=tool_name,
+                        status="failed",
+                        worksheet_name=tool_args.get("worksheet_name"),
+                        error_class=error_class,
+                        retryable=retryable,
+                        message=content,
+                        turn=turn,
+                    )
+                # Results stay in tool-call order, whatever order the groups finished in
+                tool_messages[i] = ToolMessage(content=content, tool_call_id=tool_calls[i].get("id"))
+                outcomes[i] = outcome
+
+        return {"messages": tool_messages, "result": outcomes}
+
+    def _fail_all(self, state: AgentState, message: str, error_class: str, retryable: bool) -> dict:
+        """Answers every pending tool call with the same failure (e.g. when no call can run at all)."""
+        last_message, turn = state["messages"][-1], _turn(state)
+        tool_messages, outcomes = [], []
+        for tool_call in last_message.tool_calls:
+            tool_messages.append(ToolMessage(content=f"Error: {message}", tool_call_id=tool_call.get("id")))
+            outcomes.append(ToolOutcome(
+                tool=tool_call.get("name"),
+                status="failed",
+                worksheet_name=tool_call.get("args", {}).get("worksheet_name"),
+                error_class=error_class,
+                retryable=retryable,
+                message=message,
+                turn=turn,
+            ))
+        return {"messages": tool_messages, "result": outcomes}
 
-        return {"messages": tool_messages}
+    def defer_tool_calls(self, state: AgentState, last_message: AIMessage) -> dict:
+        """Batch mode: records the rows of each append call in the state instead of writing them."""
+        tool_messages, pending = [], []
+        for tool_call in last_message.tool_calls:
+            tool_args = tool_call.get("args", {})
+            worksheet_name = tool_args.get("worksheet_name")
+            data_rows = tool_args.get("data_rows")
+            if tool_call.get("name") != batch_append_to_sheet.name or not worksheet_name or not isinstance(data_rows, list):
+                content = f"Error: invalid call to {tool_call.get('name')}. Call batch_append_to_sheet with worksheet_name and data_rows."
+            else:
+                # Always the batch's spreadsheet: ownership was checked for it, not for whatever the model names
+                pending.append({"spreadsheet_id": state["spreadsheet_id"], "worksheet_name": worksheet_name, "data_rows": data_rows})
+                content = json.dumps({"message": f"Queued {len(data_rows)} rows for '{worksheet_name}'."})
+            tool_messages.append(ToolMessage(content=content, tool_call_id=tool_call.get("id")))
+        return {"messages": tool_messages, "pending_appends": pending}
 
     def get_agent(self):
         return self.graph
\ No newline at end of file
@@ -0,0 +1,145 @@
+# app/core/checkpointer.py
+import time
+import threading
+import structlog
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+def _stored_size(value) -> int:
+    """Approximate size in bytes of a serialized entry (nested tuples of str/bytes)."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_stored_size(v) for v in value)
+    return 0
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    An in-memory checkpointer with a budget. Threads are kept in LRU order and
+    evicted once they exceed `max_threads` or `max_bytes`, or when they have not
+    been touched for `ttl_seconds`. A limit of 0 disables that limit.
+    The thread currently being written is never evicted, so an in-flight run
+    always keeps its own state.
+    """
+    def __init__(self, max_threads: int = 256, max_bytes: int = 0, ttl_seconds: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        # thread_id -> [retained bytes, last access (monotonic)]
+        self._threads: "OrderedDict[str, list]" = OrderedDict()
+        self._retained_bytes = 0
+        self._evicted_threads = 0
+
+    def get_tuple(self, config):
+        result = super().get_tuple(config)
+        thread_id = config["configurable"].get("thread_id")
+        if result is not None and thread_id is not None:
+            self._track(thread_id, 0)
+        return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            added = _stored_size(self.storage[thread_id][checkpoint_ns].get(checkpoint["id"]))
+            for k, v in new_versions.items():
+                added += _stored_size(self.blobs.get((thread_id, checkpoint_ns, k, v)))
+            self._track(thread_id, added)
+            return next_config
+
+    def put_writes(self, config, writes, task_id, task_path: str = ""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            before = _stored_size(tuple(self.writes.get(outer_key, {}).values()))
+            super().put_writes(config, writes, task_id, task_path)
+            after = _stored_size(tuple(self.writes.get(outer_key, {}).values()))
+            self._track(thread_id, after - before)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            entry = self._threads.pop(thread_id, None)
+            if entry is not None:
+                self._retained_bytes -= entry[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Current retention metrics for this checkpointer."""
+        with self._lock:
+            return {
+                "retained_threads": len(self._threads),
+                "retained_bytes": self._retained_bytes,
+                "evicted_threads": self._evicted_threads,
+                "max_threads": self.max_threads,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _track(self, thread_id: str, added_bytes: int):
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is None:
+                entry = self._threads[thread_id] = [0, 0.0]
+            entry[0] += added_bytes
+            entry[1] = time.monotonic()
+            self._threads.move_to_end(thread_id)
+            self._retained_bytes += added_bytes
+            self._evict(keep=thread_id)
+
+    def _evict(self, keep: str):
+        now = time.monotonic()
+        evicted = []
+        for thread_id in list(self._threads):
+            if thread_id == keep:
+                continue
+            retained, last_access = self._threads[thread_id]
+            expired = self.ttl_seconds and now - last_access > self.ttl_seconds
+            over_threads = self.max_threads and len(self._threads) > self.max_threads
+            over_bytes = self.max_bytes and self._retained_bytes > self.max_bytes
+            if not (expired or over_threads or over_bytes):
+                # Entries are in LRU order: once one survives, the newer ones do too
+                break
+            self.delete_thread(thread_id)
+            evicted.append(thread_id)
+
+        if evicted:
+            self._evicted_threads += len(evicted)
+            log.debug(
+                "Evicted checkpoint threads",
+                evicted=len(evicted),
+                retained_threads=len(self._threads),
+                retained_bytes=self._retained_bytes,
+            )
+
+
+# App types kept in agent state; checkpoints only restore allow-listed classes
+_STATE_TYPES = [("app.schemas", "ToolOutcome")]
+
+def build_checkpointer() -> Optional[BaseCheckpointSaver]:
+    """
+    Builds the checkpointer configured by AGENT_CHECKPOINTER:
+    "bounded" (default), "memory" (unbounded MemorySaver) or "none".
+    """
+    mode = settings.AGENT_CHECKPOINTER.lower()
+    if mode == "none":
+        return None
+    serde = JsonPlusSerializer(allowed_msgpack_modules=_STATE_TYPES)
+    if mode == "memory":
+        return MemorySaver(serde=serde)
+    if mode == "bounded":
+        return BoundedMemorySaver(
+            max_threads=settings.AGENT_CHECKPOINT_MAX_THREADS,
+            max_bytes=settings.AGENT_CHECKPOINT_MAX_BYTES,
+            ttl_seconds=settings.AGENT_CHECKPOINT_TTL_SECONDS,
+            serde=serde,
+        )
+    raise ValueError(f"Unknown AGENT_CHECKPOINTER mode: {settings.AGENT_CHECKPOINTER}")
@@ -1,3 +1,6 @@
+import os
+import math
+from typing import Dict
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -21,5 +24,156 @@ class Settings(BaseSettings):
     SUPABASE_JWT_SECRET: str
 
     PGCRYPTO_SECRET_KEY: str
-# Create a single, globally accessible instance of the settings
-settings = Settings()
\ No newline at end of file
+
+    # Build the agent and service clients at startup and prime their connections
+    WARM_UP_ON_STARTUP: bool = True
+    # Do that after the app starts serving, so health checks pass while the SDKs load;
+    # requests that need the agent or the clients wait for it
+    WARM_UP_IN_BACKGROUND: bool = True
+
+    # Upper bound on concurrent Supabase round-trips per worker (thread-pool size)
+    SUPABASE_MAX_CONCURRENCY: int = 16
+
+    # Authenticated-user cache; local verification skips the remote token check
+    AUTH_CACHE_TTL_SECONDS: float = 60
+    AUTH_CACHE_MAX_SIZE: int = 1024
+    AUTH_VERIFY_JWT_LOCALLY: bool = False
+
+    # Pooled, per-account gspread clients
+    GSPREAD_CLIENT_POOL_SIZE: int = 256
+    GSPREAD_HANDLE_CACHE_SIZE: int = 1024
+    GSPREAD_HANDLE_CACHE_TTL_SECONDS: float = 600
+
+    # Client-side Sheets API quotas (per minute, reads and writes counted separately)
+    # and the retry policy for 429/5xx responses
+    SHEETS_USER_READS_PER_MINUTE: float = 60
+    SHEETS_USER_WRITES_PER_MINUTE: float = 60
+    SHEETS_PROJECT_READS_PER_MINUTE: float = 300
+    SHEETS_PROJECT_WRITES_PER_MINUTE: float = 300
+    SHEETS_BUCKET_BURST: float = 10
+    SHEETS_MAX_RETRIES: int = 5
+    SHEETS_BACKOFF_BASE_SECONDS: float = 1.0
+    SHEETS_BACKOFF_MAX_SECONDS: float = 32.0
+    # Concurrent writes (tool calls, batch appends) against one spreadsheet
+    SHEETS_MAX_CONCURRENT_WRITES_PER_SPREADSHEET: int = 4
+    # Write-behind appends: rows are journaled locally, acknowledged, and flushed to Sheets
+    # in the background (coalesced per worksheet, retried with backoff, replayed on restart)
+    SHEETS_WRITE_BEHIND_ENABLED: bool = False
+    SHEETS_WRITE_BEHIND_JOURNAL_PATH: str = "sheets_write_behind.sqlite3"
+    SHEETS_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS: float = 2.0
+    SHEETS_WRITE_BEHIND_BATCH_SIZE: int = 500
+    SHEETS_WRITE_BEHIND_MAX_BACKOFF_SECONDS: float = 300.0
+
+    # Window of every worksheet sampled when summarising a canvas schema
+    SCHEMA_PREVIEW_RANGE: str = "A1:Z50"
+
+    # Per-(user, spreadsheet) cache of the ownership check and schema summary
+    SCHEMA_CACHE_TTL_SECONDS: float = 300
+    SCHEMA_CACHE_MAX_SIZE: int = 1024
+
+    # Receipt image intake: longest edge kept for OCR, output encoding, worker pool size
+    # (0 for this web worker's share of the available CPUs) and kind ("thread", or
+    # "process" to keep decoding off the API process' GIL)
+    IMAGE_MAX_EDGE: int = 2048
+    IMAGE_FORMAT: str = "JPEG"
+    IMAGE_QUALITY: int = 85
+    IMAGE_WORKERS: int = 0
+    IMAGE_EXECUTOR: str = "thread"
+
+    # Duplicate-receipt detection: successful results are kept on disk for this long
+    RECEIPT_DEDUP_ENABLED: bool = True
+    RECEIPT_DEDUP_DB_PATH: str = "receipt_results.sqlite3"
+    RECEIPT_DEDUP_TTL_SECONDS: float = 7 * 24 * 3600
+
+    # Asynchronous receipt jobs: worker pool, queue bounds and result retention.
+    # RECEIPT_JOB_BACKEND is "memory" or a "module:Class" JobBackend shared between replicas.
+    RECEIPT_JOB_BACKEND: str = "memory"
+    RECEIPT_JOB_WORKERS: int = 4
+    RECEIPT_JOB_MAX_QUEUED: int = 200
+    RECEIPT_JOB_MAX_QUEUED_PER_USER: int = 50
+    RECEIPT_JOB_RESULT_TTL_SECONDS: float = 3600
+
+    # Gemini context caching of the system prompt + schema summary prefix: "gemini", "local" (stand-in) or "none".
+    # Below PROMPT_CACHE_MIN_CHARS (~Gemini's minimum cacheable token count) the prefix is sent inline.
+    PROMPT_CACHE_BACKEND: str = "gemini"
+    PROMPT_CACHE_TTL_SECONDS: float = 3600
+    PROMPT_CACHE_MIN_CHARS: int = 16000
+    PROMPT_CACHE_MAX_ENTRIES: int = 256
+
+    # Ask for worksheet + rows in one structured LLM call, falling back to the tool-calling agent
+    RECEIPT_FAST_PATH_ENABLED: bool = True
+
+    # Batch uploads: receipts per request and concurrent agent runs per batch
+    BATCH_MAX_RECEIPTS: int = 50
+    BATCH_EXTRACTION_CONCURRENCY: int = 8
+
+    # Logging: level, background (queue-backed) output, and per-event sampling of
+    # high-volume info events (event name -> fraction kept; warnings and errors are always kept)
+    LOG_LEVEL: str = "INFO"
+    LOG_QUEUE_ENABLED: bool = True
+    LOG_SAMPLE_RATES: Dict[str, float] = {
+        "Health check endpoint was called.": 0.01,
+        "Receipt image prepared": 0.1,
+        "Sheets call queued for quota": 0.1,
+    }
+
+    # Per-request tracing (trace ids, stage timings) and the Prometheus /metrics endpoint
+    METRICS_ENABLED: bool = True
+    # With several workers (prometheus_client's PROMETHEUS_MULTIPROC_DIR, set by python -m app.serve),
+    # how often each one publishes its component stats for the others' scrapes
+    METRICS_STATS_INTERVAL_SECONDS: float = 5
+
+    # Agent checkpointing: "bounded", "memory" (unbounded) or "none" for one-shot runs
+    AGENT_CHECKPOINTER: str = "bounded"
+    AGENT_CHECKPOINT_MAX_THREADS: int = 256
+    AGENT_CHECKPOINT_MAX_BYTES: int = 64 * 1024 * 1024
+    AGENT_CHECKPOINT_TTL_SECONDS: float = 900
+
+    # Serving profile (python -m app.serve): worker processes, 0 for one per available CPU.
+    # Process-wide budgets (the Sheets quotas) are split evenly between the workers.
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    WEB_WORKERS: int = 0
+    # On SIGTERM: how long to wait for open requests, then for queued and running receipt jobs
+    GRACEFUL_SHUTDOWN_SECONDS: int = 30
+
+def available_cpus(cgroup_cpu_max: str = "/sys/fs/cgroup/cpu.max") -> int:
+    """CPUs this process may use: its affinity mask, capped by a cgroup v2 CPU quota (containers)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError: # not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+    try:
+        with open(cgroup_cpu_max) as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+class LazySettings:
+    """
+    Stands in for the Settings instance and builds it on first attribute access,
+    so importing a module needs no environment; a missing variable is reported
+    when a value is first read (at the latest, during lifespan startup).
+    """
+    def __init__(self):
+        object.__setattr__(self, "_settings", None)
+
+    def load(self) -> Settings:
+        if self._settings is None:
+            object.__setattr__(self, "_settings", Settings())
+        return self._settings
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self.load(), name)
+
+# A single, globally accessible instance of the settings
+settings = LazySettings()
\ No newline at end of file
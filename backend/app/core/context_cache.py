@@ -0,0 +1,209 @@
+# app/core/context_cache.py
+import time
+import asyncio
+import hashlib
+import itertools
+import structlog
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+def summary_block(summary: str) -> str:
+    """How a schema summary is presented to the model, cached or inline."""
+    return f"--- SPREADSHEET SUMMARY ---\n{summary}\n---------------------------"
+
+def is_cached_content_error(error: Exception) -> bool:
+    """
+    Whether a request naming a `cached_content` failed because Gemini no longer
+    has it. The API answers NOT_FOUND or PERMISSION_DENIED for expired, deleted
+    and unknown prefixes; the chat model re-raises the SDK error from its own.
+    """
+    from google.api_core.exceptions import NotFound, PermissionDenied
+    from google.genai.errors import ClientError
+
+    while error is not None:
+        if isinstance(error, ClientError) and error.code in (403, 404):
+            return True
+        if isinstance(error, (NotFound, PermissionDenied)):
+            return True
+        error = error.__cause__
+    return False
+
+class ContextCacheBackend(ABC):
+    """Creates and deletes server-side prompt prefixes (system instruction + summary + tools)."""
+    @abstractmethod
+    async def create(self, system_instruction: str, summary: str, tools: Optional[Sequence[Any]], ttl_seconds: float) -> str:
+        """Registers the prefix and returns the name to pass as `cached_content`."""
+        pass
+
+    @abstractmethod
+    async def delete(self, name: str):
+        pass
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """
+    Gemini explicit context caching through langchain-google-genai's public
+    `create_context_cache`, which converts the tools the same way `bind_tools` does.
+    """
+    def __init__(self, llm):
+        self.llm = llm
+
+    async def create(self, system_instruction: str, summary: str, tools: Optional[Sequence[Any]], ttl_seconds: float) -> str:
+        from langchain_core.messages import HumanMessage, SystemMessage
+        from langchain_google_genai import create_context_cache
+
+        # The helper makes a blocking call
+        return await asyncio.to_thread(
+            create_context_cache,
+            self.llm,
+            [SystemMessage(content=system_instruction), HumanMessage(content=summary_block(summary))],
+            ttl=f"{int(ttl_seconds)}s",
+            tools=list(tools) if tools else None,
+        )
+
+    async def delete(self, name: str):
+        await self.llm.client.aio.caches.delete(name=name)
+
+class LocalContextCacheBackend(ContextCacheBackend):
+    """
+    In-process stand-in that only records what would be cached. The names it
+    returns mean nothing to Gemini: use it with a fake LLM (tests, benchmarks).
+    """
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+
+    async def create(self, system_instruction: str, summary: str, tools: Optional[Sequence[Any]], ttl_seconds: float) -> str:
+        name = f"cachedContents/local-{next(self._ids)}"
+        self.entries[name] = {"system_instruction": system_instruction, "summary": summary, "tools": tools}
+        return name
+
+    async def delete(self, name: str):
+        self.entries.pop(name, None)
+
+class PromptContextCache:
+    """
+    Hands out cached prompt prefixes keyed by (kind, summary fingerprint), so
+    repeat receipts against the same canvas send only the image and the short
+    per-receipt text. `kind` separates prefixes that differ in instructions or
+    tools (the agent loop and the structured fast path).
+
+    When a spreadsheet's summary changes its fingerprint changes with it: the
+    next request creates a fresh prefix. Stale and least recently used prefixes
+    are only forgotten, never deleted, since a run started earlier may still be
+    using them; the server drops them when their TTL runs out. Summaries
+    shorter than PROMPT_CACHE_MIN_CHARS are below Gemini's minimum cacheable
+    size and are sent inline; so are all requests while a create is failing.
+    """
+    def __init__(
+        self,
+        backend: ContextCacheBackend,
+        ttl_seconds: float = None,
+        min_chars: int = None,
+        max_entries: int = None,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds or settings.PROMPT_CACHE_TTL_SECONDS
+        self.min_chars = settings.PROMPT_CACHE_MIN_CHARS if min_chars is None else min_chars
+        self.max_entries = max_entries or settings.PROMPT_CACHE_MAX_ENTRIES
+        # (kind, fingerprint) -> (cache name or None after a failure, local expiry)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Optional[str], float]]" = OrderedDict()
+        # (kind, spreadsheet_id) -> fingerprint, least recently used first; capped like the entries
+        self._current: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._creating: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._hits = 0
+        self._creates = 0
+        self._failures = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def fingerprint(system_instruction: str, summary: str) -> str:
+        digest = hashlib.sha256(system_instruction.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(summary.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(
+        self, kind: str, spreadsheet_id: str, system_instruction: str, summary: str, tools: Optional[Sequence[Any]] = None
+    ) -> Optional[str]:
+        """The cached prefix name for this summary, creating it if needed; None means send the prefix inline."""
+        if len(summary) < self.min_chars:
+            return None
+
+        fingerprint = self.fingerprint(system_instruction, summary)
+        key = (kind, fingerprint)
+        previous = self._current.pop((kind, spreadsheet_id), None)
+        self._current[(kind, spreadsheet_id)] = fingerprint
+        while len(self._current) > self.max_entries:
+            self._current.popitem(last=False)
+        if previous is not None and previous != fingerprint and previous not in self._fingerprints(kind):
+            # The summary was refreshed: its old prefix will never be asked for again
+            self._entries.pop((kind, previous), None)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            if entry[0] is not None:
+                self._hits += 1
+            return entry[0]
+
+        task = self._creating.get(key)
+        if task is None:
+            task = self._creating[key] = asyncio.create_task(self._create(key, system_instruction, summary, tools))
+        return await asyncio.shield(task)
+
+    def _fingerprints(self, kind: str) -> List[str]:
+        return [fingerprint for (entry_kind, _), fingerprint in self._current.items() if entry_kind == kind]
+
+    async def _create(self, key: Tuple[str, str], system_instruction: str, summary: str, tools: Optional[Sequence[Any]]) -> Optional[str]:
+        try:
+            name = await self.backend.create(system_instruction, summary, tools, self.ttl_seconds)
+            self._creates += 1
+            # Stop handing the prefix out a minute before the server drops it
+            self._store(key, name, time.monotonic() + max(self.ttl_seconds - 60, self.ttl_seconds / 2))
+            await log.ainfo("Prompt prefix cached", kind=key[0], summary_chars=len(summary))
+            return name
+        except Exception as e:
+            self._failures += 1
+            # Send prefixes inline for a while rather than retrying the create on every receipt
+            self._store(key, None, time.monotonic() + min(300, self.ttl_seconds))
+            await log.awarning("Prompt prefix caching failed, sending it inline", kind=key[0], error=str(e))
+            return None
+        finally:
+            self._creating.pop(key, None)
+
+    def _store(self, key: Tuple[str, str], name: Optional[str], expires_at: float):
+        self._entries.pop(key, None)
+        self._entries[key] = (name, expires_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, name: str):
+        """Forgets a prefix Gemini rejected, so the next request creates a new one."""
+        for key in [key for key, (entry_name, _) in self._entries.items() if entry_name == name]:
+            del self._entries[key]
+        self._invalidations += 1
+
+    async def close(self):
+        """At shutdown, once no run is left: deletes the prefixes still handed out."""
+        names = [name for name, _ in self._entries.values() if name is not None]
+        self._entries.clear()
+        await asyncio.gather(*(self.backend.delete(name) for name in names), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self._hits, "creates": self._creates, "failures": self._failures, "invalidations": self._invalidations}
+
+def build_prompt_cache(llm=None) -> Optional[PromptContextCache]:
+    """PROMPT_CACHE_BACKEND: "gemini" (needs the chat model whose client to use), "local" or "none"."""
+    backend = settings.PROMPT_CACHE_BACKEND.lower()
+    if backend == "none":
+        return None
+    if backend == "local":
+        return PromptContextCache(LocalContextCacheBackend())
+    if backend == "gemini":
+        return PromptContextCache(GeminiContextCacheBackend(llm))
+    raise ValueError(f"Unknown PROMPT_CACHE_BACKEND: {settings.PROMPT_CACHE_BACKEND}")
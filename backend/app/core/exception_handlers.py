@@ -9,14 +9,40 @@ from pydantic import ValidationError
 log = structlog.get_logger()
 
 class AgentLogicError(Exception):
-    """Raised when the agent completes its run but fails at its task."""
-    pass
+    """
+    Raised when the agent completes its run but fails at its task. `retryable`
+    is True only when the same request may succeed later (Sheets rate limits,
+    outages); anything else will fail the same way again.
+    """
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+class QueueFullError(Exception):
+    """Raised when the receipt job queue (or a user's share of it) is full."""
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 async def agent_logic_error_handler(request: Request, exc: AgentLogicError):
-    await log.awarning("Agent logic error", detail=str(exc))
+    await log.awarning("Agent logic error", detail=str(exc), retryable=exc.retryable)
+    if exc.retryable:
+        return JSONResponse(
+            status_code=503, # Service Unavailable: worth retrying later
+            content={"status": "error", "message": str(exc), "retryable": True},
+            headers={"Retry-After": "30"}
+        )
     return JSONResponse(
         status_code=400, # Bad Request
-        content={"status": "error", "message": str(exc)}
+        content={"status": "error", "message": str(exc), "retryable": False}
+    )
+
+async def queue_full_error_handler(request: Request, exc: QueueFullError):
+    await log.awarning("Receipt job queue full", detail=str(exc))
+    return JSONResponse(
+        status_code=429, # Too Many Requests (backpressure)
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
     )
 
 async def value_error_handler(request: Request, exc: ValueError):
@@ -41,10 +67,28 @@ async def worksheet_not_found_handler(request: Request, exc: WorksheetNotFound):
     )
 
 async def gspread_api_error_handler(request: Request, exc: APIError):
-    await log.aerror("GSpread API error", detail=str(exc))
+    # Rate-limited and server errors were already retried with backoff; what reaches here is final
+    status_code = exc.response.status_code
+    await log.aerror("GSpread API error", detail=str(exc), google_status=status_code)
+    if status_code == 429:
+        return JSONResponse(
+            status_code=429, # Too Many Requests (quota still exhausted after retries)
+            content={"status": "error", "message": "Google Sheets is rate limiting requests for this account. Please try again in a minute."},
+            headers={"Retry-After": "60"}
+        )
+    if status_code >= 500:
+        return JSONResponse(
+            status_code=503, # Service Unavailable
+            content={"status": "error", "message": "Google Sheets is temporarily unavailable. Please try again later."}
+        )
+    if status_code == 403:
+        return JSONResponse(
+            status_code=403, # Forbidden
+            content={"status": "error", "message": "Your Google account does not have access to this spreadsheet."}
+        )
     return JSONResponse(
-        status_code=429, # Too Many Requests (Rate Limiting)
-        content={"status": "error", "message": "An error occurred with the Google Sheets API, likely due to rate limiting. Please try again later."}
+        status_code=400, # Bad Request
+        content={"status": "error", "message": "Google Sheets rejected the request."}
     )
 
 async def validation_error_handler(request: Request, exc: ValidationError):
@@ -63,6 +107,7 @@ async def generic_exception_handler(request: Request, exc: Exception):
 
 def register_exception_handlers(app):
     app.add_exception_handler(AgentLogicError, agent_logic_error_handler)
+    app.add_exception_handler(QueueFullError, queue_full_error_handler)
     app.add_exception_handler(ValueError, value_error_handler)
     app.add_exception_handler(SpreadsheetNotFound, spreadsheet_not_found_handler)
     app.add_exception_handler(WorksheetNotFound, worksheet_not_found_handler)
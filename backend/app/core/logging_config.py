@@ -1,54 +1,148 @@
+import re
+import sys
+import json
+import queue
+import random
+import atexit
 import logging
+import logging.handlers
 import structlog
-import sys
+from typing import Dict, Iterable, Optional
 from app.core.config import settings
 
-def redact_sensitive_info(logger, name, event_dict):
+try:
+    import orjson
+except ImportError: # optional: the stdlib encoder is slower
+    orjson = None
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def make_redactor(secrets: Iterable[str]):
+    """
+    Structlog processor that redacts the given secrets from every string field.
+    The secrets are compiled once into a single alternation (longest first, so
+    a secret containing another is replaced whole); a field is only rewritten
+    when the pattern actually matches.
+    """
+    secrets = sorted({secret for secret in secrets if secret}, key=len, reverse=True)
+    pattern = re.compile("|".join(map(re.escape, secrets))) if secrets else None
+
+    def redact_sensitive_info(logger, name, event_dict):
+        if pattern is None:
+            return event_dict
+        for key, value in event_dict.items():
+            if isinstance(value, str) and pattern.search(value):
+                event_dict[key] = pattern.sub("[REDACTED]", value)
+        return event_dict
+
+    return redact_sensitive_info
+
+def make_sampler(rates: Dict[str, float]):
     """
-    Structlog processor to redact all sensitive secrets from logs.
+    Structlog processor keeping only a fraction of high-volume events, by event
+    name (LOG_SAMPLE_RATES). Warnings and errors are never dropped; kept events
+    carry their `sample_rate` so counts can be scaled back up.
     """
-    # Define values that should never appear in logs
-    sensitive_values = [
-        settings.SUPABASE_SERVICE_ROLE_KEY,
-        settings.SUPABASE_JWT_SECRET,
-        settings.PGCRYPTO_SECRET_KEY,
-        settings.GOOGLE_CLIENT_SECRET,
-        settings.GOOGLE_API_KEY,
-        settings.LANGCHAIN_API_KEY,
-    ]
+    def sample_events(logger, name, event_dict):
+        rate = rates.get(event_dict.get("event"))
+        if rate is None or rate >= 1 or name in ("warning", "error", "exception", "critical"):
+            return event_dict
+        if random.random() >= rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+    return sample_events
 
-    # Filter out None values in case some settings are optional
-    sensitive_values = [v for v in sensitive_values if v is not None]
+def _serializer():
+    if orjson is None:
+        return json.dumps
 
-    for key, value in event_dict.items():
-        if isinstance(value, str):
-            for sensitive in sensitive_values:
-                if sensitive in value:
-                    event_dict[key] = value.replace(sensitive, "[REDACTED]")
-    return event_dict
+    def dumps(event_dict, **kwargs):
+        try:
+            # orjson returns bytes; the stdlib logger wants str
+            return orjson.dumps(event_dict, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # What orjson refuses (e.g. ints wider than 64 bits) must not fail the log call
+            return json.dumps(event_dict, default=str)
 
+    return dumps
+
+class QueuedBoundLogger(structlog.stdlib.BoundLogger):
+    """
+    With output going through a queue, a log call never blocks on I/O, so the
+    async methods (`ainfo`, ...) log inline instead of hopping to a thread pool.
+    """
+    async def _dispatch_to_sync(self, meth, event, args, kw):
+        meth(event, *args, **kw)
 
 def setup_logging():
     """
-    Configures structlog for structured, JSON-based logging.
+    Configures structlog for structured, JSON-based logging. With LOG_QUEUE_ENABLED
+    the rendered lines are handed to a background thread that writes them to
+    stdout, so the event loop never waits on the stream.
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(message)s",
-        stream=sys.stdout,
-    )
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    if settings.LOG_QUEUE_ENABLED:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    else:
+        root.addHandler(stream_handler)
 
     structlog.configure(
         processors=[
+            # Cheap level filtering and sampling first: dropped events skip everything else
+            structlog.stdlib.filter_by_level,
+            make_sampler(settings.LOG_SAMPLE_RATES),
+            # Request-scoped context such as the trace id
+            structlog.contextvars.merge_contextvars,
             structlog.stdlib.add_log_level,
             structlog.stdlib.add_logger_name,
-            redact_sensitive_info,
+            make_redactor([
+                settings.SUPABASE_SERVICE_ROLE_KEY,
+                settings.SUPABASE_JWT_SECRET,
+                settings.PGCRYPTO_SECRET_KEY,
+                settings.GOOGLE_CLIENT_SECRET,
+                settings.GOOGLE_API_KEY,
+                settings.LANGCHAIN_API_KEY,
+            ]),
             structlog.processors.TimeStamper(fmt="iso"),
             structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
-            structlog.processors.JSONRenderer(),
+            structlog.processors.JSONRenderer(serializer=_serializer()),
         ],
         logger_factory=structlog.stdlib.LoggerFactory(),
-        wrapper_class=structlog.stdlib.BoundLogger,
+        wrapper_class=QueuedBoundLogger if settings.LOG_QUEUE_ENABLED else structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
-    )
\ No newline at end of file
+    )
+
+def shutdown_logging():
+    """
+    Flushes and stops the background writer; anything logged afterwards is
+    written directly. Safe to call more than once.
+    """
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
@@ -0,0 +1,171 @@
+# app/core/metrics.py
+import os
+import re
+import time
+import uuid
+import asyncio
+import contextvars
+import structlog
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+# Caller-supplied request ids are logged and echoed back: only short, plain ones are kept
+_REQUEST_ID = re.compile(r"[A-Za-z0-9-]{1,64}")
+
+# Stage -> seconds spent in it during the current request; None outside a request
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stage_timings", default=None)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, until the response headers are sent.",
+    ("method", "route", "status"), buckets=_LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "receipt_stage_duration_seconds", "Time spent in each stage of receipt processing.",
+    ("stage",), buckets=_LATENCY_BUCKETS,
+)
+# Exposed as llm_tokens_total
+LLM_TOKENS = Counter(
+    "llm_tokens", "Gemini tokens by call and direction (cached = input tokens served from a context cache).",
+    ("call", "kind"),
+)
+IMAGE_BYTES = Histogram(
+    "receipt_image_bytes", "Receipt image size as uploaded and after preparation.",
+    ("phase",), buckets=(50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000),
+)
+# With several workers each reports its own values (labelled by pid) while it is alive
+COMPONENT_STATS = Gauge(
+    "app_component_stat", "Retention and queue metrics of the shared, long-lived objects.",
+    ("component", "stat"), multiprocess_mode="liveall",
+)
+
+def multiprocess_dir() -> Optional[str]:
+    """Set (by python -m app.serve) when several workers share their metrics through files."""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Times a stage of the current request: observed in STAGE_SECONDS and added
+    to the request's timings, which are logged with its trace id when it ends.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            # Concurrent spans (e.g. parallel tool calls) add up, like CPU time
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def record_llm_usage(call: str, message: Any):
+    """Adds a model response's token usage (if the provider reported it) to LLM_TOKENS."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.labels(call=call, kind="input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(call=call, kind="output").inc(usage.get("output_tokens", 0))
+    cached = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached:
+        LLM_TOKENS.labels(call=call, kind="cached").inc(cached)
+
+def _flatten(prefix: str, value: Any, into: List[Tuple[str, float]]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, into)
+    elif isinstance(value, (int, float)):
+        into.append((prefix, float(value)))
+
+def record_component_stats(component_stats: Dict[str, Any]):
+    """Sets COMPONENT_STATS from the registry's stats; non-numeric values are skipped."""
+    for component, stats in component_stats.items():
+        flat: List[Tuple[str, float]] = []
+        _flatten("", stats, flat)
+        for stat, value in flat:
+            COMPONENT_STATS.labels(component=component, stat=stat).set(value)
+
+def render() -> bytes:
+    """The text exposition of every metric; with several workers, of all of them (read from their files)."""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+class ComponentStatsPublisher:
+    """
+    With several workers a scrape reaches only one of them, which cannot ask
+    the others for their stats. Each worker therefore copies its own into
+    COMPONENT_STATS every METRICS_STATS_INTERVAL_SECONDS, and prometheus_client
+    shares the values through the multiprocess directory.
+    """
+    def __init__(self, component_stats: Callable[[], Dict[str, Any]], interval: float):
+        self.component_stats, self.interval = component_stats, interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                record_component_stats(self.component_stats())
+            except Exception as e:
+                await log.awarning("Could not publish the component stats", error=str(e))
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if multiprocess_dir():
+            # Drops this worker's live gauges; its counters and histograms still add up
+            multiprocess.mark_process_dead(os.getpid())
+
+def register_request_tracing(app):
+    """
+    Gives every request a trace id (the caller's X-Request-ID if it is short
+    and plain, or a new one) bound into the structlog context and echoed back,
+    records its latency, and logs one line per request with the time spent in
+    each stage.
+    A pass-through when METRICS_ENABLED is off.
+    """
+    @app.middleware("http")
+    async def trace_request(request, call_next):
+        if not settings.METRICS_ENABLED:
+            return await call_next(request)
+        trace_id = request.headers.get("x-request-id", "")
+        if not _REQUEST_ID.fullmatch(trace_id):
+            trace_id = uuid.uuid4().hex
+        structlog.contextvars.clear_contextvars()
+        structlog.contextvars.bind_contextvars(trace_id=trace_id)
+        timings: Dict[str, float] = {}
+        token = _stage_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Request-ID"] = trace_id
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(method=request.method, route=route, status=status).observe(elapsed)
+            if route != "/metrics":
+                await log.ainfo(
+                    "Request finished", method=request.method, route=route, status=status,
+                    duration_ms=round(elapsed * 1000, 1),
+                    stages_ms={stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+                )
+            _stage_timings.reset(token)
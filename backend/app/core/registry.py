@@ -0,0 +1,348 @@
+# app/core/registry.py
+import asyncio
+import threading
+import structlog
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+class AppRegistry:
+    """
+    Process-wide home for the objects that are expensive to build: the compiled
+    agent graph (with its tool-bound LLM), the summary LLM, the Supabase client
+    and the services wrapping them. Everything is built once, during the
+    application lifespan, and shared by all requests.
+
+    The SDKs behind them (LangChain, Gemini, Supabase, gspread, Pillow) are
+    imported by the properties that need them, so importing the app is cheap.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._supabase = None
+        self._repository = None
+        self._user_cache = None
+        self._gspread_pool = None
+        self._worksheet_cache = None
+        self._schema_cache = None
+        self._image_intake = None
+        self._result_cache = None
+        self._job_runner = None
+        self._sheets_writer = None
+        self._write_behind = None
+        self._prompt_cache = None
+        self._prompt_cache_built = False
+        self._receipt_agent = None
+        self._summary_llm = None
+        self._receipt_service = None
+        self._spreadsheet_service = None
+        self._user_service = None
+        self._warm_up_task: asyncio.Task = None
+        # Set when a background warm-up failed; the health check reports it
+        self.startup_error: Exception = None
+        self._recovery_lock = asyncio.Lock()
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            from supabase import create_client
+            with self._lock:
+                if self._supabase is None:
+                    self._supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+        return self._supabase
+
+    @property
+    def repository(self):
+        if self._repository is None:
+            from app.repositories.supabase_repository import SupabaseRepository
+            supabase = self.supabase
+            with self._lock:
+                if self._repository is None:
+                    self._repository = SupabaseRepository(client=supabase)
+        return self._repository
+
+    @property
+    def user_cache(self):
+        if self._user_cache is None:
+            from app.core.user_cache import AuthenticatedUserCache
+            with self._lock:
+                if self._user_cache is None:
+                    self._user_cache = AuthenticatedUserCache()
+        return self._user_cache
+
+    @property
+    def gspread_pool(self):
+        if self._gspread_pool is None:
+            from app.tools.gspread_client_pool import GspreadClientPool
+            with self._lock:
+                if self._gspread_pool is None:
+                    self._gspread_pool = GspreadClientPool()
+        return self._gspread_pool
+
+    @property
+    def worksheet_cache(self):
+        if self._worksheet_cache is None:
+            from app.tools.gspread_handle_cache import WorksheetHandleCache
+            with self._lock:
+                if self._worksheet_cache is None:
+                    self._worksheet_cache = WorksheetHandleCache()
+        return self._worksheet_cache
+
+    @property
+    def schema_cache(self):
+        if self._schema_cache is None:
+            from app.services.schema_summary_cache import SchemaSummaryCache
+            with self._lock:
+                if self._schema_cache is None:
+                    self._schema_cache = SchemaSummaryCache()
+        return self._schema_cache
+
+    @property
+    def image_intake(self):
+        if self._image_intake is None:
+            from app.services.image_intake import ImageIntake
+            with self._lock:
+                if self._image_intake is None:
+                    self._image_intake = ImageIntake()
+        return self._image_intake
+
+    @property
+    def result_cache(self):
+        if self._result_cache is None and settings.RECEIPT_DEDUP_ENABLED:
+            from app.services.receipt_result_cache import ReceiptResultCache
+            with self._lock:
+                if self._result_cache is None:
+                    self._result_cache = ReceiptResultCache()
+        return self._result_cache
+
+    @property
+    def sheets_writer(self):
+        if self._sheets_writer is None:
+            from app.tools.gspread_writer import SheetsWriter
+            gspread_pool, worksheet_cache = self.gspread_pool, self.worksheet_cache
+            with self._lock:
+                if self._sheets_writer is None:
+                    self._sheets_writer = SheetsWriter(gspread_pool=gspread_pool, worksheet_cache=worksheet_cache)
+        return self._sheets_writer
+
+    @property
+    def write_behind(self):
+        if self._write_behind is None and settings.SHEETS_WRITE_BEHIND_ENABLED:
+            from app.tools.sheets_write_behind import WriteBehindAppender
+            sheets_writer, repository = self.sheets_writer, self.repository
+            with self._lock:
+                if self._write_behind is None:
+                    self._write_behind = WriteBehindAppender(sheets_writer=sheets_writer, repository=repository)
+        return self._write_behind
+
+    @property
+    def receipt_agent(self):
+        if self._receipt_agent is None:
+            # Imported here to avoid a circular import (agent -> tools -> config)
+            from app.agent import ReceiptAgent
+            gspread_pool, worksheet_cache = self.gspread_pool, self.worksheet_cache
+            sheets_writer, write_behind = self.sheets_writer, self.write_behind
+            with self._lock:
+                if self._receipt_agent is None:
+                    self._receipt_agent = ReceiptAgent(
+                        gspread_pool=gspread_pool, worksheet_cache=worksheet_cache,
+                        sheets_writer=sheets_writer, write_behind=write_behind,
+                    )
+        return self._receipt_agent
+
+    @property
+    def prompt_cache(self):
+        if not self._prompt_cache_built:
+            from app.core.context_cache import build_prompt_cache
+            llm = self.receipt_agent.llm
+            with self._lock:
+                if not self._prompt_cache_built:
+                    # None when PROMPT_CACHE_BACKEND is "none"
+                    self._prompt_cache = build_prompt_cache(llm)
+                    self._prompt_cache_built = True
+        return self._prompt_cache
+
+    @property
+    def agent_graph(self):
+        return self.receipt_agent.get_agent()
+
+    @property
+    def summary_llm(self):
+        if self._summary_llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            with self._lock:
+                if self._summary_llm is None:
+                    self._summary_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=settings.GOOGLE_API_KEY)
+        return self._summary_llm
+
+    @property
+    def receipt_service(self):
+        if self._receipt_service is None:
+            from app.services.receipt_service import ReceiptService
+            agent_graph, repository, schema_cache, result_cache = self.agent_graph, self.repository, self.schema_cache, self.result_cache
+            sheets_writer = self.sheets_writer
+            extractor = self.receipt_agent if settings.RECEIPT_FAST_PATH_ENABLED else None
+            prompt_cache, write_behind = self.prompt_cache, self.write_behind
+            with self._lock:
+                if self._receipt_service is None:
+                    self._receipt_service = ReceiptService(
+                        agent_runnable=agent_graph, repository=repository, schema_cache=schema_cache,
+                        result_cache=result_cache, sheets_writer=sheets_writer, extractor=extractor,
+                        prompt_cache=prompt_cache, write_behind=write_behind,
+                    )
+        return self._receipt_service
+
+    @property
+    def spreadsheet_service(self):
+        if self._spreadsheet_service is None:
+            from app.services.spreadsheet_service import SpreadsheetService
+            repository, llm, gspread_pool, schema_cache = self.repository, self.summary_llm, self.gspread_pool, self.schema_cache
+            with self._lock:
+                if self._spreadsheet_service is None:
+                    self._spreadsheet_service = SpreadsheetService(
+                        repository=repository, llm=llm, gspread_pool=gspread_pool, schema_cache=schema_cache
+                    )
+        return self._spreadsheet_service
+
+    @property
+    def user_service(self):
+        if self._user_service is None:
+            from app.services.user_service import UserService
+            repository, user_cache = self.repository, self.user_cache
+            with self._lock:
+                if self._user_service is None:
+                    self._user_service = UserService(repository=repository, user_cache=user_cache)
+        return self._user_service
+
+    @property
+    def job_runner(self):
+        if self._job_runner is None:
+            from app.services.receipt_jobs import ReceiptJobRunner
+            receipt_service, repository = self.receipt_service, self.repository
+            with self._lock:
+                if self._job_runner is None:
+                    self._job_runner = ReceiptJobRunner(receipt_service, repository)
+        return self._job_runner
+
+    def stats(self) -> dict:
+        """Retention metrics for the shared, long-lived objects."""
+        stats = {}
+        checkpointer = self._receipt_agent.checkpointer if self._receipt_agent else None
+        if hasattr(checkpointer, "stats"):
+            stats["checkpointer"] = checkpointer.stats()
+        if self._user_cache is not None:
+            stats["user_cache"] = self._user_cache.stats()
+        if self._gspread_pool is not None:
+            stats["gspread_pool"] = self._gspread_pool.stats()
+            stats["sheets_scheduler"] = self._gspread_pool.scheduler.stats()
+        if self._worksheet_cache is not None:
+            stats["worksheet_cache"] = self._worksheet_cache.stats()
+        if self._schema_cache is not None:
+            stats["schema_cache"] = self._schema_cache.stats()
+        if self._result_cache is not None:
+            stats["receipt_results"] = self._result_cache.stats()
+        if self._job_runner is not None:
+            stats["receipt_jobs"] = self._job_runner.stats()
+        if self._prompt_cache is not None:
+            stats["prompt_cache"] = self._prompt_cache.stats()
+        if self._write_behind is not None:
+            stats["sheets_write_behind"] = self._write_behind.stats()
+        return stats
+
+    def startup(self):
+        """Builds every shared object up front so no request pays for it."""
+        self.receipt_service
+        self.spreadsheet_service
+        self.user_service
+        self.image_intake
+        self.job_runner
+        self.write_behind
+        log.info("Application registry built.")
+
+    async def warm_up(self):
+        """
+        Primes the connections behind the shared clients so the first request
+        does not pay for DNS, TLS handshakes or lazy client initialisation.
+        Failures are logged, never raised: a cold dependency must not block startup.
+        """
+        self.startup()
+        await self._prime()
+
+    async def _prime(self):
+        try:
+            await self.repository.ping()
+        except Exception as e:
+            await log.awarning("Supabase warm-up failed", error=str(e))
+
+        # Rendering the graph walks every node once, catching wiring errors at startup
+        self.agent_graph.get_graph()
+        await log.ainfo("Application registry warmed up.")
+
+    def start_warm_up(self, prime: bool = True):
+        """
+        Builds the registry (and, with `prime`, warms it up) in the background,
+        then starts the background workers. The imports and graph compilation
+        run in a thread, so the event loop keeps answering health checks meanwhile.
+        """
+        async def build():
+            try:
+                await asyncio.to_thread(self.startup)
+                if prime:
+                    await self._prime()
+                self.start_background()
+            except Exception as e:
+                # `ready` retries the build on the next request that needs it
+                self.startup_error = e
+                await log.aexception("Background warm-up failed")
+        self._warm_up_task = asyncio.get_running_loop().create_task(build())
+
+    async def _warm_up_finished(self):
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            await asyncio.shield(self._warm_up_task)
+
+    async def ready(self):
+        """
+        Waits for a background warm-up, if one is still running. After a failed
+        one, retries the build: the first success starts the background workers
+        and clears `startup_error`; a failure is raised to the caller.
+        """
+        await self._warm_up_finished()
+        if self.startup_error is None:
+            return
+        async with self._recovery_lock:
+            if self.startup_error is None:
+                return
+            await asyncio.to_thread(self.startup)
+            self.start_background()
+            self.startup_error = None
+            await log.ainfo("Application registry recovered from a failed warm-up.")
+
+    def start_background(self):
+        """Starts the job workers and, in write-behind mode, the Sheets flusher (which replays the journal)."""
+        self.job_runner.start()
+        if self.write_behind is not None:
+            self.write_behind.start()
+
+    async def shutdown(self):
+        # Let a warm-up still in progress finish, so there is a consistent state to close
+        await self._warm_up_finished()
+        await log.ainfo("Application registry shutting down.", **self.stats())
+        if self._job_runner is not None:
+            await self._job_runner.stop()
+        if self._write_behind is not None:
+            # Last chance to flush; whatever is left is replayed by the next process
+            await self._write_behind.stop()
+            self._write_behind.close()
+        if self._repository is not None:
+            self._repository.close()
+        if self._image_intake is not None:
+            self._image_intake.close()
+        if self._result_cache is not None:
+            self._result_cache.close()
+        if self._prompt_cache is not None:
+            # Cached prefixes are billed for storage until their TTL runs out
+            await self._prompt_cache.close()
+
+
+# Create a single, globally accessible registry
+registry = AppRegistry()
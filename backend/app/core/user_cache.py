@@ -0,0 +1,65 @@
+# app/core/user_cache.py
+import time
+import uuid
+import hashlib
+import jwt
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.schemas import User
+
+def verify_access_token(token: str) -> Dict[str, Any]:
+    """
+    Verifies a Supabase access token locally against SUPABASE_JWT_SECRET and
+    returns its claims. Raises jwt.InvalidTokenError if it is invalid or expired.
+    """
+    return jwt.decode(
+        token,
+        settings.SUPABASE_JWT_SECRET,
+        algorithms=["HS256"],
+        audience="authenticated",
+        options={"require": ["sub", "exp"]},
+    )
+
+def _token_expiry(token: str) -> Optional[float]:
+    """Reads the `exp` claim without verifying the token, so a cache entry never outlives it."""
+    try:
+        return jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        return None
+
+class AuthenticatedUserCache:
+    """
+    TTL + LRU cache of authenticated users, keyed by a hash of the bearer token
+    so raw tokens are never kept in memory. An entry lives for at most
+    AUTH_CACHE_TTL_SECONDS and never past the token's own expiry.
+    """
+    def __init__(self, max_size: int = None, ttl_seconds: float = None):
+        self._cache = TTLCache(
+            max_size=max_size or settings.AUTH_CACHE_MAX_SIZE,
+            ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds,
+        )
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        return self._cache.get(self._key(token))
+
+    def set(self, token: str, user: User, expires_at: Optional[float] = None):
+        if expires_at is None:
+            expires_at = _token_expiry(token)
+        ttl = None if expires_at is None else expires_at - time.time()
+        self._cache.set(self._key(token), user, ttl_seconds=ttl)
+
+    def invalidate_user(self, auth_id: uuid.UUID) -> int:
+        """Drops every cached session of a user, e.g. after their profile changed."""
+        return self._cache.invalidate_where(lambda user: user.auth_id == auth_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
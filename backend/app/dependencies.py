@@ -1,14 +1,16 @@
 # app/dependencies.py
+import jwt
+import structlog
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer
-from supabase import create_client, Client
-from gotrue.errors import AuthApiError
 
 from app.core.config import settings
+from app.core.metrics import span
+from app.core.registry import registry
+from app.core.user_cache import verify_access_token
 from app.schemas import User
 
-# Initialize Supabase client for backend operations
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+log = structlog.get_logger()
 
 # Reusable bearer scheme
 token_auth_scheme = HTTPBearer()
@@ -16,29 +18,53 @@ token_auth_scheme = HTTPBearer()
 async def get_current_user(token: str = Depends(token_auth_scheme)) -> User:
     """
     Validates JWT and retrieves the user profile with the Google token decrypted.
+    Recently seen tokens are served from the authenticated-user cache.
     """
+    with span("auth"):
+        return await _authenticate(token)
 
-    print("\n--- AUTHENTICATION DEBUG ---")
-    print(f"VERIFYING TOKEN... (ends with: ...{token.credentials[-6:]})")
-    print(f"USING SECRET KEY... (ends with: ...{settings.SUPABASE_JWT_SECRET[-6:]})")
+async def _authenticate(token) -> User:
 
+    claims = None
+    if settings.AUTH_VERIFY_JWT_LOCALLY:
+        try:
+            claims = verify_access_token(token.credentials)
+        except jwt.InvalidTokenError as e:
+            raise HTTPException(status_code=401, detail=f"Token validation failed: {e}")
+
+    # The user cache and repository may still be loading in a background warm-up
+    await registry.ready()
+    user_cache = registry.user_cache
+    cached_user = user_cache.get(token.credentials)
+    if cached_user is not None:
+        return cached_user
+
+    repository = registry.repository
     try:
-        auth_user = supabase.auth.get_user(jwt=token.credentials).user
-        if not auth_user:
-            raise HTTPException(status_code=401, detail="Token is invalid or expired.")
-        
-        response = supabase.rpc('get_decrypted_user_by_auth_id', {'user_auth_id_input': str(auth_user.id)}).single().execute()
+        if claims is not None:
+            # The signature was already verified locally; skip the remote validation
+            auth_id = claims["sub"]
+        else:
+            auth_user = await repository.get_auth_user(token.credentials)
+            if not auth_user:
+                raise HTTPException(status_code=401, detail="Token is invalid or expired.")
+            auth_id = auth_user.id
         
-        user_data = response.data
+        user_data = await repository.get_decrypted_user(auth_id)
         if not user_data:
              raise HTTPException(status_code=404, detail="User profile not found in our database.")
 
-        return User(**user_data)
+        user = User(**user_data)
+        user_cache.set(token.credentials, user, expires_at=claims["exp"] if claims else None)
+        return user
 
-    except AuthApiError as e:
-        # THIS IS THE CRITICAL ERROR MESSAGE WE NEED TO SEE
-        print(f"!!! AUTHENTICATION FAILED. Reason: {e.message} !!!")
-        raise HTTPException(status_code=401, detail=f"Token validation failed: {e.message}")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        # gotrue ships with the Supabase client, which the repository call above has loaded
+        from gotrue.errors import AuthApiError
+        if isinstance(e, AuthApiError):
+            await log.awarning("Authentication failed", reason=e.message)
+            raise HTTPException(status_code=401, detail=f"Token validation failed: {e.message}")
+        await log.aexception("Unexpected error while authenticating")
         raise HTTPException(status_code=500, detail="Could not validate credentials")
\ No newline at end of file
@@ -5,50 +5,121 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import necessary modules
-import io
-import magic
-from PIL import Image
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+import json
+import asyncio
 import structlog
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict
 
-# Import application-specific modules
-from app.services.spreadsheet_service import SpreadsheetService
+# Import application-specific modules. The services are only named in type hints
+# here: the registry imports them (and the SDKs behind them) when it builds them.
 from app.core.config import settings
-from app.core.logging_config import setup_logging
+from app.core.registry import registry
+from app.core.logging_config import setup_logging, shutdown_logging
+from app.core import metrics
 from app.core.exception_handlers import register_exception_handlers
-from app.schemas import AgentResponse, User 
-from app.services.receipt_service import ReceiptService, IReceiptService
+from app.schemas import AgentResponse, BatchReceiptResponse, ReceiptJob, User 
+from app.services.image_intake import ImageIntake, InvalidImageError
+from app.services.receipt_jobs import ReceiptJobRunner
 from app.dependencies import get_current_user
 
-from app.services.user_service import UserService
-# Setup
-setup_logging()
-app = FastAPI(title="ReceiptAgent API", version="1.0.0")
-register_exception_handlers(app)
+if TYPE_CHECKING:
+    from app.services.receipt_service import ReceiptService, IReceiptService
+    from app.services.spreadsheet_service import SpreadsheetService
+    from app.services.user_service import UserService
+
 log = structlog.get_logger()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Settings are loaded (and validated) here at the latest
+    setup_logging()
+    app.state.registry = registry
+    publisher = None
+    if settings.METRICS_ENABLED and metrics.multiprocess_dir():
+        # Other workers' scrapes see this one's stats only through the shared metric files
+        publisher = metrics.ComponentStatsPublisher(registry.stats, settings.METRICS_STATS_INTERVAL_SECONDS)
+        publisher.start()
+    if settings.WARM_UP_IN_BACKGROUND:
+        # Serve health checks right away; requests needing the agent wait in their dependencies
+        registry.start_warm_up(prime=settings.WARM_UP_ON_STARTUP)
+    else:
+        # Build the agent graph, LLMs and clients once per process, before serving traffic
+        if settings.WARM_UP_ON_STARTUP:
+            await registry.warm_up()
+        else:
+            registry.startup()
+        registry.start_background()
+    yield
+    await registry.shutdown()
+    if publisher is not None:
+        await publisher.stop()
+    shutdown_logging()
+
+def cors_middleware(app):
+    # Built when the app first starts, so the settings are not read at import time
+    return CORSMiddleware(
+        app,
+        allow_origins=[settings.FRONTEND_URL],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+app = FastAPI(title="ReceiptAgent API", version="1.0.0", lifespan=lifespan)
+register_exception_handlers(app)
+metrics.register_request_tracing(app)
+
 # Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[settings.FRONTEND_URL],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(cors_middleware)
+
+# Dependencies injection. Each waits for a background warm-up still in progress.
+async def get_receipt_service() -> "ReceiptService":
+    await registry.ready()
+    return registry.receipt_service
 
-# Dependencies injection
-def get_receipt_service():
-    return ReceiptService()
+async def get_spreadsheet_service() -> "SpreadsheetService":
+    await registry.ready()
+    return registry.spreadsheet_service
+
+async def get_user_service() -> "UserService":
+    await registry.ready()
+    return registry.user_service
+
+async def get_image_intake() -> ImageIntake:
+    await registry.ready()
+    return registry.image_intake
+
+async def get_job_runner() -> ReceiptJobRunner:
+    await registry.ready()
+    return registry.job_runner
 
 # Health Check Endpoint
 @app.get("/", tags=["Health Check"], summary="Health Check")
 async def read_root():
     await log.ainfo("Health check endpoint was called.")
+    if registry.startup_error is not None:
+        try:
+            # A dependency that was down during warm-up may be back
+            await registry.ready()
+        except Exception:
+            raise HTTPException(status_code=503, detail="Startup failed; see the logs.")
     return {"status": "ok"}
 
+# Prometheus scrape target: request and stage latencies, token and image sizes, component stats
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # The stats are in-memory counters; rendering may read every worker's metric files
+    metrics.record_component_stats(registry.stats())
+    return Response(await asyncio.to_thread(metrics.render), media_type=CONTENT_TYPE_LATEST)
+
 class SpreadsheetRegistration(BaseModel):
     spreadsheet_id: str
     name: str
@@ -58,7 +129,7 @@ class SpreadsheetRegistration(BaseModel):
 async def register_spreadsheet_for_user(
     reg_data: SpreadsheetRegistration,
     current_user: User = Depends(get_current_user),
-    spreadsheet_service: SpreadsheetService = Depends(SpreadsheetService)
+    spreadsheet_service: "SpreadsheetService" = Depends(get_spreadsheet_service)
 ):
     """Registers a spreadsheet to the currently authenticated user."""
     return await spreadsheet_service.register_spreadsheet(reg_data.spreadsheet_id, reg_data.name, current_user)
@@ -68,7 +139,7 @@ async def register_spreadsheet_for_user(
 async def get_spreadsheet_worksheets(
     spreadsheet_id: str,
     current_user: User = Depends(get_current_user),
-    spreadsheet_service: SpreadsheetService = Depends(SpreadsheetService)
+    spreadsheet_service: "SpreadsheetService" = Depends(get_spreadsheet_service)
 ):
     """Returns a list of worksheet names for a given spreadsheet."""
     return await spreadsheet_service.get_worksheets(spreadsheet_id, current_user)
@@ -76,7 +147,7 @@ async def get_spreadsheet_worksheets(
 @app.get("/canvases", response_model=List[Dict], summary="Get all canvases for a user")
 async def get_user_canvases(
     current_user: User = Depends(get_current_user),
-    spreadsheet_service: SpreadsheetService = Depends(SpreadsheetService)
+    spreadsheet_service: "SpreadsheetService" = Depends(get_spreadsheet_service)
 ):
     """
     Retrieves a list of all canvases (spreadsheets) registered to the
@@ -88,7 +159,7 @@ async def get_user_canvases(
 async def refresh_canvas_schema(
     spreadsheet_id: str,
     current_user: User = Depends(get_current_user),
-    spreadsheet_service: SpreadsheetService = Depends(SpreadsheetService)
+    spreadsheet_service: "SpreadsheetService" = Depends(get_spreadsheet_service)
 ):
     """
     Triggers a background analysis of the specified spreadsheet to update
@@ -114,39 +185,164 @@ async def process_receipt(
     spreadsheet_id: str = Form(...),
     worksheet_name: str = Form(...),
     image: UploadFile = File(...),
-    receipt_service: IReceiptService = Depends(get_receipt_service),
+    receipt_service: "IReceiptService" = Depends(get_receipt_service),
+    image_intake: ImageIntake = Depends(get_image_intake),
     current_user: User = Depends(get_current_user)
 ):
-    # 1. File validation
+    # 1. Validate, orient, downscale and re-encode the upload off the event loop
     image_bytes = await image.read()
-    if not image_bytes:
-        # This will be caught by our custom exception middleware if we add a handler
-        # For now, HTTPException is fine.
-        raise HTTPException(status_code=400, detail="File is empty.")
-    
-    true_mime_type = magic.from_buffer(image_bytes, mime=True)
-    if not true_mime_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail=f"File not a valid image. Detected type: {true_mime_type}")
-
     try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            output_buffer = io.BytesIO()
-            img.save(output_buffer, format='PNG')
-            sanitized_image_bytes = output_buffer.getvalue()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid or corrupt image file: {e}")
+        prepared_image = await image_intake.prepare(image_bytes)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     #Delegate to the service layer
     response = await receipt_service.process_receipt(
         spreadsheet_id=spreadsheet_id,
-        image_bytes=sanitized_image_bytes,
-        image_content_type="image/png",
+        image_bytes=prepared_image.data,
+        image_content_type=prepared_image.content_type,
         # Pass the user object to the service
         current_user=current_user 
     )
     
     return response
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Same as /process-receipt, reporting progress as Server-Sent Events
+@app.post(
+    "/process-receipt/stream",
+    tags=["Agent"],
+    summary="Process a receipt, streaming progress events",
+    description="""
+    Same input as /process-receipt. Responds with a text/event-stream of
+    `accepted`, `token`, `extracted`, `tool_started` and `tool_finished` events,
+    ending with `result` (an AgentResponse) or `error`. Disconnecting cancels the run.
+    """
+)
+async def process_receipt_stream(
+    spreadsheet_id: str = Form(...),
+    worksheet_name: str = Form(...),
+    image: UploadFile = File(...),
+    receipt_service: "ReceiptService" = Depends(get_receipt_service),
+    image_intake: ImageIntake = Depends(get_image_intake),
+    current_user: User = Depends(get_current_user)
+):
+    image_bytes = await image.read()
+    try:
+        prepared_image = await image_intake.prepare(image_bytes)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Access checks happen here, before the 200 and the first event go out
+    events = await receipt_service.stream_receipt(
+        spreadsheet_id=spreadsheet_id,
+        image_bytes=prepared_image.data,
+        image_content_type=prepared_image.content_type,
+        current_user=current_user
+    )
+
+    async def event_stream():
+        try:
+            async for event, data in events:
+                yield _sse(event, data)
+        except asyncio.CancelledError:
+            await log.ainfo("Client disconnected, receipt run cancelled")
+            raise
+        except Exception:
+            await log.aexception("Streaming receipt run failed")
+            yield _sse("error", {"detail": "An unexpected internal server error occurred."})
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Process many receipts in one request, writing each worksheet once
+@app.post(
+    "/process-receipts",
+    response_model=BatchReceiptResponse,
+    tags=["Agent"],
+    summary="Process a batch of receipts and append them to Google Sheets",
+    description="""
+    Uploads several receipt images at once. Receipts are extracted concurrently,
+    then their rows are appended with one write per worksheet. Each receipt's
+    outcome is reported separately, in upload order.
+    """
+)
+async def process_receipt_batch(
+    spreadsheet_id: str = Form(...),
+    images: List[UploadFile] = File(...),
+    receipt_service: "ReceiptService" = Depends(get_receipt_service),
+    image_intake: ImageIntake = Depends(get_image_intake),
+    current_user: User = Depends(get_current_user)
+):
+    if len(images) > settings.BATCH_MAX_RECEIPTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_RECEIPTS} receipts per batch.")
+
+    async def prepare(image: UploadFile):
+        try:
+            return await image_intake.prepare(await image.read())
+        except InvalidImageError as e:
+            raise HTTPException(status_code=400, detail=f"{image.filename}: {e}")
+
+    prepared_images = await asyncio.gather(*(prepare(image) for image in images))
+    return await receipt_service.process_receipt_batch(
+        spreadsheet_id=spreadsheet_id,
+        images=[(prepared.data, prepared.content_type) for prepared in prepared_images],
+        current_user=current_user
+    )
+
+# Queue a receipt and return immediately
+@app.post(
+    "/receipt-jobs",
+    response_model=ReceiptJob,
+    status_code=202,
+    tags=["Agent"],
+    summary="Queue a receipt for processing",
+    description="""
+    Same input as /process-receipt, but returns a job id right away instead of
+    holding the connection for the agent run. Poll /receipt-jobs/{job_id} for the result.
+    Responds 429 with Retry-After when the queue is full.
+    """
+)
+async def submit_receipt_job(
+    spreadsheet_id: str = Form(...),
+    worksheet_name: str = Form(...),
+    image: UploadFile = File(...),
+    job_runner: ReceiptJobRunner = Depends(get_job_runner),
+    image_intake: ImageIntake = Depends(get_image_intake),
+    current_user: User = Depends(get_current_user)
+):
+    image_bytes = await image.read()
+    try:
+        prepared_image = await image_intake.prepare(image_bytes)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return await job_runner.submit(
+        spreadsheet_id=spreadsheet_id,
+        image_bytes=prepared_image.data,
+        image_content_type=prepared_image.content_type,
+        current_user=current_user
+    )
+
+@app.get("/receipt-jobs/{job_id}", response_model=ReceiptJob, tags=["Agent"], summary="Get a receipt job's status and result")
+async def get_receipt_job(
+    job_id: str,
+    job_runner: ReceiptJobRunner = Depends(get_job_runner),
+    current_user: User = Depends(get_current_user)
+):
+    job = await job_runner.get(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
 class TokenData(BaseModel):
     refresh_token: str
 
@@ -155,12 +351,16 @@ class TokenData(BaseModel):
 async def store_google_token(
     token_data: TokenData,
     current_user: User = Depends(get_current_user),
-    user_service: UserService = Depends(UserService) # Inject the new service
+    user_service: "UserService" = Depends(get_user_service)
 ):
     """
     Receives and stores the user's Google refresh token.
     """
-    user_service.store_google_refresh_token(current_user.auth_id, token_data.refresh_token)
+    try:
+        await user_service.store_google_refresh_token(current_user.auth_id, token_data.refresh_token)
+    except Exception:
+        # Already logged by the service
+        raise HTTPException(status_code=500, detail="Could not store the Google token. Please try again.")
     return
 
 
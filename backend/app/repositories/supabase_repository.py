@@ -0,0 +1,123 @@
+# app/repositories/supabase_repository.py
+import asyncio
+import uuid
+import structlog
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+from postgrest.exceptions import APIError
+from supabase import create_client, Client
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+def _is_missing_column(error: APIError, column: str) -> bool:
+    """42703 (undefined_column) on reads, PGRST204 (not in the schema cache) on writes."""
+    return error.code in ("42703", "PGRST204") and column in (error.message or "")
+
+class SupabaseRepository:
+    """
+    Async data access layer over the shared Supabase client.
+
+    The supabase-py client is synchronous, so every call is offloaded to a
+    dedicated, bounded thread pool instead of running on the event loop. The
+    single client is shared by all workers, so its underlying HTTP connection
+    pool is reused across requests, and the pool size caps how many database
+    round-trips a worker can have in flight at once.
+    """
+    def __init__(self, client: Client = None, max_concurrency: int = None):
+        self.client: Client = client or create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency or settings.SUPABASE_MAX_CONCURRENCY,
+            thread_name_prefix="supabase",
+        )
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Auth ---
+
+    async def get_auth_user(self, jwt: str):
+        """Validates a Supabase access token and returns the auth user (or None)."""
+        response = await self._run(self.client.auth.get_user, jwt=jwt)
+        return response.user if response else None
+
+    async def get_decrypted_user(self, auth_id: uuid.UUID) -> Optional[Dict]:
+        """Fetches the user profile, with the Google token decrypted, by auth id."""
+        query = self.client.rpc('get_decrypted_user_by_auth_id', {'user_auth_id_input': str(auth_id)}).single()
+        response = await self._run(query.execute)
+        return response.data
+
+    async def update_google_token(self, auth_id: uuid.UUID, refresh_token: str):
+        """Stores the Google refresh token through the secure SQL function."""
+        query = self.client.rpc('update_user_google_token', {
+            'user_auth_id_input': str(auth_id),
+            'token_input': refresh_token
+        })
+        await self._run(query.execute)
+
+    # --- Spreadsheets ---
+
+    async def user_owns_spreadsheet(self, user_id: uuid.UUID, spreadsheet_id: str) -> bool:
+        query = self.client.table("spreadsheets").select("id").eq("user_id", str(user_id)).eq("google_spreadsheet_id", spreadsheet_id)
+        response = await self._run(query.execute)
+        return bool(response.data)
+
+    async def get_owned_spreadsheet(self, user_id: uuid.UUID, spreadsheet_id: str) -> Optional[Dict]:
+        """Ownership check and schema summary in one round-trip; None if the user does not own it."""
+        query = self.client.table("spreadsheets").select("id, schema_summary").eq("user_id", str(user_id)).eq("google_spreadsheet_id", spreadsheet_id).limit(1)
+        response = await self._run(query.execute)
+        return response.data[0] if response.data else None
+
+    async def upsert_spreadsheet(self, user_id: uuid.UUID, spreadsheet_id: str, name: str) -> List[Dict]:
+        query = self.client.table("spreadsheets").upsert({
+            "user_id": str(user_id),
+            "google_spreadsheet_id": spreadsheet_id,
+            "name": name
+        }, on_conflict="user_id, google_spreadsheet_id")
+        response = await self._run(query.execute)
+        return response.data
+
+    async def list_spreadsheets(self, user_id: uuid.UUID) -> List[Dict]:
+        query = self.client.table("spreadsheets").select("*").eq("user_id", str(user_id)).order("created_at", desc=True)
+        response = await self._run(query.execute)
+        return response.data
+
+    async def get_schema_sections(self, spreadsheet_id: str) -> Optional[Dict[str, Dict]]:
+        """
+        Per-worksheet summaries and fingerprints (the `schema_sections` jsonb
+        column); None if there are none, or the column was not added yet (every
+        worksheet is then summarized, as before).
+        """
+        query = self.client.table("spreadsheets").select("schema_sections").eq("google_spreadsheet_id", spreadsheet_id).limit(1)
+        try:
+            response = await self._run(query.execute)
+        except APIError as e:
+            if not _is_missing_column(e, "schema_sections"):
+                raise
+            await log.awarning("spreadsheets.schema_sections is missing; see the README setup. Summarizing every worksheet.")
+            return None
+        return response.data[0].get("schema_sections") if response.data else None
+
+    async def update_schema_summary(self, spreadsheet_id: str, summary: str, sections: Dict[str, Dict] = None):
+        values = {"schema_summary": summary}
+        if sections is not None:
+            values["schema_sections"] = sections
+        query = self.client.table("spreadsheets").update(values).eq("google_spreadsheet_id", spreadsheet_id)
+        try:
+            await self._run(query.execute)
+        except APIError as e:
+            if sections is None or not _is_missing_column(e, "schema_sections"):
+                raise
+            # Without the column only the combined summary can be kept
+            await self.update_schema_summary(spreadsheet_id, summary)
+
+    async def ping(self):
+        """Cheap query used to open a pooled connection ahead of traffic."""
+        query = self.client.table("spreadsheets").select("id").limit(1)
+        await self._run(query.execute)
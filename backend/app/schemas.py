@@ -1,9 +1,7 @@
 # app/schemas.py
 import uuid
 from datetime import datetime
-from typing import TypedDict, Annotated, Sequence, Optional, List
-from langchain_core.messages import BaseMessage
-from langgraph.graph.message import add_messages
+from typing import Optional, List, Dict
 from pydantic import BaseModel, Field
 
 class User(BaseModel):
@@ -27,13 +25,55 @@ class Spreadsheet(BaseModel):
     class Config:
         from_attributes = True
 
-class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], add_messages]
-    spreadsheet_id: str
-    worksheet_name: str
-    google_refresh_token: str 
-    result: Optional[str]
+class ToolOutcome(BaseModel):
+    """What one tool call did, recorded by the agent's tool node."""
+    tool: str
+    status: str # appended | queued (write-behind) | failed
+    worksheet_name: Optional[str] = None
+    rows_appended: int = 0
+    error_class: Optional[str] = None
+    retryable: bool = False # True when the same request may succeed later (rate limits, outages)
+    message: str
+    turn: int = 0 # the agent turn (model call) that requested it; calls of one turn run together
 
 class AgentResponse(BaseModel):
-    status: str
-    message: str
\ No newline at end of file
+    status: str # success | partial (some rows could not be written)
+    message: str
+    rows_appended: int = 0
+    # True when the rows were journaled for a background write rather than appended already
+    queued: bool = False
+
+class ReceiptExtraction(BaseModel):
+    worksheet_name: str = Field(description="The destination worksheet, named exactly as in the spreadsheet summary.")
+    data_rows: List[List[str]] = Field(description="The rows to append, one per entry, values in the worksheet's column order.")
+
+class WorksheetSummary(BaseModel):
+    worksheet: str = Field(description="The worksheet name, exactly as given.")
+    summary: str = Field(description="Concise description of the worksheet's data table, headers and dropdown values.")
+
+class WorksheetSummaries(BaseModel):
+    summaries: List[WorksheetSummary]
+
+class ReceiptJob(BaseModel):
+    job_id: str
+    user_id: uuid.UUID
+    spreadsheet_id: str
+    status: str = "queued" # queued | running | succeeded | failed
+    result: Optional[AgentResponse] = None
+    error: Optional[str] = None
+    retryable: bool = False # whether resubmitting a failed job may help
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class BatchReceiptResult(BaseModel):
+    index: int # position of the image in the upload
+    status: str # success | partial (rows went to some of its worksheets only) | failed
+    message: str
+    rows: int = 0
+    retryable: bool = False
+
+class BatchReceiptResponse(BaseModel):
+    status: str # success | partial | failed
+    results: List[BatchReceiptResult]
+    appended_rows: Dict[str, int] = Field(default_factory=dict) # worksheet -> rows written
@@ -0,0 +1,90 @@
+# app/serve.py
+"""
+Production entry point: several uvicorn worker processes sharing one socket.
+
+    cd backend && python -m app.serve                # one worker per available CPU (shared job backend)
+    cd backend && python -m app.serve --workers 4 --port 8080
+
+Each worker is a separate process with its own registry (agent graph, LLM
+clients, Supabase and gspread pools, caches), built once in its lifespan.
+The worker count is exported as WEB_WORKERS, so budgets that are really
+per project or per user (the Sheets quotas) are split between the workers,
+and so are the CPUs for image decoding, which runs on a process pool per
+worker unless IMAGE_EXECUTOR is set.
+
+Several workers need a RECEIPT_JOB_BACKEND shared between them: a job queued
+in one worker's memory could not be polled through the others. They keep
+their metrics in prometheus_client's multiprocess mode, in
+PROMETHEUS_MULTIPROC_DIR (a temporary directory unless it is set), so that
+any worker can answer a scrape of /metrics for all of them.
+
+The in-memory caches are per worker too. An invalidation (a schema refresh,
+a new Google token) only reaches the worker that handled that request; the
+others may keep serving the old value until it expires: the schema summary
+for up to SCHEMA_CACHE_TTL_SECONDS, an authenticated user (with the token)
+for up to AUTH_CACHE_TTL_SECONDS and a worksheet handle for up to
+GSPREAD_HANDLE_CACHE_TTL_SECONDS. Lower those TTLs if that is too long.
+Cached prompt prefixes are keyed by the summary's contents, so they are
+never stale, only possibly created once per worker.
+
+On SIGTERM each worker stops accepting connections, waits up to
+GRACEFUL_SHUTDOWN_SECONDS for open requests (streams included), then for its
+queued and running receipt jobs, and finally flushes the write-behind journal.
+The orchestrator's termination grace period should cover both waits.
+"""
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+import uvicorn
+
+from app.core.config import available_cpus, settings
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.serve", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", help="bind address (default: SERVER_HOST)")
+    parser.add_argument("--port", type=int, help="bind port (default: SERVER_PORT)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: WEB_WORKERS, or one per available CPU with a shared RECEIPT_JOB_BACKEND)")
+    args = parser.parse_args()
+
+    # Validates the configuration once, before any worker is started
+    configured = settings.load()
+    workers = args.workers or settings.WEB_WORKERS or (1 if settings.RECEIPT_JOB_BACKEND == "memory" else available_cpus())
+    # The workers are spawned and read their settings from this environment
+    if workers > 1 and settings.RECEIPT_JOB_BACKEND == "memory":
+        parser.error(
+            f"{workers} workers cannot share RECEIPT_JOB_BACKEND=memory: a job would only be found by the worker that queued it. "
+            "Configure a shared backend, or run a single worker (--workers 1)."
+        )
+    os.environ["WEB_WORKERS"] = str(workers)
+    if "IMAGE_EXECUTOR" not in configured.model_fields_set:
+        os.environ["IMAGE_EXECUTOR"] = "process"
+
+    metrics_dir = None
+    if workers > 1 and settings.METRICS_ENABLED:
+        # Read by prometheus_client when the workers import it
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            # An earlier run's files would be added in forever
+            for db in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+                os.unlink(db)
+        else:
+            metrics_dir = tempfile.mkdtemp(prefix="receipt-metrics-")
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host or settings.SERVER_HOST,
+            port=args.port or settings.SERVER_PORT,
+            workers=workers,
+            timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_SECONDS,
+            # The app logs one structured line per request, with its trace id
+            access_log=False,
+        )
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import io
+import asyncio
+import structlog
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
+
+from app.core.config import available_cpus, settings
+from app.core.metrics import IMAGE_BYTES, span
+
+log = structlog.get_logger()
+
+class InvalidImageError(ValueError):
+    """Raised when an upload is empty, not an image, or cannot be decoded."""
+    pass
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    content_type: str
+    original_bytes: int
+    width: int
+    height: int
+
+_CONTENT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+def prepare_image(image_bytes: bytes, max_edge: int, output_format: str, quality: int) -> PreparedImage:
+    """
+    Validates an upload and re-encodes it for OCR: EXIF orientation applied,
+    longest edge capped at `max_edge`, compact output format. Re-encoding also
+    strips metadata and anything smuggled alongside the pixels.
+
+    CPU-bound and self-contained (module-level, picklable arguments) so it can
+    run in a thread or process pool.
+    """
+    # Imported on first use, in the worker that decodes
+    import magic
+    from PIL import Image, ImageOps
+
+    if not image_bytes:
+        raise InvalidImageError("File is empty.")
+
+    true_mime_type = magic.from_buffer(image_bytes, mime=True)
+    if not true_mime_type.startswith("image/"):
+        raise InvalidImageError(f"File not a valid image. Detected type: {true_mime_type}")
+
+    output_format = output_format.upper()
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            # JPEG can decode straight at 1/2, 1/4 or 1/8 scale; never below the requested box
+            img.draft("RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+            if output_format == "JPEG" and img.mode != "RGB":
+                # JPEG has no alpha channel: flatten onto white, as a printed receipt would be
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+
+            output_buffer = io.BytesIO()
+            save_options = {"optimize": True} if output_format == "PNG" else {"quality": quality}
+            img.save(output_buffer, format=output_format, **save_options)
+            width, height = img.size
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"Invalid or corrupt image file: {e}")
+
+    return PreparedImage(
+        data=output_buffer.getvalue(),
+        content_type=_CONTENT_TYPES[output_format],
+        original_bytes=len(image_bytes),
+        width=width,
+        height=height,
+    )
+
+def image_pool_size() -> int:
+    """IMAGE_WORKERS, or by default the available CPUs split between the web workers, each of which has its own pool."""
+    if settings.IMAGE_WORKERS > 0:
+        return settings.IMAGE_WORKERS
+    return max(1, available_cpus() // max(1, settings.WEB_WORKERS))
+
+def build_image_executor() -> Executor:
+    """
+    `image_pool_size()` threads, or processes with IMAGE_EXECUTOR="process".
+    Processes are spawned rather than forked: the API process runs threads
+    (log writer, Supabase pool) that a fork would copy mid-flight.
+    """
+    if settings.IMAGE_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=image_pool_size(), mp_context=multiprocessing.get_context("spawn"))
+    if settings.IMAGE_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=image_pool_size(), thread_name_prefix="image-intake")
+    raise ValueError(f"Unsupported IMAGE_EXECUTOR: {settings.IMAGE_EXECUTOR}")
+
+class ImageIntake:
+    """Runs `prepare_image` off the event loop on a bounded worker pool, shared by all requests."""
+    def __init__(self, executor: Executor = None):
+        if settings.IMAGE_FORMAT.upper() not in _CONTENT_TYPES:
+            raise ValueError(f"Unsupported IMAGE_FORMAT: {settings.IMAGE_FORMAT}")
+        self._owns_executor = executor is None
+        self._executor = executor or build_image_executor()
+
+    async def prepare(self, image_bytes: bytes) -> PreparedImage:
+        loop = asyncio.get_running_loop()
+        IMAGE_BYTES.labels(phase="upload").observe(len(image_bytes))
+        with span("image_prepare"):
+            image = await loop.run_in_executor(
+                self._executor,
+                prepare_image,
+                image_bytes,
+                settings.IMAGE_MAX_EDGE,
+                settings.IMAGE_FORMAT,
+                settings.IMAGE_QUALITY,
+            )
+        IMAGE_BYTES.labels(phase="prepared").observe(len(image.data))
+        await log.ainfo(
+            "Receipt image prepared",
+            bytes_before=image.original_bytes,
+            bytes_after=len(image.data),
+            width=image.width,
+            height=image.height,
+            content_type=image.content_type,
+        )
+        return image
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
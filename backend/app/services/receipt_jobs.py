@@ -0,0 +1,242 @@
+import uuid
+import asyncio
+import importlib
+import structlog
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.exception_handlers import AgentLogicError, QueueFullError
+from app.schemas import ReceiptJob, User
+
+if TYPE_CHECKING:
+    from app.repositories.supabase_repository import SupabaseRepository
+
+log = structlog.get_logger()
+
+class ReceiptJobRequest(BaseModel):
+    """
+    Everything a worker needs to run `ReceiptService.process_receipt` for a job.
+    Only the user's ids are queued: the worker loads the profile (and the
+    decrypted Google token, current as of the run) when it takes the job, so
+    no credentials end up in a shared queue.
+    """
+    spreadsheet_id: str
+    image_bytes: bytes
+    image_content_type: str
+    user_id: uuid.UUID
+    auth_id: uuid.UUID
+
+class JobBackend(ABC):
+    """
+    Storage and hand-off for receipt jobs. The in-memory backend serves a single
+    process; a shared implementation (e.g. Redis or a database table) lets
+    several API replicas enqueue and work off the same queue.
+    """
+    @abstractmethod
+    async def enqueue(self, job: ReceiptJob, request: ReceiptJobRequest):
+        """Queues a job, or raises QueueFullError."""
+        pass
+
+    @abstractmethod
+    async def dequeue(self) -> Tuple[ReceiptJob, ReceiptJobRequest]:
+        """Waits for the next job to run."""
+        pass
+
+    @abstractmethod
+    async def save(self, job: ReceiptJob):
+        """Persists a job's status and result."""
+        pass
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[ReceiptJob]:
+        pass
+
+    def stats(self) -> Dict:
+        return {}
+
+class InMemoryJobBackend(JobBackend):
+    """
+    Process-local backend with per-user fairness: each user has their own FIFO,
+    and workers take jobs from users in round-robin order, so one user's month-end
+    batch cannot starve everyone else. Both the whole queue and each user's share
+    of it are bounded. Finished jobs are kept for `result_ttl_seconds`.
+    """
+    def __init__(self, max_queued: int = None, max_queued_per_user: int = None, result_ttl_seconds: float = None):
+        self.max_queued = max_queued or settings.RECEIPT_JOB_MAX_QUEUED
+        self.max_queued_per_user = max_queued_per_user or settings.RECEIPT_JOB_MAX_QUEUED_PER_USER
+        self.result_ttl = timedelta(seconds=settings.RECEIPT_JOB_RESULT_TTL_SECONDS if result_ttl_seconds is None else result_ttl_seconds)
+        self._jobs: Dict[str, ReceiptJob] = {}
+        self._requests: Dict[str, ReceiptJobRequest] = {}
+        # user id -> queued job ids; dict order is the round-robin order
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._ready = asyncio.Condition()
+
+    async def enqueue(self, job: ReceiptJob, request: ReceiptJobRequest):
+        self._purge_finished()
+        user_key = str(job.user_id)
+        if self._queued >= self.max_queued:
+            raise QueueFullError("The receipt queue is full. Please try again shortly.")
+        if len(self._queues.get(user_key, ())) >= self.max_queued_per_user:
+            raise QueueFullError("You have too many receipts waiting. Please wait for some to finish.")
+
+        async with self._ready:
+            self._jobs[job.job_id] = job
+            self._requests[job.job_id] = request
+            self._queues.setdefault(user_key, deque()).append(job.job_id)
+            self._queued += 1
+            self._ready.notify()
+
+    async def dequeue(self) -> Tuple[ReceiptJob, ReceiptJobRequest]:
+        async with self._ready:
+            await self._ready.wait_for(lambda: self._queued > 0)
+            user_key, queue = next(iter(self._queues.items()))
+            job_id = queue.popleft()
+            # Rotate: this user goes to the back of the line
+            if queue:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+            self._queued -= 1
+            return self._jobs[job_id], self._requests.pop(job_id)
+
+    async def save(self, job: ReceiptJob):
+        self._jobs[job.job_id] = job
+
+    async def get(self, job_id: str) -> Optional[ReceiptJob]:
+        return self._jobs.get(job_id)
+
+    def _purge_finished(self):
+        cutoff = datetime.now(timezone.utc) - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        return {"queued": self._queued, "queued_users": len(self._queues), "tracked_jobs": len(self._jobs)}
+
+def build_job_backend() -> JobBackend:
+    """
+    RECEIPT_JOB_BACKEND is "memory" (default) or a "package.module:ClassName"
+    path to a JobBackend implementation shared between replicas.
+    """
+    name = settings.RECEIPT_JOB_BACKEND
+    if name == "memory":
+        return InMemoryJobBackend()
+    module_name, _, class_name = name.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class()
+
+class ReceiptJobRunner:
+    """A fixed pool of async workers running queued receipts through the receipt service."""
+    def __init__(self, receipt_service, repository: "SupabaseRepository" = None, backend: JobBackend = None, workers: int = None):
+        self.receipt_service = receipt_service
+        if repository is None:
+            from app.repositories.supabase_repository import SupabaseRepository
+            repository = SupabaseRepository()
+        # Loads each job's user when it runs
+        self.repository = repository
+        self.backend = backend or build_job_backend()
+        self.workers = workers or settings.RECEIPT_JOB_WORKERS
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+
+    async def submit(self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User) -> ReceiptJob:
+        job = ReceiptJob(
+            job_id=str(uuid.uuid4()),
+            user_id=current_user.id,
+            spreadsheet_id=spreadsheet_id,
+            created_at=datetime.now(timezone.utc),
+        )
+        request = ReceiptJobRequest(
+            spreadsheet_id=spreadsheet_id,
+            image_bytes=image_bytes,
+            image_content_type=image_content_type,
+            user_id=current_user.id,
+            auth_id=current_user.auth_id,
+        )
+        await self.backend.enqueue(job, request)
+        await log.ainfo("Receipt job queued", job_id=job.job_id, **self.backend.stats())
+        return job
+
+    async def get(self, job_id: str, current_user: User) -> Optional[ReceiptJob]:
+        """A job is only visible to the user who submitted it."""
+        job = await self.backend.get(job_id)
+        if job is None or job.user_id != current_user.id:
+            return None
+        return job
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work(i), name=f"receipt-job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = None):
+        """
+        Lets the workers finish the running jobs and, with the in-memory backend
+        (whose queue dies with the process), the queued ones too, for up to
+        `drain_timeout` (GRACEFUL_SHUTDOWN_SECONDS); then cancels them.
+        """
+        drain_timeout = settings.GRACEFUL_SHUTDOWN_SECONDS if drain_timeout is None else drain_timeout
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._drained(), drain_timeout)
+            except asyncio.TimeoutError:
+                await log.awarning("Receipt jobs still pending at shutdown, cancelling", running=self._running, **self.backend.stats())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _drained(self):
+        local_queue = isinstance(self.backend, InMemoryJobBackend)
+        while self._running or (local_queue and self.backend.stats()["queued"]):
+            await asyncio.sleep(0.05)
+
+    async def _work(self, worker_id: int):
+        while True:
+            job, request = await self.backend.dequeue()
+            await self._run(job, request)
+
+    async def _run(self, job: ReceiptJob, request: ReceiptJobRequest):
+        self._running += 1
+        job = job.model_copy(update={"status": "running", "started_at": datetime.now(timezone.utc)})
+        await self.backend.save(job)
+        try:
+            current_user = await self._load_user(request)
+            result = await self.receipt_service.process_receipt(
+                spreadsheet_id=request.spreadsheet_id,
+                image_bytes=request.image_bytes,
+                image_content_type=request.image_content_type,
+                current_user=current_user,
+            )
+            job = job.model_copy(update={"status": "succeeded", "result": result})
+        except AgentLogicError as e:
+            job = job.model_copy(update={"status": "failed", "error": str(e), "retryable": e.retryable})
+        except ValueError as e:
+            job = job.model_copy(update={"status": "failed", "error": str(e)})
+        except Exception:
+            await log.aexception("Receipt job crashed", job_id=job.job_id)
+            job = job.model_copy(update={"status": "failed", "error": "An unexpected internal server error occurred."})
+        finally:
+            self._running -= 1
+
+        job = job.model_copy(update={"finished_at": datetime.now(timezone.utc)})
+        await self.backend.save(job)
+        await log.ainfo("Receipt job finished", job_id=job.job_id, status=job.status)
+
+    async def _load_user(self, request: ReceiptJobRequest) -> User:
+        user_data = await self.repository.get_decrypted_user(request.auth_id)
+        if not user_data:
+            raise AgentLogicError("User profile not found.")
+        user = User(**user_data)
+        if user.id != request.user_id:
+            raise AgentLogicError("User profile not found.")
+        return user
+
+    def stats(self) -> Dict:
+        return {"workers": len(self._tasks), "running": self._running, **self.backend.stats()}
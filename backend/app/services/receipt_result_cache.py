@@ -0,0 +1,141 @@
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import structlog
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+from app.schemas import AgentResponse
+
+log = structlog.get_logger()
+
+class ReceiptResultCache:
+    """
+    Remembers the outcome of successfully processed receipts, keyed by a hash
+    of the user, the target spreadsheet and the prepared image bytes, so a
+    re-upload of the same receipt returns the earlier response instead of
+    re-running the agent and appending duplicate rows.
+
+    Results live in a small SQLite file so they survive restarts; identical
+    submissions that arrive while the first one is still running share its
+    in-flight run. Failures are never cached.
+    """
+    def __init__(self, path: str = None, ttl_seconds: float = None):
+        self.path = path or settings.RECEIPT_DEDUP_DB_PATH
+        self.ttl_seconds = settings.RECEIPT_DEDUP_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS receipt_results ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._hits = 0
+        self._joins = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(user_id: uuid.UUID, spreadsheet_id: str, image_bytes: bytes) -> str:
+        digest = hashlib.sha256()
+        digest.update(str(user_id).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(spreadsheet_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def _get(self, key: str) -> Optional[AgentResponse]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM receipt_results WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return AgentResponse.model_validate_json(row[0]) if row else None
+
+    def _set(self, key: str, response: AgentResponse):
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM receipt_results WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO receipt_results (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response.model_dump_json(), now + self.ttl_seconds),
+            )
+            self._db.commit()
+
+    async def get_or_run(self, key: str, run: Callable[[], Awaitable[AgentResponse]]) -> AgentResponse:
+        """Returns the cached result for `key`, joins its in-flight run, or starts `run`."""
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._joins += 1
+            await log.ainfo("Joining in-flight run for duplicate receipt")
+            return await asyncio.shield(task)
+
+        cached = await asyncio.to_thread(self._get, key)
+        if cached is not None:
+            self._hits += 1
+            await log.ainfo("Duplicate receipt, returning earlier result")
+            return cached
+
+        # Another identical submission may have started while we read the store
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._joins += 1
+            return await asyncio.shield(task)
+
+        self._misses += 1
+        task = asyncio.create_task(self._run_and_store(key, run))
+        self._in_flight[key] = task
+        # Shielded: a disconnecting client must not cancel a run others are waiting on
+        return await asyncio.shield(task)
+
+    async def lookup(self, key: str) -> Optional[AgentResponse]:
+        """
+        The earlier result for `key` (joining its in-flight run), or None. For
+        batches, which extract and write their receipts in separate phases
+        instead of running each one through `get_or_run`.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._joins += 1
+            try:
+                response = await asyncio.shield(task)
+            except Exception:
+                return None
+            return response if response.status == "success" else None
+        cached = await asyncio.to_thread(self._get, key)
+        if cached is not None:
+            self._hits += 1
+        else:
+            self._misses += 1
+        return cached
+
+    async def store(self, key: str, response: AgentResponse):
+        """Records a successful result written outside `get_or_run`."""
+        if response.status == "success":
+            await asyncio.to_thread(self._set, key, response)
+
+    async def _run_and_store(self, key: str, run: Callable[[], Awaitable[AgentResponse]]) -> AgentResponse:
+        try:
+            response = await run()
+            if response.status == "success":
+                await asyncio.to_thread(self._set, key, response)
+            return response
+        finally:
+            self._in_flight.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._hits + self._joins + self._misses
+        return {
+            "hits": self._hits,
+            "in_flight_joins": self._joins,
+            "misses": self._misses,
+            "in_flight": len(self._in_flight),
+            "hit_rate": round((self._hits + self._joins) / lookups, 4) if lookups else 0.0,
+        }
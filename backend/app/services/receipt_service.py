@@ -1,38 +1,79 @@
 import uuid
 import base64
 import re
+import asyncio
+from collections import OrderedDict
+from functools import partial
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 import structlog
+from gspread.exceptions import APIError, WorksheetNotFound
 from abc import ABC, abstractmethod
 from langgraph.graph.state import CompiledStateGraph
-from langchain_core.messages import HumanMessage
-from supabase import create_client, Client
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 
 from app.core.config import settings
-from app.schemas import AgentResponse, User
-from app.prompts import SYSTEM_PROMPT
-from app.agent import ReceiptAgent
+from app.core.context_cache import PromptContextCache, is_cached_content_error, summary_block
+from app.core.metrics import span
+from app.schemas import AgentResponse, BatchReceiptResponse, BatchReceiptResult, ReceiptExtraction, ToolOutcome, User
+from app.prompts import EXTRACTION_PROMPT, SYSTEM_PROMPT
+from app.agent import ReceiptAgent, tools as agent_tools
 from app.core.exception_handlers import AgentLogicError
+from app.repositories.supabase_repository import SupabaseRepository
+from app.services.schema_summary_cache import SchemaSummaryCache
+from app.services.receipt_result_cache import ReceiptResultCache
+from app.tools.gspread_tool import classify_error
+from app.tools.gspread_writer import SheetsWriter
+from app.tools.sheets_write_behind import WriteBehindAppender
 
 log = structlog.get_logger()
 
 class IReceiptService(ABC):
     @abstractmethod
     async def process_receipt(
-        self, spreadsheet_id: str, worksheet_name: str, image_bytes: bytes, image_content_type: str
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User
     ) -> AgentResponse:
         pass
 
 class ReceiptService(IReceiptService):
-    def __init__(self, agent_runnable: CompiledStateGraph  = None):
-        # Allow injecting the agent for easier testing
+    def __init__(
+        self,
+        agent_runnable: CompiledStateGraph  = None,
+        repository: SupabaseRepository = None,
+        schema_cache: SchemaSummaryCache = None,
+        result_cache: ReceiptResultCache = None,
+        sheets_writer: SheetsWriter = None,
+        extractor: ReceiptAgent = None,
+        prompt_cache: PromptContextCache = None,
+        write_behind: WriteBehindAppender = None,
+    ):
+        # Allow injecting the agent, repository and cache; the app injects the shared ones from the registry
         self.agent_runnable = agent_runnable or ReceiptAgent().get_agent()
-        self.supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
-    async def process_receipt(
-        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User
-    ) -> AgentResponse:
-        
-        response = self.supabase.table("spreadsheets").select("id").eq("user_id", str(current_user.id)).eq("google_spreadsheet_id", spreadsheet_id).execute()
-        if not response.data:
+        self.repository = repository or SupabaseRepository()
+        self.schema_cache = schema_cache or SchemaSummaryCache()
+        # Optional: without it every upload runs the agent
+        self.result_cache = result_cache
+        # Needed for batches and the fast path, which write the rows themselves
+        self.sheets_writer = sheets_writer
+        # Optional structured-output fast path (anything with `extract(message)`); the agent loop is the fallback
+        self.extractor = extractor
+        # Optional: without it the instructions and summary are sent with every request
+        self.prompt_cache = prompt_cache
+        # Optional: rows are journaled and acknowledged, then written to Sheets in the background
+        self.write_behind = write_behind
+
+    async def _get_owned_spreadsheet(self, spreadsheet_id: str, current_user: User):
+        """Ownership + schema summary, from the cache in steady state and one query otherwise."""
+        spreadsheet = self.schema_cache.get(current_user.id, spreadsheet_id)
+        if spreadsheet is None:
+            spreadsheet = await self.repository.get_owned_spreadsheet(current_user.id, spreadsheet_id)
+            if spreadsheet is not None:
+                self.schema_cache.set(current_user.id, spreadsheet_id, spreadsheet)
+        return spreadsheet
+
+    async def _authorize_receipt(self, spreadsheet_id: str, current_user: User) -> str:
+        """Checks the user may write receipts to the spreadsheet and returns its schema summary."""
+        spreadsheet = await self._get_owned_spreadsheet(spreadsheet_id, current_user)
+        if spreadsheet is None:
             raise AgentLogicError("Access denied. You do not own this spreadsheet or it has not been registered.")
 
         if not current_user.google_refresh_token:
@@ -42,46 +83,421 @@ class ReceiptService(IReceiptService):
         if not re.match(r"^[a-zA-Z0-9-_]{40,}$", spreadsheet_id):
              raise ValueError("Invalid spreadsheet_id format.")
 
-        thread_id = str(uuid.uuid4())
-        config = {"configurable": {"thread_id": thread_id}}
+        return spreadsheet.get("schema_summary") or "No summary available. Please refresh the canvas schema."
 
-        base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    async def process_receipt(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User
+    ) -> AgentResponse:
+        with span("authorize"):
+            schema_summary = await self._authorize_receipt(spreadsheet_id, current_user)
+        run = partial(self._run_agent, spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+        if self.result_cache is None:
+            return await run()
 
-        response = self.supabase.table("spreadsheets").select("schema_summary").eq("google_spreadsheet_id", spreadsheet_id).single().execute()
-        schema_summary = response.data.get("schema_summary", "No summary available. Please refresh the canvas schema.")
+        # Re-uploads of the same receipt return the earlier result instead of appending the rows again
+        key = self.result_cache.key(current_user.id, spreadsheet_id, image_bytes)
+        return await self.result_cache.get_or_run(key, run)
 
-        # Inject the summary into the initial message
-        prompt_text = (
-            f"{SYSTEM_PROMPT}\n\n"
-            f"You are working with the Google Sheet that has the ID: {spreadsheet_id}\n" # <-- ADD THIS LINE
-            f"--- SPREADSHEET SUMMARY ---\n{schema_summary}\n---------------------------\n\n"
-        )
-        
-        initial_message = HumanMessage(
+    async def process_receipt_batch(
+        self, spreadsheet_id: str, images: Sequence[Tuple[bytes, str]], current_user: User
+    ) -> BatchReceiptResponse:
+        """
+        Extracts a batch of receipts concurrently (at most BATCH_EXTRACTION_CONCURRENCY
+        agent runs at a time) with their writes deferred, then appends the rows
+        grouped by worksheet: one Sheets write per worksheet instead of one per receipt.
+        A receipt that fails extraction or whose worksheet write fails is reported
+        on its own; the rest of the batch still goes through. A receipt whose rows
+        were only partly written is reported as partial and not retryable: sending
+        it again would duplicate the rows that did go in.
+
+        Like single uploads, receipts are deduplicated by content: one processed
+        before (alone or in an earlier batch, e.g. one retried after a timeout)
+        returns its earlier result and is not written again.
+        """
+        if self.sheets_writer is None:
+            raise RuntimeError("Batch processing needs a SheetsWriter.")
+        with span("authorize"):
+            schema_summary = await self._authorize_receipt(spreadsheet_id, current_user)
+
+        results: Dict[int, BatchReceiptResult] = {}
+        keys: Dict[int, str] = {}
+        first_of_key: Dict[str, int] = {}
+        to_extract: List[int] = []
+        for index, (image_bytes, _) in enumerate(images):
+            if self.result_cache is None:
+                to_extract.append(index)
+                continue
+            keys[index] = self.result_cache.key(current_user.id, spreadsheet_id, image_bytes)
+            # The same image twice in one batch is processed once
+            if first_of_key.setdefault(keys[index], index) == index:
+                to_extract.append(index)
+
+        async def earlier_result(index: int):
+            return index, await self.result_cache.lookup(keys[index])
+
+        if self.result_cache is not None:
+            for index, earlier in await asyncio.gather(*(earlier_result(index) for index in to_extract)):
+                if earlier is not None:
+                    results[index] = BatchReceiptResult(
+                        index=index, status="success", message=f"Already processed: {earlier.message}", rows=earlier.rows_appended,
+                    )
+            to_extract = [index for index in to_extract if index not in results]
+
+        semaphore = asyncio.Semaphore(settings.BATCH_EXTRACTION_CONCURRENCY)
+
+        async def extract(index: int):
+            image_bytes, image_content_type = images[index]
+            async with semaphore:
+                try:
+                    appends = await self._extract_rows(spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+                    return index, appends, None
+                except AgentLogicError as e:
+                    return index, [], e
+                except Exception:
+                    await log.aexception("Batch receipt extraction crashed", index=index)
+                    return index, [], AgentLogicError("An unexpected internal server error occurred.")
+
+        extractions = await asyncio.gather(*(extract(index) for index in to_extract))
+
+        # Group rows per worksheet, keeping upload order within each group
+        groups: "OrderedDict[str, List[List[str]]]" = OrderedDict()
+        worksheets_by_receipt: Dict[int, List[str]] = {}
+        for index, appends, error in extractions:
+            if error is not None:
+                results[index] = BatchReceiptResult(index=index, status="failed", message=str(error), retryable=error.retryable)
+                continue
+            for append in appends:
+                groups.setdefault(append["worksheet_name"], []).extend(append["data_rows"])
+                if append["worksheet_name"] not in worksheets_by_receipt.setdefault(index, []):
+                    worksheets_by_receipt[index].append(append["worksheet_name"])
+            rows = sum(len(append["data_rows"]) for append in appends)
+            worksheets = ", ".join(f"'{name}'" for name in sorted(worksheets_by_receipt[index]))
+            results[index] = BatchReceiptResult(index=index, status="success", message=f"Extracted {rows} rows for {worksheets}.", rows=rows)
+
+        async def write(worksheet_name: str, data_rows: List[List[str]]):
+            try:
+                return worksheet_name, await self._append(current_user, spreadsheet_id, worksheet_name, data_rows), None
+            except Exception as e:
+                await log.aerror("Batch append failed", worksheet_name=worksheet_name, rows=len(data_rows), error=str(e))
+                return worksheet_name, False, e
+
+        appended_rows, queued, errors = {}, set(), {}
+        for worksheet_name, was_queued, error in await asyncio.gather(*(write(name, rows) for name, rows in groups.items())):
+            if error is not None:
+                errors[worksheet_name] = error
+                continue
+            appended_rows[worksheet_name] = len(groups[worksheet_name])
+            if was_queued:
+                queued.add(worksheet_name)
+
+        for index, worksheets in worksheets_by_receipt.items():
+            failed = [name for name in worksheets if name in errors]
+            if not failed:
+                if index in keys:
+                    await self.result_cache.store(keys[index], AgentResponse(
+                        status="success", message=results[index].message, rows_appended=results[index].rows,
+                        queued=any(name in queued for name in worksheets),
+                    ))
+                continue
+            problems = "; ".join(f"could not write rows to '{name}': {errors[name]}" for name in failed)
+            written = [name for name in worksheets if name not in errors]
+            if written:
+                results[index] = results[index].model_copy(update={
+                    "status": "partial",
+                    "message": f"Rows written to {', '.join(repr(name) for name in written)}, but {problems}.",
+                    # Resending the receipt would write those rows again
+                    "retryable": False,
+                })
+            else:
+                results[index] = results[index].model_copy(update={
+                    "status": "failed",
+                    "message": problems[0].upper() + problems[1:],
+                    "retryable": all(classify_error(errors[name])[1] for name in failed),
+                })
+
+        # Repeats of an image within the batch share its result
+        for index, key in keys.items():
+            if index not in results:
+                first = first_of_key[key]
+                results[index] = results[first].model_copy(update={"index": index, "rows": 0, "message": f"Same image as receipt {first}."})
+
+        ordered = [results[index] for index in range(len(images))]
+        succeeded = sum(result.status == "success" for result in ordered)
+        written = sum(result.status in ("success", "partial") for result in ordered)
+        status = "success" if succeeded == len(ordered) else "partial" if written else "failed"
+        await log.ainfo("Receipt batch finished", receipts=len(ordered), succeeded=succeeded, sheet_writes=len(groups))
+        return BatchReceiptResponse(status=status, results=ordered, appended_rows=appended_rows)
+
+    async def _append(self, current_user: User, spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]]) -> bool:
+        """Writes the rows, or journals them in write-behind mode; True when they were only queued."""
+        if self.write_behind is not None:
+            await self.write_behind.enqueue(
+                str(current_user.auth_id), current_user.google_refresh_token, spreadsheet_id, worksheet_name, data_rows
+            )
+            return True
+        await self.sheets_writer.append_rows(current_user.google_refresh_token, spreadsheet_id, worksheet_name, data_rows)
+        return False
+
+    async def _build_messages(
+        self, kind: str, instructions: str, spreadsheet_id: str, image_bytes: bytes, image_content_type: str,
+        schema_summary: str, tools: Optional[list] = None, use_cache: bool = True,
+    ) -> Tuple[List[BaseMessage], Optional[str]]:
+        """
+        The opening messages for a run, and the name of the cached prompt prefix
+        they rely on. With a cached prefix only the per-receipt part is sent;
+        otherwise the instructions go out as a system message and the summary inline.
+        """
+        context_cache = None
+        if self.prompt_cache is not None and use_cache:
+            with span("prompt_cache"):
+                context_cache = await self.prompt_cache.get(kind, spreadsheet_id, instructions, schema_summary, tools)
+
+        prompt_text = f"You are working with the Google Sheet that has the ID: {spreadsheet_id}"
+        if context_cache is None:
+            prompt_text = f"{summary_block(schema_summary)}\n\n{prompt_text}"
+
+        base64_image = base64.b64encode(image_bytes).decode("utf-8")
+        receipt_message = HumanMessage(
             content=[
                 {"type": "text", "text": prompt_text},
                 {"type": "image_url", "image_url": f"data:{image_content_type};base64,{base64_image}"},
             ]
         )
+        if context_cache is not None:
+            return [receipt_message], context_cache
+        return [SystemMessage(content=instructions), receipt_message], None
 
-        initial_state = {
-            "messages": [initial_message],
+    async def _initial_state(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User, schema_summary: str
+    ) -> dict:
+        messages, context_cache = await self._build_messages(
+            "agent", SYSTEM_PROMPT, spreadsheet_id, image_bytes, image_content_type, schema_summary, tools=agent_tools
+        )
+        state = {
+            "messages": messages,
             "spreadsheet_id": spreadsheet_id,
-            "google_refresh_token": current_user.google_refresh_token
+            "google_refresh_token": current_user.google_refresh_token,
+            "user_auth_id": str(current_user.auth_id),
+            "context_cache": context_cache,
         }
+        if context_cache is not None:
+            # Sent in place of the cached prefix if Gemini rejects it mid-run
+            state["inline_prefix"] = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=summary_block(schema_summary))]
+        return state
+
+    def _forget_rejected_prefix(self, initial_state: dict, final_state: Optional[dict]):
+        """A run that had to fall back to the inline prefix dropped its cached one: don't hand that out again."""
+        context_cache = initial_state.get("context_cache")
+        if context_cache is not None and final_state is not None and final_state.get("context_cache", context_cache) is None:
+            self.prompt_cache.invalidate(context_cache)
+
+    @staticmethod
+    def _extraction_problem(extraction: Optional[ReceiptExtraction], schema_summary: str) -> Optional[str]:
+        """Why a structured extraction cannot be written as-is, or None if it can."""
+        if extraction is None:
+            return "output did not match the schema"
+        if not extraction.data_rows or not all(extraction.data_rows):
+            return "no rows extracted"
+        if len({len(row) for row in extraction.data_rows}) > 1:
+            return "rows have different lengths"
+        # Summaries list each worksheet as "### Worksheet: <title>"; legacy summaries cannot be checked
+        if "### Worksheet: " in schema_summary and f"### Worksheet: {extraction.worksheet_name}\n" not in schema_summary + "\n":
+            return f"unknown worksheet '{extraction.worksheet_name}'"
+        return None
+
+    async def _extract_structured(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, schema_summary: str
+    ) -> Optional[ReceiptExtraction]:
+        """Single-call extraction, validated; None means use the agent loop instead."""
+        if self.extractor is None or self.sheets_writer is None:
+            return None
+        messages, context_cache = await self._build_messages(
+            "extraction", EXTRACTION_PROMPT, spreadsheet_id, image_bytes, image_content_type, schema_summary
+        )
+        try:
+            extraction = await self.extractor.extract(messages, cached_content=context_cache)
+        except Exception as e:
+            if context_cache is None or not is_cached_content_error(e):
+                raise
+            await log.awarning("Cached prompt prefix rejected, sending it inline", error=str(e))
+            self.prompt_cache.invalidate(context_cache)
+            messages, _ = await self._build_messages(
+                "extraction", EXTRACTION_PROMPT, spreadsheet_id, image_bytes, image_content_type, schema_summary, use_cache=False
+            )
+            extraction = await self.extractor.extract(messages)
+        problem = self._extraction_problem(extraction, schema_summary)
+        if problem is not None:
+            await log.ainfo("Fast path extraction rejected, falling back to the agent", reason=problem)
+            return None
+        return extraction
+
+    async def _run_fast_path(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User, schema_summary: str
+    ) -> Optional[AgentResponse]:
+        """Extract with one LLM call and write directly; None means use the agent loop instead."""
+        extraction = await self._extract_structured(spreadsheet_id, image_bytes, image_content_type, schema_summary)
+        if extraction is None:
+            return None
+
+        worksheet_name, data_rows = extraction.worksheet_name, extraction.data_rows
+        try:
+            queued = await self._append(current_user, spreadsheet_id, worksheet_name, data_rows)
+        except (WorksheetNotFound, APIError) as e:
+            # A missing tab or a rejected append wrote nothing; the agent can inspect the error and correct itself
+            if isinstance(e, APIError) and e.response.status_code != 400:
+                raise AgentLogicError(f"Error appending rows to '{worksheet_name}': {e}", retryable=classify_error(e)[1])
+            await log.ainfo("Fast path append rejected, falling back to the agent", worksheet_name=worksheet_name, error=str(e))
+            return None
+        except Exception as e:
+            raise AgentLogicError(f"Error appending rows to '{worksheet_name}': {e}", retryable=classify_error(e)[1])
+
+        await log.ainfo("Receipt processed on the fast path.", worksheet_name=worksheet_name, rows=len(data_rows), queued=queued)
+        verb = "queued" if queued else "appended"
+        return AgentResponse(
+            status="success",
+            message=f"Successfully {verb} {len(data_rows)} rows to '{worksheet_name}'.",
+            rows_appended=len(data_rows),
+            queued=queued,
+        )
+
+    async def _extract_rows(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User, schema_summary: str
+    ) -> List[Dict]:
+        """Returns the appends for one receipt: from the fast path, or from an agent run with writes deferred."""
+        extraction = await self._extract_structured(spreadsheet_id, image_bytes, image_content_type, schema_summary)
+        if extraction is not None:
+            return [{"spreadsheet_id": spreadsheet_id, "worksheet_name": extraction.worksheet_name, "data_rows": extraction.data_rows}]
+
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        initial_state = await self._initial_state(spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+        initial_state["defer_writes"] = True
 
         final_state = await self.agent_runnable.ainvoke(initial_state, config)
+        self._forget_rejected_prefix(initial_state, final_state)
+        appends = final_state.get("pending_appends") or []
+        if not appends:
+            messages = final_state.get("messages")
+            raise AgentLogicError(str(messages[-1].content) if messages else "Agent finished without extracting any rows.")
+        return appends
+
+    async def _run_agent(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User, schema_summary: str
+    ) -> AgentResponse:
+        response = await self._run_fast_path(spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+        if response is not None:
+            return response
+
+        thread_id = str(uuid.uuid4())
+        config = {"configurable": {"thread_id": thread_id}}
+        initial_state = await self._initial_state(spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+
+        final_state = await self.agent_runnable.ainvoke(initial_state, config)
+        self._forget_rejected_prefix(initial_state, final_state)
+        return await self._to_response(final_state)
+
+    async def _to_response(self, final_state: dict) -> AgentResponse:
+        """
+        Decides the run's outcome from the tool outcomes it recorded, never from
+        the wording of the final message. A failed call is resolved only by rows
+        appended in a later turn, after the model saw the error and corrected
+        itself; calls of the same turn are independent (e.g. expense rows and a
+        tax line for different worksheets). Unresolved failures make the run
+        failed, or partial if some rows were appended; a run that appended
+        nothing failed.
+        """
+        outcomes: List[ToolOutcome] = final_state.get("result") or []
+        appended = [outcome for outcome in outcomes if outcome.status in ("appended", "queued")]
+        rows_appended = sum(outcome.rows_appended for outcome in appended)
+        queued = any(outcome.status == "queued" for outcome in appended)
+        last_append_turn = max((outcome.turn for outcome in appended), default=-1)
+        unresolved = [
+            outcome for outcome in outcomes
+            if outcome.status not in ("appended", "queued") and outcome.turn >= last_append_turn
+        ]
+
+        messages = final_state.get("messages")
+        final_text = str(messages[-1].content) if messages else ""
+
+        if unresolved:
+            failure = unresolved[-1]
+            await log.awarning(
+                "Agent run failed" if not rows_appended else "Agent run partially failed",
+                error_class=failure.error_class, retryable=failure.retryable,
+                failed_worksheets=[outcome.worksheet_name for outcome in unresolved],
+                rows_appended=rows_appended, agent_response=final_text,
+            )
+            if not rows_appended:
+                raise AgentLogicError(failure.message, retryable=failure.retryable)
+            # Some rows are in the sheet: report them along with what is missing
+            return AgentResponse(
+                status="partial",
+                message=f"Appended {rows_appended} rows, but some could not be written: "
+                        + "; ".join(outcome.message for outcome in unresolved),
+                rows_appended=rows_appended,
+                queued=queued,
+            )
+        if not rows_appended:
+            # The model declined to write anything, e.g. the image is not a receipt
+            await log.awarning("Agent finished without appending rows", agent_response=final_text)
+            raise AgentLogicError(final_text or "Agent finished without appending any rows.")
+
+        await log.ainfo("Receipt processing service finished successfully.", rows_appended=rows_appended)
+        return AgentResponse(
+            status="success",
+            message=final_text or f"Successfully appended {rows_appended} rows.",
+            rows_appended=rows_appended,
+            queued=queued,
+        )
+
+    async def stream_receipt(
+        self, spreadsheet_id: str, image_bytes: bytes, image_content_type: str, current_user: User
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of `process_receipt`. Checks run up front, so access
+        errors still surface as HTTP errors; the returned iterator then yields
+        (event, data) pairs as the run progresses:
+        accepted, token, extracted, tool_started, tool_finished, and finally
+        result or error. Closing the iterator early cancels the agent run.
+        Streamed runs bypass the duplicate-receipt cache.
+        """
+        with span("authorize"):
+            schema_summary = await self._authorize_receipt(spreadsheet_id, current_user)
+        initial_state = await self._initial_state(spreadsheet_id, image_bytes, image_content_type, current_user, schema_summary)
+        return self._stream_agent(initial_state)
+
+    async def _stream_agent(self, initial_state: dict) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        yield "accepted", {"spreadsheet_id": initial_state["spreadsheet_id"]}
+
+        final_state = None
+        events = self.agent_runnable.astream_events(initial_state, config, version="v2")
+        try:
+            async for event in events:
+                kind, name = event["event"], event.get("name")
+                node = event.get("metadata", {}).get("langgraph_node")
+
+                if kind == "on_chat_model_stream":
+                    text = event["data"]["chunk"].content
+                    if isinstance(text, str) and text:
+                        yield "token", {"text": text}
+                elif kind == "on_chat_model_end":
+                    tool_calls = getattr(event["data"].get("output"), "tool_calls", None)
+                    if tool_calls:
+                        yield "extracted", {"tool_calls": len(tool_calls)}
+                elif kind == "on_chain_start" and name == "action" and node == "action":
+                    yield "tool_started", {}
+                elif kind == "on_chain_end" and name == "action" and node == "action":
+                    outcomes = (event["data"].get("output") or {}).get("result", [])
+                    yield "tool_finished", {"outcomes": [outcome.model_dump() for outcome in outcomes]}
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = event["data"].get("output")
+        finally:
+            # Runs when the client goes away mid-stream: stops the graph instead of letting it finish unobserved
+            await events.aclose()
 
-        if final_state.get("messages"):
-            last_message = final_state["messages"][-1]
-            result_message = last_message.content
-        else:
-            result_message = "Agent finished without providing a final message."
-        
-        failure_keywords = ["error", "failed", "unable to", "could not", "unexpected"] 
-        if any(keyword in result_message.lower() for keyword in failure_keywords):
-            await log.awarning("Agent completed with a business logic failure", agent_response=result_message)
-            raise AgentLogicError(result_message)
-        
-        await log.ainfo("Receipt processing service finished successfully.")
-        return AgentResponse(status="success", message=str(result_message))
\ No newline at end of file
+        self._forget_rejected_prefix(initial_state, final_state)
+        try:
+            response = await self._to_response(final_state or {})
+            yield "result", response.model_dump()
+        except AgentLogicError as e:
+            yield "error", {"detail": str(e), "retryable": e.retryable}
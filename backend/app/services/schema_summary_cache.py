@@ -0,0 +1,31 @@
+import uuid
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+class SchemaSummaryCache:
+    """
+    Per-(user, spreadsheet) cache of the ownership check and schema summary
+    that every receipt needs. Only owned spreadsheets are cached, so a newly
+    registered canvas is never shadowed by a stale "not found".
+    Writers must call `invalidate` after changing a spreadsheet's row.
+    """
+    def __init__(self, max_size: int = None, ttl_seconds: float = None):
+        self._cache = TTLCache(
+            max_size=max_size or settings.SCHEMA_CACHE_MAX_SIZE,
+            ttl_seconds=settings.SCHEMA_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds,
+        )
+
+    def get(self, user_id: uuid.UUID, spreadsheet_id: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get((str(user_id), spreadsheet_id))
+
+    def set(self, user_id: uuid.UUID, spreadsheet_id: str, row: Dict[str, Any]):
+        self._cache.set((str(user_id), spreadsheet_id), row)
+
+    def invalidate(self, spreadsheet_id: str) -> int:
+        """Drops the spreadsheet's entries for every user (summaries are shared across owners)."""
+        return self._cache.invalidate_keys(lambda key: key[1] == spreadsheet_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
@@ -1,27 +1,83 @@
 from typing import List, Dict, Any
-from supabase import create_client, Client
+from gspread.utils import rowcol_to_a1
 from fastapi import HTTPException, status
-from functools import partial
-import gspread_asyncio
 import json
+import hashlib
 
 from app.core.config import settings
-from app.schemas import User
-from app.tools.gspread_tool import get_creds_for_user
+from app.schemas import User, WorksheetSummaries
+from app.repositories.supabase_repository import SupabaseRepository
+from app.services.schema_summary_cache import SchemaSummaryCache
+from app.tools.gspread_client_pool import GspreadClientPool
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+def _preview_range(title: str, window: str) -> str:
+    """A1 range of the preview window on a given tab, with the title quoted for the API."""
+    quoted_title = title.replace("'", "''")
+    return f"'{quoted_title}'!{window}"
+
+def _parse_preview(sheet: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns one sheet of an includeGridData response into its preview rows and dropdown rules."""
+    preview = []
+    validation_rules = {}
+    for grid in sheet.get("data", []):
+        start_row, start_col = grid.get("startRow", 0), grid.get("startColumn", 0)
+        for row_offset, row in enumerate(grid.get("rowData", [])):
+            cells = row.get("values", [])
+            values = [cell.get("formattedValue", "") for cell in cells]
+            # Match values.get: trailing empty cells are dropped
+            while values and values[-1] == "":
+                values.pop()
+            preview.append(values)
+            for col_offset, cell in enumerate(cells):
+                rule = cell.get("dataValidation")
+                if rule:
+                    # One rule per column is enough for the prompt; the first cell locates it
+                    column = rowcol_to_a1(1, start_col + col_offset + 1)[:-1]
+                    validation_rules.setdefault(column, {
+                        "first_cell": rowcol_to_a1(start_row + row_offset + 1, start_col + col_offset + 1),
+                        "condition": rule.get("condition", {}),
+                    })
+    # Match values.get: trailing empty rows are dropped
+    while preview and not preview[-1]:
+        preview.pop()
+    return {"name": sheet["properties"]["title"], "preview": preview, "validation_rules": validation_rules}
+
+def _structural_fingerprint(sheet: Dict[str, Any]) -> str:
+    """
+    Hash of what the summary depends on: the table anchor, its header row and
+    the dropdown rules. New data rows do not change it.
+    """
+    headers, anchor = [], None
+    for row_index, row in enumerate(sheet["preview"]):
+        if any(row):
+            first_col = next(i for i, value in enumerate(row) if value)
+            headers, anchor = row[first_col:], rowcol_to_a1(row_index + 1, first_col + 1)
+            break
+    structure = {"anchor": anchor, "headers": headers, "validation_rules": sheet["validation_rules"]}
+    return hashlib.sha256(json.dumps(structure, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _compose_summary(sections: Dict[str, Dict[str, Any]], titles: List[str]) -> str:
+    """Joins the per-worksheet sections, in tab order, into the summary given to the agent."""
+    return "\n\n".join(f"### Worksheet: {title}\n{sections[title]['summary']}" for title in titles if title in sections)
+
 class SpreadsheetService:
-    def __init__(self):
-        self.supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=settings.GOOGLE_API_KEY)
+    def __init__(
+        self,
+        repository: SupabaseRepository = None,
+        llm: ChatGoogleGenerativeAI = None,
+        gspread_pool: GspreadClientPool = None,
+        schema_cache: SchemaSummaryCache = None,
+    ):
+        self.repository = repository or SupabaseRepository()
+        self.schema_cache = schema_cache or SchemaSummaryCache()
+        self.gspread_pool = gspread_pool or GspreadClientPool()
+        self.llm = llm or ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=settings.GOOGLE_API_KEY)
     
     async def register_spreadsheet(self, spreadsheet_id: str, name: str, current_user: User):
         """Registers a spreadsheet for a user, or updates its name if it already exists."""
-        data, count = self.supabase.table("spreadsheets").upsert({
-            "user_id": str(current_user.id),
-            "google_spreadsheet_id": spreadsheet_id,
-            "name": name
-        }, on_conflict="user_id, google_spreadsheet_id").execute()
+        data = await self.repository.upsert_spreadsheet(current_user.id, spreadsheet_id, name)
+        self.schema_cache.invalidate(spreadsheet_id)
         return data
 
     async def get_worksheets(self, spreadsheet_id: str, current_user: User) -> List[str]:
@@ -30,8 +86,7 @@ class SpreadsheetService:
         but only if the user owns it.
         """
         # 1. Authorization Check: Verify the user has this spreadsheet registered.
-        response = self.supabase.table("spreadsheets").select("id").eq("user_id", str(current_user.id)).eq("google_spreadsheet_id", spreadsheet_id).execute()
-        if not response.data:
+        if not await self.repository.user_owns_spreadsheet(current_user.id, spreadsheet_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Access denied. This spreadsheet is not registered to your account."
@@ -43,9 +98,7 @@ class SpreadsheetService:
 
         # 3. Fetch worksheets using the user's credentials
         try:
-            user_creds_func = partial(get_creds_for_user, refresh_token=current_user.google_refresh_token)
-            user_agcm = gspread_asyncio.AsyncioGspreadClientManager(user_creds_func)
-            agc = await user_agcm.authorize()
+            agc = await self.gspread_pool.authorize(current_user.google_refresh_token)
             spreadsheet = await agc.open_by_key(spreadsheet_id)
             worksheets = await spreadsheet.worksheets()
             return [ws.title for ws in worksheets]
@@ -55,60 +108,85 @@ class SpreadsheetService:
     
     async def get_canvases(self, current_user: User) -> List[Dict]:
         """Fetches all registered spreadsheets (canvases) for the current user."""
-        response = self.supabase.table("spreadsheets").select("*").eq("user_id", str(current_user.id)).order("created_at", desc=True).execute()
-        return response.data
+        return await self.repository.list_spreadsheets(current_user.id)
+
+    async def _fetch_sheet_previews(self, spreadsheet, preview_range: str = None) -> List[Dict[str, Any]]:
+        """
+        Reads the preview window and the dropdown rules of every worksheet in
+        two API calls, whatever the number of tabs: one lists the tab titles,
+        one `includeGridData` read (narrowed by a field mask) covers all of them.
+        """
+        window = preview_range or settings.SCHEMA_PREVIEW_RANGE
+        listing = await spreadsheet.fetch_sheet_metadata(params={"fields": "sheets.properties(sheetId,title)"})
+        titles = [sheet["properties"]["title"] for sheet in listing.get("sheets", [])]
+        if not titles:
+            return []
+
+        grid = await spreadsheet.fetch_sheet_metadata(params={
+            "includeGridData": "true",
+            "ranges": [_preview_range(title, window) for title in titles],
+            "fields": "sheets(properties(sheetId,title),data(startRow,startColumn,rowData(values(formattedValue,dataValidation))))",
+        })
+        return [_parse_preview(sheet) for sheet in grid.get("sheets", [])]
+
+    async def _summarize_worksheets(self, sheet_details: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Asks the LLM for one summary section per worksheet, in a single call."""
+        prompt = f"""
+        Analyze the following Google Sheet worksheets and generate a concise summary of each one for another AI agent.
+        The goal is to provide context so the agent can correctly add new data.
+        For each worksheet, identify the primary data table, its starting cell (e.g., A1, C5), its column headers, and the exact allowed values for any columns with dropdown menus.
+        Return exactly one entry per worksheet, using the worksheet name as given.
+        Structure data: {json.dumps(sheet_details)}
+        """
+        result = await self.llm.with_structured_output(WorksheetSummaries).ainvoke(prompt)
+        return {entry.worksheet: entry.summary for entry in result.summaries}
 
     async def refresh_schema_summary(self, spreadsheet_id: str, current_user: User):
-        """Generates and saves an AI summary of the spreadsheet's structure."""
+        """
+        Generates and saves an AI summary of the spreadsheet's structure.
+        The summary is kept per worksheet alongside a structural fingerprint, so
+        only worksheets whose structure changed are sent to the LLM again.
+        """
         if not current_user.google_refresh_token:
             raise HTTPException(status_code=400, detail="Google account not linked.")
 
-        response = self.supabase.table("spreadsheets").select("id").eq("user_id", str(current_user.id)).eq("google_spreadsheet_id", spreadsheet_id).execute()
-        if not response.data:
+        if not await self.repository.user_owns_spreadsheet(current_user.id, spreadsheet_id):
             raise HTTPException(status_code=403, detail="Access denied.")
         
         try:
-            user_creds_func = partial(get_creds_for_user, refresh_token=current_user.google_refresh_token)
-            user_agcm = gspread_asyncio.AsyncioGspreadClientManager(user_creds_func)
-            agc = await user_agcm.authorize()
+            agc = await self.gspread_pool.authorize(current_user.google_refresh_token)
             spreadsheet = await agc.open_by_key(spreadsheet_id)
             
-           # 1. Efficiently fetch all metadata for the entire spreadsheet in one API call
-            metadata = await spreadsheet.fetch_sheet_metadata()
-            
-            sheet_details = []
-            all_worksheets = await spreadsheet.worksheets()
-
-            # Create a mapping of worksheet IDs to their properties from the metadata
-            sheet_properties_map = {sheet['properties']['sheetId']: sheet for sheet in metadata['sheets']}
-
-            for ws in all_worksheets:
-                preview_data = await ws.get("A1:Z50", value_render_option='FORMATTED_VALUE')
-                
-                # 2. Find the corresponding sheet properties using the worksheet's ID
-                sheet_props = sheet_properties_map.get(ws.id)
-                
-                # 3. Safely get the data validation rules from the fetched metadata
-                validation_rules = sheet_props.get('dataValidationRules', []) if sheet_props else []
-                
-                sheet_details.append({
-                    "name": ws.title, 
-                    "preview": preview_data, 
-                    "validation_rules": str(validation_rules) # Convert rules to string for the prompt
-                })
-
-            prompt = f"""
-            Analyze the following Google Sheet structure and generate a concise summary for another AI agent.
-            The goal is to provide context so the agent can correctly add new data.
-            For each worksheet, identify the primary data table, its starting cell (e.g., A1, C5), its column headers, and the exact allowed values for any columns with dropdown menus.
-            Structure data: {json.dumps(sheet_details)}
-            
-            Summary:
-            """
-            
-            summary = (await self.llm.ainvoke(prompt)).content
-            self.supabase.table("spreadsheets").update({"schema_summary": summary}).eq("google_spreadsheet_id", spreadsheet_id).execute()
-            
-            return {"status": "success", "summary": summary}
+            # Constant cost in the number of tabs: one call lists them, one reads every preview window
+            sheet_details = await self._fetch_sheet_previews(spreadsheet)
+            titles = [sheet["name"] for sheet in sheet_details]
+            fingerprints = {sheet["name"]: _structural_fingerprint(sheet) for sheet in sheet_details}
+
+            # Only worksheets whose structure changed since the last refresh go to the LLM
+            stored_sections = await self.repository.get_schema_sections(spreadsheet_id) or {}
+            changed = [
+                sheet for sheet in sheet_details
+                if stored_sections.get(sheet["name"], {}).get("fingerprint") != fingerprints[sheet["name"]]
+            ]
+            if not changed and set(stored_sections) == set(titles):
+                return {"status": "success", "summary": _compose_summary(stored_sections, titles), "changed_worksheets": []}
+
+            new_summaries = await self._summarize_worksheets(changed) if changed else {}
+            sections = {}
+            for name in titles:
+                if name in new_summaries:
+                    sections[name] = {"fingerprint": fingerprints[name], "summary": new_summaries[name]}
+                elif stored_sections.get(name, {}).get("fingerprint") == fingerprints[name]:
+                    sections[name] = stored_sections[name]
+                else:
+                    # The LLM skipped this worksheet; leave it unfingerprinted so the next refresh retries it
+                    previous = stored_sections.get(name, {}).get("summary", "No summary available.")
+                    sections[name] = {"fingerprint": None, "summary": previous}
+
+            summary = _compose_summary(sections, titles)
+            await self.repository.update_schema_summary(spreadsheet_id, summary, sections)
+            self.schema_cache.invalidate(spreadsheet_id)
+
+            return {"status": "success", "summary": summary, "changed_worksheets": [sheet["name"] for sheet in changed]}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to analyze sheet: {e}")
\ No newline at end of file
@@ -1,20 +1,27 @@
 import uuid
-from supabase import create_client, Client
-from app.core.config import settings
+import structlog
+from app.core.user_cache import AuthenticatedUserCache
+from app.repositories.supabase_repository import SupabaseRepository
+
+log = structlog.get_logger()
 
 class UserService:
-    def __init__(self):
-        self.supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+    def __init__(self, repository: SupabaseRepository = None, user_cache: AuthenticatedUserCache = None):
+        self.repository = repository or SupabaseRepository()
+        self.user_cache = user_cache
 
-    def store_google_refresh_token(self, user_auth_id: uuid.UUID, refresh_token: str):
+    async def store_google_refresh_token(self, user_auth_id: uuid.UUID, refresh_token: str):
         """
         Stores the Google refresh token by calling a secure SQL function.
+        Raises if it could not be stored, so the caller does not report success.
         """
         try:
             # The secret key is no longer passed from here.
-            self.supabase.rpc('update_user_google_token', {
-                'user_auth_id_input': str(user_auth_id),
-                'token_input': refresh_token
-            }).execute()
-        except Exception as e:
-            print(f"Error storing refresh token: {e}")
\ No newline at end of file
+            await self.repository.update_google_token(user_auth_id, refresh_token)
+        except Exception:
+            await log.aexception("Could not store Google refresh token", auth_id=str(user_auth_id))
+            raise
+        finally:
+            # Cached users carry the old token; make the next request reload the profile
+            if self.user_cache is not None:
+                self.user_cache.invalidate_user(user_auth_id)
\ No newline at end of file
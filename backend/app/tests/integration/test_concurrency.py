@@ -1,40 +1,56 @@
 # tests/integration/test_concurrency.py
-
-import pytest
 import asyncio
-from unittest.mock import patch, MagicMock
+import pytest
 
-# It's better to test the service directly
+from app.agent import ReceiptAgent
+from app.schemas import User
 from app.services.receipt_service import ReceiptService
+from app.services.schema_summary_cache import SchemaSummaryCache
+from app.tools.gspread_writer import SheetsWriter
+from app.tools.sheets_scheduler import SheetsScheduler
+from benchmarks.fakes import FakeGspreadPool, FakeReceiptLLM, FakeSheets, FakeSupabaseRepository, Latency
+from benchmarks.harness import BenchmarkConfig, run_benchmark
+
+SUMMARY = "### Worksheet: Expenses\nDate, Item, Amount"
 
 @pytest.mark.asyncio
-@patch('app.services.receipt_service.ReceiptAgent')
-async def test_service_concurrency(MockReceiptAgent):
+async def test_service_concurrency():
     """
-    Tests that two concurrent requests to the service complete successfully
-    and that the agent is not re-initialized for every call.
+    Concurrent receipts from several users run through one shared agent graph
+    (real tool node, pooled clients) and all land in the sheet.
     """
-    # Mock the agent runnable to return a predictable response
-    mock_agent_runnable = MagicMock()
-    mock_agent_runnable.ainvoke.return_value = {"messages": [MagicMock(content="Success")]}
-    
-    # The ReceiptAgent is initialized once per service instance.
-    # The key is to ensure the underlying gspread client is not re-initialized.
-    # We can patch the tool file for a more direct test of that.
-    
-    with patch('app.tools.gspread_tool.get_creds_sync') as mock_get_creds:
-        service = ReceiptService(agent_runnable=mock_agent_runnable)
-
-        # Simulate two concurrent calls
-        task1 = service.process_receipt("id1", "ws1", b"fake_bytes", "image/png")
-        task2 = service.process_receipt("id2", "ws2", b"fake_bytes", "image/png")
-        
-        results = await asyncio.gather(task1, task2)
-
-        # Assert that both tasks completed successfully
-        assert len(results) == 2
-        assert results[0].status == "success"
-        assert results[1].status == "success"
-        
-        # Assert that credential loading was only called once, proving client reuse
-        assert mock_get_creds.call_count == 1
\ No newline at end of file
+    repository = FakeSupabaseRepository(Latency(5))
+    sheets = FakeSheets(SheetsScheduler(), Latency(5))
+    pool = FakeGspreadPool(sheets)
+    agent = ReceiptAgent(gspread_pool=pool)
+    agent.llm = agent.llm_with_tools = FakeReceiptLLM(latency_ms=20)
+    service = ReceiptService(
+        agent_runnable=agent.get_agent(),
+        repository=repository,
+        schema_cache=SchemaSummaryCache(max_size=10, ttl_seconds=60),
+        sheets_writer=SheetsWriter(pool, agent.worksheet_cache),
+    )
+    users = []
+    for index in range(4):
+        spreadsheet_id = f"{index:04d}".ljust(44, "x")
+        users.append((spreadsheet_id, User(**repository.add_user([spreadsheet_id], SUMMARY))))
+
+    results = await asyncio.gather(*(
+        service.process_receipt(spreadsheet_id, b"image-%d-%d" % (index, round), "image/png", user)
+        for round in range(3) for index, (spreadsheet_id, user) in enumerate(users)
+    ))
+
+    assert [result.status for result in results] == ["success"] * 12
+    assert sheets.appended_rows == 12
+    # One pooled client per account, however many receipts it sent
+    assert pool.stats()["clients"] == 4
+
+@pytest.mark.asyncio
+async def test_benchmark_harness_drives_every_scenario():
+    config = BenchmarkConfig(concurrency=(2,), requests=4, users=2, llm_ms=0, sheets_ms=0, supabase_ms=0)
+
+    results = await run_benchmark(config)
+
+    assert [result["scenario"] for result in results] == ["process-receipt", "canvases", "refresh-schema"]
+    assert all(result["ok"] == 4 for result in results)
+    assert all(result["p99_ms"] >= result["p50_ms"] for result in results)
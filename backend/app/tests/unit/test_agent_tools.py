@@ -0,0 +1,127 @@
+# tests/unit/test_agent_tools.py
+import asyncio
+import pytest
+from unittest.mock import patch
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from google.genai.errors import ClientError
+
+from app.agent import ReceiptAgent
+from app.tools.gspread_writer import SheetsWriter
+
+class FakeAppendTool:
+    name = "batch_append_to_sheet"
+
+    def __init__(self, delay=0.05, failing=()):
+        self.delay = delay
+        self.failing = failing
+        self.calls = []
+        self.running = self.max_running = 0
+
+    async def ainvoke(self, args, config=None):
+        self.calls.append(args)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if args["worksheet_name"] in self.failing:
+                raise RuntimeError("append rejected")
+            return {"message": f"Successfully appended {len(args['data_rows'])} rows to '{args['worksheet_name']}'."}
+        finally:
+            self.running -= 1
+
+class FakeWriter(SheetsWriter):
+    def __init__(self, **kwargs):
+        super().__init__(gspread_pool=object(), worksheet_cache=object(), **kwargs)
+
+    async def tool_config(self, refresh_token):
+        return {"configurable": {}}
+
+def _call(call_id, worksheet, rows):
+    return {"name": "batch_append_to_sheet", "id": call_id, "args": {"spreadsheet_id": "sheet", "worksheet_name": worksheet, "data_rows": rows}}
+
+def _state(*tool_calls):
+    return {"messages": [AIMessage(content="", tool_calls=list(tool_calls))], "spreadsheet_id": "sheet", "google_refresh_token": "token"}
+
+def _agent(tool, **writer_options):
+    agent = ReceiptAgent()
+    agent.sheets_writer = FakeWriter(**writer_options)
+    return agent, patch.dict("app.agent.tool_map", {"batch_append_to_sheet": tool})
+
+@pytest.mark.asyncio
+async def test_calls_to_the_same_worksheet_are_merged_and_results_keep_call_order():
+    tool = FakeAppendTool()
+    agent, tools = _agent(tool)
+    with tools:
+        update = await agent.execute_tools(_state(
+            _call("1", "Expenses", [["coffee"]]), _call("2", "Tax", [["vat"]]), _call("3", "Expenses", [["bagel"], ["tip"]]),
+        ))
+
+    assert sorted((call["worksheet_name"], len(call["data_rows"])) for call in tool.calls) == [("Expenses", 3), ("Tax", 1)]
+    assert [message.tool_call_id for message in update["messages"]] == ["1", "2", "3"]
+    assert [outcome.rows_appended for outcome in update["result"]] == [1, 1, 2]
+
+@pytest.mark.asyncio
+async def test_worksheets_are_written_concurrently_up_to_the_spreadsheet_cap():
+    tool = FakeAppendTool(delay=0.05)
+    agent, tools = _agent(tool, max_concurrent_per_spreadsheet=2)
+    with tools:
+        update = await agent.execute_tools(_state(*(_call(str(i), f"Sheet{i}", [["row"]]) for i in range(4))))
+
+    assert tool.max_running == 2
+    assert all(outcome.status == "appended" for outcome in update["result"])
+    assert agent.sheets_writer._slots == {}
+
+@pytest.mark.asyncio
+async def test_a_failed_group_fails_each_of_its_calls():
+    tool = FakeAppendTool(failing={"Tax"})
+    agent, tools = _agent(tool)
+    with tools:
+        update = await agent.execute_tools(_state(_call("1", "Tax", [["a"]]), _call("2", "Expenses", [["b"]]), _call("3", "Tax", [["c"]])))
+
+    assert [outcome.status for outcome in update["result"]] == ["failed", "appended", "failed"]
+    assert update["messages"][2].content.startswith("Error executing tool batch_append_to_sheet")
+
+class FakeWriteBehind:
+    def __init__(self):
+        self.queued = []
+
+    async def enqueue(self, auth_id, refresh_token, spreadsheet_id, worksheet_name, data_rows):
+        self.queued.append((auth_id, worksheet_name, data_rows))
+        return {"message": f"Queued {len(data_rows)} rows for '{worksheet_name}'.", "queued": True}
+
+@pytest.mark.asyncio
+async def test_write_behind_journals_appends_instead_of_writing():
+    tool = FakeAppendTool()
+    agent, tools = _agent(tool)
+    agent.write_behind = FakeWriteBehind()
+    state = _state(_call("1", "Expenses", [["coffee"]]), _call("2", "Expenses", [["bagel"]]))
+    state["user_auth_id"] = "user"
+    with tools:
+        update = await agent.execute_tools(state)
+
+    assert tool.calls == []
+    assert agent.write_behind.queued == [("user", "Expenses", [["coffee"], ["bagel"]])]
+    assert [outcome.status for outcome in update["result"]] == ["queued", "queued"]
+
+@pytest.mark.asyncio
+async def test_a_rejected_cached_prefix_is_sent_inline_for_the_rest_of_the_run():
+    class FakeLLM:
+        def __init__(self):
+            self.calls = []
+
+        async def ainvoke(self, messages, cached_content=None):
+            self.calls.append((list(messages), cached_content))
+            if cached_content is not None:
+                raise ClientError(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+            return AIMessage(content="done")
+
+    agent = ReceiptAgent()
+    agent.llm = agent.llm_with_tools = FakeLLM()
+    prefix = [SystemMessage(content="instructions"), HumanMessage(content="summary")]
+    receipt = HumanMessage(content="receipt")
+
+    update = await agent.agent_node({"messages": [receipt], "context_cache": "cachedContents/gone", "inline_prefix": prefix})
+
+    assert update["context_cache"] is None
+    assert update["messages"][0].content == "done"
+    assert agent.llm.calls[-1] == (prefix + [receipt], None)
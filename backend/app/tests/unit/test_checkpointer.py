@@ -0,0 +1,57 @@
+# tests/unit/test_checkpointer.py
+
+from langgraph.graph import StateGraph, END
+from typing import TypedDict
+
+from app.core.checkpointer import BoundedMemorySaver
+
+class _State(TypedDict):
+    payload: str
+
+def _graph(checkpointer):
+    workflow = StateGraph(_State)
+    workflow.add_node("echo", lambda state: {"payload": state["payload"]})
+    workflow.set_entry_point("echo")
+    workflow.add_edge("echo", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+def _run(graph, thread_id, payload="x" * 1000):
+    graph.invoke({"payload": payload}, {"configurable": {"thread_id": thread_id}})
+
+def test_evicts_least_recently_used_threads_over_the_thread_budget():
+    saver = BoundedMemorySaver(max_threads=2)
+    graph = _graph(saver)
+
+    for thread_id in ("a", "b", "c"):
+        _run(graph, thread_id)
+
+    stats = saver.stats()
+    assert stats["retained_threads"] == 2
+    assert stats["evicted_threads"] == 1
+    assert "a" not in saver.storage
+    assert {"b", "c"} <= set(saver.storage)
+
+def test_byte_budget_keeps_retained_bytes_flat():
+    saver = BoundedMemorySaver(max_threads=0, max_bytes=100_000)
+    graph = _graph(saver)
+    _run(graph, "probe", payload="x" * 5_000)
+    thread_bytes = saver.stats()["retained_bytes"]
+
+    for i in range(50):
+        _run(graph, f"thread-{i}", payload="x" * 5_000)
+
+    # The thread being written is never evicted, so it may overshoot by one thread
+    stats = saver.stats()
+    assert stats["retained_bytes"] <= 100_000 + thread_bytes
+    assert stats["retained_threads"] < 50
+
+def test_deleting_a_thread_releases_its_bytes():
+    saver = BoundedMemorySaver(max_threads=10)
+    graph = _graph(saver)
+    _run(graph, "a")
+    assert saver.stats()["retained_bytes"] > 0
+
+    saver.delete_thread("a")
+
+    assert saver.stats()["retained_threads"] == 0
+    assert saver.stats()["retained_bytes"] == 0
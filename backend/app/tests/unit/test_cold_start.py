@@ -0,0 +1,37 @@
+# tests/unit/test_cold_start.py
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[3]
+
+# Loaded by the registry on first use or during warm-up, never by importing the app
+DEFERRED_MODULES = [
+    "langchain_core", "langgraph", "langchain_google_genai", "google.genai",
+    "supabase", "gotrue", "gspread_asyncio", "PIL", "magic",
+]
+# Import of app.main in a fresh interpreter; the SDKs alone used to take over a second
+IMPORT_BUDGET_SECONDS = 0.8
+
+_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+def test_app_imports_fast_without_credentials_or_sdks(tmp_path):
+    # No settings in the environment and no .env in the working directory
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": str(BACKEND_DIR)}
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE % DEFERRED_MODULES],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    assert probe["loaded"] == []
+    assert probe["seconds"] < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,115 @@
+# tests/unit/test_context_cache.py
+import asyncio
+import pytest
+
+from app.core.context_cache import LocalContextCacheBackend, PromptContextCache, is_cached_content_error
+
+SUMMARY = "### Worksheet: Expenses\n" + "Date, Item, Amount. " * 50
+
+class FailingBackend(LocalContextCacheBackend):
+    async def create(self, system_instruction, summary, tools, ttl_seconds):
+        raise RuntimeError("content too small to cache")
+
+def _cache(backend=None, **overrides):
+    options = dict(ttl_seconds=3600, min_chars=100, max_entries=10)
+    options.update(overrides)
+    return PromptContextCache(backend or LocalContextCacheBackend(), **options)
+
+@pytest.mark.asyncio
+async def test_prefix_is_created_once_per_summary():
+    cache = _cache()
+
+    names = await asyncio.gather(*(cache.get("agent", "sheet-1", "instructions", SUMMARY) for _ in range(5)))
+    again = await cache.get("agent", "sheet-2", "instructions", SUMMARY)
+
+    assert len(set(names)) == 1 and again == names[0]
+    assert len(cache.backend.entries) == 1
+    assert cache.stats()["creates"] == 1
+
+@pytest.mark.asyncio
+async def test_changed_summary_replaces_the_old_prefix_without_deleting_it():
+    cache = _cache()
+    old = await cache.get("agent", "sheet-1", "instructions", SUMMARY)
+    new = await cache.get("agent", "sheet-1", "instructions", SUMMARY + " Category.")
+
+    assert new != old
+    assert cache.stats()["entries"] == 1
+    # A run started before the refresh may still be using the old prefix: it expires by TTL
+    assert list(cache.backend.entries) == [old, new]
+
+@pytest.mark.asyncio
+async def test_least_recently_used_prefixes_are_forgotten_not_deleted():
+    cache = _cache(max_entries=2)
+    names = [await cache.get("agent", f"sheet-{i}", "instructions", SUMMARY + str(i)) for i in range(3)]
+
+    assert cache.stats()["entries"] == 2
+    assert list(cache.backend.entries) == names
+
+@pytest.mark.asyncio
+async def test_a_rejected_prefix_is_replaced_on_the_next_request():
+    cache = _cache()
+    rejected = await cache.get("agent", "sheet-1", "instructions", SUMMARY)
+
+    cache.invalidate(rejected)
+
+    assert await cache.get("agent", "sheet-1", "instructions", SUMMARY) != rejected
+    assert cache.stats()["invalidations"] == 1
+
+@pytest.mark.asyncio
+async def test_kinds_get_separate_prefixes():
+    cache = _cache()
+    agent = await cache.get("agent", "sheet-1", "use the tool", SUMMARY, tools=["tool"])
+    extraction = await cache.get("extraction", "sheet-1", "return json", SUMMARY)
+
+    assert agent != extraction
+    assert cache.backend.entries[agent]["tools"] == ["tool"]
+
+@pytest.mark.asyncio
+async def test_short_summaries_and_failures_are_sent_inline():
+    assert await _cache().get("agent", "sheet-1", "instructions", "tiny") is None
+
+    failing = _cache(FailingBackend())
+    assert await failing.get("agent", "sheet-1", "instructions", SUMMARY) is None
+    assert await failing.get("agent", "sheet-1", "instructions", SUMMARY) is None
+    assert failing.stats()["failures"] == 1
+
+def test_cached_content_errors_are_recognised_by_status():
+    from google.genai.errors import ClientError
+    from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+
+    def client_error(code, status):
+        return ClientError(code, {"error": {"code": code, "message": "boom", "status": status}})
+
+    try:
+        raise ChatGoogleGenerativeAIError("Error calling model") from client_error(404, "NOT_FOUND")
+    except ChatGoogleGenerativeAIError as wrapped:
+        assert is_cached_content_error(wrapped)
+    assert is_cached_content_error(client_error(403, "PERMISSION_DENIED"))
+    assert not is_cached_content_error(client_error(429, "RESOURCE_EXHAUSTED"))
+    assert not is_cached_content_error(RuntimeError("CachedContent not found"))
+
+@pytest.mark.asyncio
+async def test_spreadsheets_tracked_for_refreshes_are_capped():
+    cache = _cache(max_entries=2)
+    for i in range(5):
+        await cache.get("agent", f"sheet-{i}", "instructions", SUMMARY)
+
+    assert list(cache._current) == [("agent", "sheet-3"), ("agent", "sheet-4")]
+
+@pytest.mark.asyncio
+async def test_gemini_prefixes_are_created_through_the_public_helper(monkeypatch):
+    import langchain_google_genai
+    from app.core.context_cache import GeminiContextCacheBackend
+    calls = []
+
+    def create_context_cache(model, messages, ttl=None, tools=None):
+        calls.append((model, [message.content for message in messages], ttl, tools))
+        return "cachedContents/abc"
+
+    monkeypatch.setattr(langchain_google_genai, "create_context_cache", create_context_cache)
+    name = await GeminiContextCacheBackend("llm").create("instructions", "summary", ["tool"], 3600)
+
+    assert name == "cachedContents/abc"
+    [(model, contents, ttl, tools)] = calls
+    assert (model, contents[0], ttl, tools) == ("llm", "instructions", "3600s", ["tool"])
+    assert "summary" in contents[1]
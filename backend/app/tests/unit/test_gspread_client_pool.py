@@ -0,0 +1,48 @@
+# tests/unit/test_gspread_client_pool.py
+import asyncio
+import time
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.tools.gspread_client_pool import GspreadClientPool
+
+def _fake_refresh(calls):
+    def refresh(creds, request):
+        time.sleep(0.05)
+        calls.append(creds.refresh_token)
+        creds.token = "access-token"
+        creds.expiry = (datetime.now(timezone.utc) + timedelta(hours=1)).replace(tzinfo=None)
+    return refresh
+
+@pytest.mark.asyncio
+async def test_concurrent_authorizations_share_one_token_refresh():
+    calls = []
+    pool = GspreadClientPool(max_size=10)
+    with patch("google.oauth2.credentials.Credentials.refresh", _fake_refresh(calls)):
+        clients = await asyncio.gather(*(pool.authorize("refresh-token") for _ in range(10)))
+        await pool.authorize("refresh-token")
+
+    assert calls == ["refresh-token"]
+    assert len({id(client) for client in clients}) == 1
+    assert pool.stats()["token_refreshes"] == 1
+
+@pytest.mark.asyncio
+async def test_least_recently_used_account_is_evicted():
+    calls = []
+    pool = GspreadClientPool(max_size=2)
+    with patch("google.oauth2.credentials.Credentials.refresh", _fake_refresh(calls)):
+        for token in ("a", "b", "c", "a"):
+            await pool.authorize(token)
+
+    assert pool.stats()["size"] == 2
+    assert calls == ["a", "b", "c", "a"]
+
+@pytest.mark.asyncio
+async def test_failed_refresh_drops_the_account():
+    pool = GspreadClientPool(max_size=2)
+    with patch("google.oauth2.credentials.Credentials.refresh", side_effect=RuntimeError("revoked")):
+        with pytest.raises(RuntimeError):
+            await pool.authorize("revoked-token")
+
+    assert pool.stats()["size"] == 0
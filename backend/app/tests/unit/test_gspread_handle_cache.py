@@ -0,0 +1,68 @@
+# tests/unit/test_gspread_handle_cache.py
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+from app.tools.gspread_handle_cache import WorksheetHandleCache
+from app.tools.gspread_tool import batch_append_to_sheet
+
+class FakeWorksheet:
+    def __init__(self, calls, title):
+        self.calls, self.title = calls, title
+
+    async def append_rows(self, rows, value_input_option=None):
+        self.calls.append(("append_rows", self.title, len(rows)))
+
+class FakeSpreadsheet:
+    def __init__(self, calls, titles):
+        self.calls, self.titles = calls, titles
+
+    async def worksheet(self, title):
+        self.calls.append(("worksheet", title))
+        if title not in self.titles:
+            raise WorksheetNotFound(title)
+        return FakeWorksheet(self.calls, title)
+
+class FakeClient:
+    def __init__(self, titles):
+        self.calls, self.titles = [], titles
+
+    async def open_by_key(self, key):
+        self.calls.append(("open_by_key", key))
+        return FakeSpreadsheet(self.calls, self.titles)
+
+def _config(client, cache):
+    return {"configurable": {"gspread_client": client, "gspread_account": "account-1", "worksheet_cache": cache}}
+
+def _args(worksheet_name="Expenses"):
+    return {"spreadsheet_id": "sheet-1", "worksheet_name": worksheet_name, "data_rows": [["a", "1"]]}
+
+@pytest.mark.asyncio
+async def test_steady_state_append_is_a_single_api_call():
+    client, cache = FakeClient({"Expenses"}), WorksheetHandleCache(max_size=10, ttl_seconds=60)
+
+    await batch_append_to_sheet.ainvoke(_args(), config=_config(client, cache))
+    client.calls.clear()
+    await batch_append_to_sheet.ainvoke(_args(), config=_config(client, cache))
+
+    assert client.calls == [("append_rows", "Expenses", 1)]
+
+@pytest.mark.asyncio
+async def test_missing_worksheet_is_not_cached():
+    client, cache = FakeClient(set()), WorksheetHandleCache(max_size=10, ttl_seconds=60)
+
+    with pytest.raises(WorksheetNotFound):
+        await batch_append_to_sheet.ainvoke(_args(), config=_config(client, cache))
+
+    client.titles.add("Expenses")
+    await batch_append_to_sheet.ainvoke(_args(), config=_config(client, cache))
+    assert client.calls[-1] == ("append_rows", "Expenses", 1)
+
+@pytest.mark.asyncio
+async def test_handles_are_scoped_to_the_account():
+    client, cache = FakeClient({"Expenses"}), WorksheetHandleCache(max_size=10, ttl_seconds=60)
+    await cache.get_worksheet(client, "account-1", "sheet-1", "Expenses")
+    client.calls.clear()
+
+    await cache.get_worksheet(client, "account-2", "sheet-1", "Expenses")
+
+    assert ("open_by_key", "sheet-1") in client.calls
@@ -0,0 +1,63 @@
+# tests/unit/test_image_intake.py
+import io
+import pytest
+from PIL import Image
+
+from app.services.image_intake import InvalidImageError, prepare_image
+
+def _encode(img, fmt, **options):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+def test_large_photo_is_downscaled_and_reencoded_as_jpeg():
+    photo = Image.effect_noise((3000, 2000), 64).convert("RGB")
+    original = _encode(photo, "PNG")
+
+    prepared = prepare_image(original, max_edge=1600, output_format="JPEG", quality=85)
+
+    assert prepared.content_type == "image/jpeg"
+    assert max(prepared.width, prepared.height) == 1600
+    assert prepared.original_bytes == len(original)
+    assert len(prepared.data) < len(original)
+
+def test_exif_orientation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    original = _encode(Image.new("RGB", (400, 200), "white"), "JPEG", exif=exif)
+
+    prepared = prepare_image(original, max_edge=2048, output_format="JPEG", quality=85)
+
+    assert (prepared.width, prepared.height) == (200, 400)
+
+def test_transparent_images_are_flattened_for_jpeg():
+    original = _encode(Image.new("RGBA", (50, 50), (0, 0, 0, 0)), "PNG")
+
+    prepared = prepare_image(original, max_edge=2048, output_format="JPEG", quality=85)
+
+    with Image.open(io.BytesIO(prepared.data)) as img:
+        assert img.mode == "RGB"
+        assert img.getpixel((0, 0)) == (255, 255, 255)
+
+@pytest.mark.parametrize("payload", [b"", b"%PDF-1.4 not an image", b"\x89PNG\r\n\x1a\n" + b"\x00" * 64])
+def test_invalid_uploads_are_rejected(payload):
+    with pytest.raises(InvalidImageError):
+        prepare_image(payload, max_edge=2048, output_format="JPEG", quality=85)
+
+@pytest.mark.asyncio
+async def test_intake_can_prepare_in_a_process_pool(monkeypatch):
+    from app.core.config import settings
+    from app.services.image_intake import ImageIntake
+    monkeypatch.setattr(settings, "IMAGE_EXECUTOR", "process")
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 1)
+
+    intake = ImageIntake()
+    try:
+        prepared = await intake.prepare(_encode(Image.new("RGB", (400, 200), "white"), "PNG"))
+        with pytest.raises(InvalidImageError):
+            await intake.prepare(b"%PDF-1.4 not an image")
+    finally:
+        intake.close()
+
+    assert prepared.content_type == "image/jpeg"
+    assert (prepared.width, prepared.height) == (400, 200)
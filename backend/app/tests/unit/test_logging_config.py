@@ -0,0 +1,40 @@
+# tests/unit/test_logging_config.py
+import json
+import pytest
+import structlog
+
+from app.core.logging_config import make_redactor, make_sampler
+
+def test_redactor_replaces_every_secret_in_string_fields():
+    redact = make_redactor(["secret-key", "secret-key-long", None, ""])
+    event = {"event": "Calling with secret-key-long", "detail": "a secret-key and secret-key", "count": 3}
+
+    assert redact(None, "info", event) == {
+        "event": "Calling with [REDACTED]",
+        "detail": "a [REDACTED] and [REDACTED]",
+        "count": 3,
+    }
+
+def test_redactor_without_secrets_is_a_no_op():
+    event = {"event": "nothing to hide"}
+    assert make_redactor([None])(None, "info", event) == {"event": "nothing to hide"}
+
+def test_sampler_drops_a_fraction_of_listed_info_events(monkeypatch):
+    sample = make_sampler({"Sheets call queued for quota": 0.1})
+    monkeypatch.setattr("app.core.logging_config.random.random", lambda: 0.5)
+
+    with pytest.raises(structlog.DropEvent):
+        sample(None, "info", {"event": "Sheets call queued for quota"})
+    # Unlisted events and warnings are always kept
+    assert sample(None, "info", {"event": "Request finished"}) == {"event": "Request finished"}
+    assert sample(None, "warning", {"event": "Sheets call queued for quota"}) == {"event": "Sheets call queued for quota"}
+
+    monkeypatch.setattr("app.core.logging_config.random.random", lambda: 0.05)
+    assert sample(None, "info", {"event": "Sheets call queued for quota"})["sample_rate"] == 0.1
+
+def test_serializer_accepts_what_the_stdlib_encoder_accepts():
+    from app.core.logging_config import _serializer
+    dumps = _serializer()
+
+    assert json.loads(dumps({"per_index": {0: "ok"}})) == {"per_index": {"0": "ok"}}
+    assert json.loads(dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
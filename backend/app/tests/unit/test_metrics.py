@@ -0,0 +1,58 @@
+# tests/unit/test_metrics.py
+from langchain_core.messages import AIMessage
+from prometheus_client import REGISTRY
+
+from app.core import metrics
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_span_adds_to_the_current_requests_timings():
+    before = _sample("receipt_stage_duration_seconds_count", stage="sheets_append")
+    timings = {}
+    token = metrics._stage_timings.set(timings)
+    try:
+        with metrics.span("sheets_append"):
+            pass
+        with metrics.span("sheets_append"):
+            pass
+    finally:
+        metrics._stage_timings.reset(token)
+
+    assert list(timings) == ["sheets_append"]
+    assert _sample("receipt_stage_duration_seconds_count", stage="sheets_append") == before + 2
+
+def test_llm_usage_is_counted_by_direction():
+    kinds = ("input", "output", "cached")
+    before = {kind: _sample("llm_tokens_total", call="test", kind=kind) for kind in kinds}
+    message = AIMessage(content="", usage_metadata={
+        "input_tokens": 1200, "output_tokens": 40, "total_tokens": 1240, "input_token_details": {"cache_read": 1000},
+    })
+    metrics.record_llm_usage("test", message)
+    metrics.record_llm_usage("test", AIMessage(content="no usage reported"))
+
+    added = {kind: _sample("llm_tokens_total", call="test", kind=kind) - before[kind] for kind in kinds}
+    assert added == {"input": 1200, "output": 40, "cached": 1000}
+
+def test_component_stats_are_flattened_into_gauges():
+    metrics.record_component_stats({"worksheet_cache": {"worksheets": {"hits": 3}}, "receipt_jobs": {"backend": "memory"}})
+
+    assert _sample("app_component_stat", component="worksheet_cache", stat="worksheets.hits") == 3
+    assert b'component="receipt_jobs"' not in metrics.render()
+
+def test_only_plain_request_ids_are_trusted():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    metrics.register_request_tracing(app)
+
+    @app.get("/ping")
+    async def ping():
+        return {}
+
+    client = TestClient(app)
+    assert client.get("/ping", headers={"X-Request-ID": "abc-123"}).headers["X-Request-ID"] == "abc-123"
+    for unsafe in ("a" * 65, "id with spaces", "id\\u2028forged"):
+        echoed = client.get("/ping", headers={"X-Request-ID": unsafe}).headers["X-Request-ID"]
+        assert echoed != unsafe and len(echoed) == 32
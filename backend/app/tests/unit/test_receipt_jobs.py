@@ -0,0 +1,117 @@
+# tests/unit/test_receipt_jobs.py
+import uuid
+import asyncio
+import pytest
+from datetime import datetime, timezone
+
+from app.core.exception_handlers import AgentLogicError, QueueFullError
+from app.schemas import AgentResponse, ReceiptJob, User
+from app.services.receipt_jobs import InMemoryJobBackend, ReceiptJobRequest, ReceiptJobRunner
+
+def _user():
+    return User(id=uuid.uuid4(), auth_id=uuid.uuid4(), email="user@example.com", google_refresh_token="token", created_at=datetime.now())
+
+def _job(user, job_id):
+    job = ReceiptJob(job_id=job_id, user_id=user.id, spreadsheet_id="sheet", created_at=datetime.now(timezone.utc))
+    request = ReceiptJobRequest(spreadsheet_id="sheet", image_bytes=b"img", image_content_type="image/jpeg", user_id=user.id, auth_id=user.auth_id)
+    return job, request
+
+class FakeRepository:
+    """Profiles by auth id, with the token as stored now."""
+    def __init__(self, *users):
+        self.users = {user.auth_id: user for user in users}
+
+    async def get_decrypted_user(self, auth_id):
+        user = self.users.get(auth_id)
+        return user.model_dump() if user else None
+
+class FakeReceiptService:
+    def __init__(self):
+        self.tokens = []
+
+    async def process_receipt(self, spreadsheet_id, image_bytes, image_content_type, current_user):
+        self.tokens.append(current_user.google_refresh_token)
+        await asyncio.sleep(0)
+        if image_bytes == b"bad":
+            raise AgentLogicError("Could not read the receipt.")
+        return AgentResponse(status="success", message="Added 1 row.")
+
+@pytest.mark.asyncio
+async def test_users_are_served_round_robin():
+    backend = InMemoryJobBackend(max_queued=10, max_queued_per_user=10, result_ttl_seconds=60)
+    heavy, light = _user(), _user()
+    for i in range(3):
+        await backend.enqueue(*_job(heavy, f"heavy-{i}"))
+    await backend.enqueue(*_job(light, "light-0"))
+
+    order = [(await backend.dequeue())[0].job_id for _ in range(4)]
+
+    assert order == ["heavy-0", "light-0", "heavy-1", "heavy-2"]
+
+@pytest.mark.asyncio
+async def test_full_queue_applies_backpressure():
+    backend = InMemoryJobBackend(max_queued=3, max_queued_per_user=2, result_ttl_seconds=60)
+    user = _user()
+    for i in range(2):
+        await backend.enqueue(*_job(user, f"job-{i}"))
+
+    with pytest.raises(QueueFullError):
+        await backend.enqueue(*_job(user, "one-too-many"))
+    await backend.enqueue(*_job(_user(), "other-user"))
+    with pytest.raises(QueueFullError):
+        await backend.enqueue(*_job(_user(), "queue-full"))
+
+@pytest.mark.asyncio
+async def test_workers_run_jobs_and_record_outcomes():
+    user, stranger = _user(), _user()
+    runner = ReceiptJobRunner(FakeReceiptService(), FakeRepository(user), backend=InMemoryJobBackend(10, 10, 60), workers=2)
+    runner.start()
+    try:
+        ok = await runner.submit("sheet", b"img", "image/jpeg", user)
+        bad = await runner.submit("sheet", b"bad", "image/jpeg", user)
+        for _ in range(50):
+            jobs = [await runner.get(ok.job_id, user), await runner.get(bad.job_id, user)]
+            if all(job.finished_at for job in jobs):
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await runner.stop()
+
+    assert jobs[0].status == "succeeded" and jobs[0].result.message == "Added 1 row."
+    assert jobs[1].status == "failed" and jobs[1].error == "Could not read the receipt."
+    assert await runner.get(ok.job_id, stranger) is None
+
+@pytest.mark.asyncio
+async def test_stop_drains_running_and_queued_jobs():
+    class SlowReceiptService(FakeReceiptService):
+        async def process_receipt(self, *args, **kwargs):
+            await asyncio.sleep(0.05)
+            return await super().process_receipt(*args, **kwargs)
+
+    user = _user()
+    runner = ReceiptJobRunner(SlowReceiptService(), FakeRepository(user), backend=InMemoryJobBackend(10, 10, 60), workers=1)
+    runner.start()
+    jobs = [await runner.submit("sheet", b"img", "image/jpeg", user) for _ in range(3)]
+
+    await runner.stop(drain_timeout=5)
+
+    assert [(await runner.get(job.job_id, user)).status for job in jobs] == ["succeeded"] * 3
+
+@pytest.mark.asyncio
+async def test_jobs_queue_no_credentials_and_run_with_the_current_token():
+    user = _user()
+    repository, service = FakeRepository(user), FakeReceiptService()
+    backend = InMemoryJobBackend(10, 10, 60)
+    runner = ReceiptJobRunner(service, repository, backend=backend, workers=1)
+
+    job = await runner.submit("sheet", b"img", "image/jpeg", user)
+    queued_request = backend._requests[job.job_id]
+    assert "token" not in queued_request.model_dump_json()
+
+    # The user reconnects Google before the job runs
+    repository.users[user.auth_id] = user.model_copy(update={"google_refresh_token": "new-token"})
+    runner.start()
+    await runner.stop(drain_timeout=5)
+
+    assert service.tokens == ["new-token"]
+    assert (await runner.get(job.job_id, user)).status == "succeeded"
@@ -0,0 +1,416 @@
+# tests/unit/test_receipt_service.py
+import uuid
+import asyncio
+import pytest
+from datetime import datetime
+from gspread.exceptions import WorksheetNotFound
+from langchain_core.messages import AIMessage, SystemMessage
+from google.genai.errors import ClientError
+
+from app.core.context_cache import LocalContextCacheBackend, PromptContextCache
+from app.core.exception_handlers import AgentLogicError
+from app.schemas import ReceiptExtraction, ToolOutcome, User
+from app.services.receipt_service import ReceiptService
+from app.services.receipt_result_cache import ReceiptResultCache
+from app.services.schema_summary_cache import SchemaSummaryCache
+
+SPREADSHEET_ID = "a" * 44
+
+def _appended(worksheet_name, rows, turn=1):
+    return ToolOutcome(tool="batch_append_to_sheet", status="appended", worksheet_name=worksheet_name, rows_appended=rows, message="ok", turn=turn)
+
+class FakeAgent:
+    def __init__(self):
+        self.states = []
+
+    async def ainvoke(self, state, config=None):
+        self.states.append(state)
+        return {
+            "messages": state["messages"] + [AIMessage(content="Added 2 rows to 'Expenses'.")],
+            "result": [_appended("Expenses", 2)],
+        }
+
+class FakeRepository:
+    def __init__(self, owned=True):
+        self.owned = owned
+        self.lookups = 0
+
+    async def get_owned_spreadsheet(self, user_id, spreadsheet_id):
+        self.lookups += 1
+        return {"id": "row-1", "schema_summary": "Expenses: Date, Item, Amount"} if self.owned else None
+
+def _user():
+    return User(id=uuid.uuid4(), auth_id=uuid.uuid4(), email="user@example.com", google_refresh_token="token", created_at=datetime.now())
+
+def _service(repository, cache=None):
+    return ReceiptService(agent_runnable=FakeAgent(), repository=repository, schema_cache=cache or SchemaSummaryCache(max_size=10, ttl_seconds=60))
+
+@pytest.mark.asyncio
+async def test_schema_summary_lookup_is_cached_per_user_and_spreadsheet():
+    repository, user = FakeRepository(), _user()
+    service = _service(repository)
+
+    for _ in range(3):
+        await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+
+    assert repository.lookups == 1
+    prompt = service.agent_runnable.states[-1]["messages"][1].content[0]["text"]
+    assert "Expenses: Date, Item, Amount" in prompt
+
+@pytest.mark.asyncio
+async def test_invalidation_forces_a_fresh_lookup():
+    repository, user, cache = FakeRepository(), _user(), SchemaSummaryCache(max_size=10, ttl_seconds=60)
+    service = _service(repository, cache)
+
+    await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+    cache.invalidate(SPREADSHEET_ID)
+    await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+
+    assert repository.lookups == 2
+
+@pytest.mark.asyncio
+async def test_unowned_spreadsheets_are_not_cached():
+    repository, user = FakeRepository(owned=False), _user()
+    service = _service(repository)
+
+    for _ in range(2):
+        with pytest.raises(AgentLogicError):
+            await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+
+    assert repository.lookups == 2
+
+class SlowAgent(FakeAgent):
+    async def ainvoke(self, state, config=None):
+        await asyncio.sleep(0.05)
+        return await super().ainvoke(state, config)
+
+@pytest.mark.asyncio
+async def test_duplicate_receipts_reuse_the_first_result():
+    service = _service(FakeRepository())
+    service.agent_runnable = SlowAgent()
+    service.result_cache = ReceiptResultCache(path=":memory:", ttl_seconds=60)
+    user = _user()
+
+    concurrent = await asyncio.gather(*(service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user) for _ in range(3)))
+    later = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+    other = await service.process_receipt(SPREADSHEET_ID, b"another image", "image/png", user)
+
+    assert len(service.agent_runnable.states) == 2
+    assert all(response == later for response in concurrent)
+    assert other.status == "success"
+    assert service.result_cache.stats()["in_flight_joins"] == 2
+
+@pytest.mark.asyncio
+async def test_failed_runs_are_not_cached():
+    class FailingAgent(FakeAgent):
+        async def ainvoke(self, state, config=None):
+            self.states.append(state)
+            return {"messages": [AIMessage(content="Error executing tool batch_append_to_sheet")]}
+
+    service = _service(FakeRepository())
+    service.agent_runnable = FailingAgent()
+    service.result_cache = ReceiptResultCache(path=":memory:", ttl_seconds=60)
+    user = _user()
+
+    for _ in range(2):
+        with pytest.raises(AgentLogicError):
+            await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+
+    assert len(service.agent_runnable.states) == 2
+
+class DeferringAgent(FakeAgent):
+    """Returns one deferred append per image; images named b"bad..." extract nothing."""
+    async def ainvoke(self, state, config=None):
+        self.states.append(state)
+        image_url = state["messages"][-1].content[1]["image_url"]
+        if "YmFk" in image_url: # base64 of b"bad"
+            return {"messages": [AIMessage(content="The image is not a receipt.")], "pending_appends": []}
+        worksheet = "Fuel" if "ZnVlbA" in image_url else "Expenses" # base64 of b"fuel"
+        return {"messages": [], "pending_appends": [{"spreadsheet_id": state["spreadsheet_id"], "worksheet_name": worksheet, "data_rows": [["2024-01-01", "item", "1.00"]]}]}
+
+class FakeSheetsWriter:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    async def append_rows(self, refresh_token, spreadsheet_id, worksheet_name, data_rows):
+        self.calls.append((worksheet_name, len(data_rows)))
+        if worksheet_name in self.failing:
+            raise RuntimeError("quota exceeded")
+        return {"message": "ok"}
+
+@pytest.mark.asyncio
+async def test_batch_writes_each_worksheet_once():
+    service = _service(FakeRepository())
+    service.agent_runnable = DeferringAgent()
+    service.sheets_writer = FakeSheetsWriter()
+    images = [(b"receipt-%d" % i, "image/jpeg") for i in range(5)] + [(b"fuel", "image/jpeg"), (b"bad", "image/jpeg")]
+
+    response = await service.process_receipt_batch(SPREADSHEET_ID, images, _user())
+
+    assert sorted(service.sheets_writer.calls) == [("Expenses", 5), ("Fuel", 1)]
+    assert response.status == "partial"
+    assert response.appended_rows == {"Expenses": 5, "Fuel": 1}
+    assert [result.status for result in response.results] == ["success"] * 6 + ["failed"]
+    assert response.results[-1].message == "The image is not a receipt."
+    assert all(state["defer_writes"] for state in service.agent_runnable.states)
+
+@pytest.mark.asyncio
+async def test_failed_worksheet_write_fails_only_its_receipts():
+    service = _service(FakeRepository())
+    service.agent_runnable = DeferringAgent()
+    service.sheets_writer = FakeSheetsWriter(failing={"Fuel"})
+
+    response = await service.process_receipt_batch(SPREADSHEET_ID, [(b"receipt", "image/jpeg"), (b"fuel", "image/jpeg")], _user())
+
+    assert [result.status for result in response.results] == ["success", "failed"]
+    assert "quota exceeded" in response.results[1].message
+    assert response.appended_rows == {"Expenses": 1}
+
+@pytest.mark.asyncio
+async def test_a_retried_batch_does_not_write_its_receipts_again():
+    service = _service(FakeRepository())
+    service.agent_runnable = DeferringAgent()
+    service.sheets_writer = FakeSheetsWriter()
+    service.result_cache = ReceiptResultCache(path=":memory:", ttl_seconds=60)
+    user = _user()
+    images = [(b"receipt", "image/jpeg"), (b"fuel", "image/jpeg"), (b"receipt", "image/jpeg")]
+
+    first = await service.process_receipt_batch(SPREADSHEET_ID, images, user)
+    retry = await service.process_receipt_batch(SPREADSHEET_ID, images, user)
+
+    assert sorted(service.sheets_writer.calls) == [("Expenses", 1), ("Fuel", 1)]
+    assert first.results[2].message == "Same image as receipt 0."
+    assert retry.status == "success" and retry.appended_rows == {}
+    assert retry.results[0].message.startswith("Already processed")
+
+@pytest.mark.asyncio
+async def test_a_receipt_written_to_only_some_worksheets_is_partial():
+    class SplittingAgent(FakeAgent):
+        async def ainvoke(self, state, config=None):
+            self.states.append(state)
+            rows = [["2024-01-01", "item", "1.00"]]
+            return {"messages": [], "pending_appends": [
+                {"spreadsheet_id": state["spreadsheet_id"], "worksheet_name": "Expenses", "data_rows": rows * 2},
+                {"spreadsheet_id": state["spreadsheet_id"], "worksheet_name": "Tax", "data_rows": rows},
+            ]}
+
+    service = _service(FakeRepository())
+    service.agent_runnable = SplittingAgent()
+    service.sheets_writer = FakeSheetsWriter(failing={"Tax"})
+
+    response = await service.process_receipt_batch(SPREADSHEET_ID, [(b"receipt", "image/jpeg")], _user())
+
+    [result] = response.results
+    assert (response.status, result.status, result.retryable) == ("partial", "partial", False)
+    assert "'Expenses'" in result.message and "could not write rows to 'Tax'" in result.message
+    assert response.appended_rows == {"Expenses": 2}
+
+class StreamingAgent(FakeAgent):
+    def __init__(self):
+        super().__init__()
+        self.closed = False
+
+    async def astream_events(self, state, config=None, version=None):
+        self.states.append(state)
+        try:
+            yield {"event": "on_chat_model_stream", "name": "model", "data": {"chunk": AIMessage(content="Reading")}, "parent_ids": ["root"]}
+            yield {"event": "on_chat_model_end", "name": "model", "data": {"output": AIMessage(content="", tool_calls=[{"name": "batch_append_to_sheet", "args": {}, "id": "1"}])}, "parent_ids": ["root"]}
+            yield {"event": "on_chain_start", "name": "action", "metadata": {"langgraph_node": "action"}, "data": {}, "parent_ids": ["root"]}
+            await asyncio.sleep(0)
+            yield {"event": "on_chain_end", "name": "action", "metadata": {"langgraph_node": "action"}, "data": {"output": {"result": [_appended("Expenses", 2)]}}, "parent_ids": ["root"]}
+            yield {"event": "on_chain_end", "name": "LangGraph", "data": {"output": {"messages": [AIMessage(content="Added 2 rows to 'Expenses'.")], "result": [_appended("Expenses", 2)]}}, "parent_ids": []}
+        finally:
+            self.closed = True
+
+@pytest.mark.asyncio
+async def test_stream_reports_progress_and_result():
+    service = _service(FakeRepository())
+    service.agent_runnable = StreamingAgent()
+
+    events = [event async for event in await service.stream_receipt(SPREADSHEET_ID, b"image", "image/png", _user())]
+
+    assert [name for name, _ in events] == ["accepted", "token", "extracted", "tool_started", "tool_finished", "result"]
+    assert events[-1][1] == {"status": "success", "message": "Added 2 rows to 'Expenses'.", "rows_appended": 2, "queued": False}
+
+@pytest.mark.asyncio
+async def test_closing_the_stream_stops_the_run():
+    service = _service(FakeRepository())
+    service.agent_runnable = StreamingAgent()
+
+    events = await service.stream_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+    async for name, _ in events:
+        if name == "tool_started":
+            break
+    await events.aclose()
+
+    assert service.agent_runnable.closed
+
+@pytest.mark.asyncio
+async def test_stream_checks_access_before_streaming():
+    service = _service(FakeRepository(owned=False))
+    service.agent_runnable = StreamingAgent()
+
+    with pytest.raises(AgentLogicError):
+        await service.stream_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+    assert service.agent_runnable.states == []
+
+class FakeExtractor:
+    def __init__(self, extraction):
+        self.extraction = extraction
+        self.messages = []
+
+    async def extract(self, messages, cached_content=None):
+        self.messages.append(messages)
+        return self.extraction
+
+_FAST_USER = _user()
+
+SECTIONED_SUMMARY = "### Worksheet: Expenses\nDate, Item, Amount\n\n### Worksheet: Income\nDate, Source, Amount"
+
+def _fast_path_service(extraction, writer=None):
+    repository = FakeRepository()
+    service = _service(repository)
+    service.sheets_writer = writer or FakeSheetsWriter()
+    service.extractor = FakeExtractor(extraction)
+    service.schema_cache.set(_FAST_USER.id, SPREADSHEET_ID, {"id": "row-1", "schema_summary": SECTIONED_SUMMARY})
+    return service
+
+@pytest.mark.asyncio
+async def test_fast_path_writes_without_the_agent_loop():
+    service = _fast_path_service(ReceiptExtraction(worksheet_name="Expenses", data_rows=[["2024-01-01", "Coffee", "3.50"]]))
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _FAST_USER)
+
+    assert response.status == "success"
+    assert "1 rows to 'Expenses'" in response.message
+    assert service.sheets_writer.calls == [("Expenses", 1)]
+    assert service.agent_runnable.states == []
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("worksheet_name, data_rows", [
+    ("Groceries", [["2024-01-01", "Coffee", "3.50"]]), # not in the summary
+    ("Expenses", []),
+    ("Expenses", [["2024-01-01", "Coffee", "3.50"], ["2024-01-01"]]),
+])
+async def test_invalid_extractions_fall_back_to_the_agent(worksheet_name, data_rows):
+    service = _fast_path_service(ReceiptExtraction(worksheet_name=worksheet_name, data_rows=data_rows))
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _FAST_USER)
+
+    assert response.message == "Added 2 rows to 'Expenses'."
+    assert service.sheets_writer.calls == []
+    assert len(service.agent_runnable.states) == 1
+
+@pytest.mark.asyncio
+async def test_missing_worksheet_falls_back_to_the_agent():
+
+    class MissingWorksheetWriter(FakeSheetsWriter):
+        async def append_rows(self, refresh_token, spreadsheet_id, worksheet_name, data_rows):
+            raise WorksheetNotFound(worksheet_name)
+
+    service = _fast_path_service(ReceiptExtraction(worksheet_name="Income", data_rows=[["2024-01-01", "Client", "100"]]), MissingWorksheetWriter())
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _FAST_USER)
+
+    assert response.message == "Added 2 rows to 'Expenses'."
+    assert len(service.agent_runnable.states) == 1
+
+@pytest.mark.asyncio
+async def test_cached_prefix_is_not_resent():
+    service = _service(FakeRepository())
+    service.prompt_cache = PromptContextCache(LocalContextCacheBackend(), ttl_seconds=3600, min_chars=0, max_entries=10)
+    user = _user()
+
+    for _ in range(2):
+        await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", user)
+
+    first, second = service.agent_runnable.states
+    assert first["context_cache"] == second["context_cache"] is not None
+    assert len(second["messages"]) == 1 # no system message
+    assert "Expenses: Date, Item, Amount" not in second["messages"][0].content[0]["text"]
+    assert len(service.prompt_cache.backend.entries) == 1
+
+@pytest.mark.asyncio
+async def test_a_rejected_cached_prefix_is_retried_inline():
+
+    class RejectingExtractor(FakeExtractor):
+        async def extract(self, messages, cached_content=None):
+            if cached_content is not None:
+                raise ClientError(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+            return await super().extract(messages)
+
+    service = _fast_path_service(ReceiptExtraction(worksheet_name="Expenses", data_rows=[["2024-01-01", "Coffee", "3.50"]]))
+    service.extractor = RejectingExtractor(service.extractor.extraction)
+    service.prompt_cache = PromptContextCache(LocalContextCacheBackend(), ttl_seconds=3600, min_chars=0, max_entries=10)
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _FAST_USER)
+
+    assert response.status == "success"
+    [messages] = service.extractor.messages
+    assert isinstance(messages[0], SystemMessage) # sent inline
+    assert service.prompt_cache.stats() == {"entries": 0, "hits": 0, "creates": 1, "failures": 0, "invalidations": 1}
+
+class OutcomeAgent(FakeAgent):
+    def __init__(self, text, outcomes):
+        super().__init__()
+        self.text, self.outcomes = text, outcomes
+
+    async def ainvoke(self, state, config=None):
+        self.states.append(state)
+        return {"messages": [AIMessage(content=self.text)], "result": self.outcomes}
+
+def _failed(error_class, retryable, worksheet_name="Expenses", turn=1):
+    return ToolOutcome(
+        tool="batch_append_to_sheet", status="failed", worksheet_name=worksheet_name, error_class=error_class,
+        retryable=retryable, message="Error executing tool batch_append_to_sheet: boom", turn=turn,
+    )
+
+@pytest.mark.asyncio
+async def test_success_is_not_decided_by_the_wording_of_the_reply():
+    service = _service(FakeRepository())
+    service.agent_runnable = OutcomeAgent("Added 1 row for Unexpected Café; nothing failed.", [_appended("Expenses", 1)])
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+
+    assert response.status == "success"
+    assert response.rows_appended == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("outcome, retryable", [(_failed("APIError(429)", True), True), (_failed("WorksheetNotFound", False), False)])
+async def test_failures_carry_whether_a_retry_can_help(outcome, retryable):
+    service = _service(FakeRepository())
+    service.agent_runnable = OutcomeAgent("All done!", [outcome])
+
+    with pytest.raises(AgentLogicError) as raised:
+        await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+    assert raised.value.retryable is retryable
+
+@pytest.mark.asyncio
+async def test_a_corrected_failure_counts_as_success():
+    service = _service(FakeRepository())
+    service.agent_runnable = OutcomeAgent("Added to 'Expenses' after retrying.", [_failed("WorksheetNotFound", False), _appended("Expenses", 3, turn=2)])
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+
+    assert response.status == "success"
+    assert response.rows_appended == 3
+
+@pytest.mark.asyncio
+async def test_a_failure_beside_a_success_in_the_same_turn_is_reported():
+    service = _service(FakeRepository())
+    service.agent_runnable = OutcomeAgent("Added 2 rows.", [_failed("WorksheetNotFound", False, worksheet_name="Tax"), _appended("Expenses", 2)])
+
+    response = await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+
+    assert response.status == "partial"
+    assert response.rows_appended == 2
+    assert "could not be written" in response.message
+
+@pytest.mark.asyncio
+async def test_a_run_that_appends_nothing_fails():
+    service = _service(FakeRepository())
+    service.agent_runnable = OutcomeAgent("This image is not a receipt.", [])
+
+    with pytest.raises(AgentLogicError, match="not a receipt") as raised:
+        await service.process_receipt(SPREADSHEET_ID, b"image", "image/png", _user())
+    assert raised.value.retryable is False
@@ -0,0 +1,29 @@
+# tests/unit/test_registry.py
+import pytest
+
+from app.core.registry import AppRegistry
+
+@pytest.mark.asyncio
+async def test_failed_background_warm_up_is_retried_and_starts_the_workers(monkeypatch):
+    registry = AppRegistry()
+    builds, started = [], []
+
+    def startup():
+        builds.append(True)
+        if len(builds) == 1:
+            raise ConnectionError("Supabase is down")
+
+    monkeypatch.setattr(registry, "startup", startup)
+    monkeypatch.setattr(registry, "start_background", lambda: started.append(True))
+
+    registry.start_warm_up(prime=False)
+    await registry._warm_up_task
+    assert isinstance(registry.startup_error, ConnectionError)
+    assert started == []
+
+    await registry.ready()
+    assert registry.startup_error is None
+    assert started == [True]
+
+    await registry.ready()
+    assert len(builds) == 2
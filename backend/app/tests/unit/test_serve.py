@@ -0,0 +1,47 @@
+# tests/unit/test_serve.py
+import os
+
+from app.core.config import available_cpus
+
+def _affinity():
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+def test_cpu_count_is_capped_by_the_container_quota(tmp_path):
+    cpu_max = tmp_path / "cpu.max"
+    cpu_max.write_text("150000 100000\n") # 1.5 CPUs
+
+    assert available_cpus(str(cpu_max)) == min(_affinity(), 2)
+
+def test_cpu_count_without_a_quota_is_the_affinity_mask(tmp_path):
+    cpu_max = tmp_path / "cpu.max"
+    cpu_max.write_text("max 100000\n")
+
+    assert available_cpus(str(cpu_max)) == _affinity()
+    assert available_cpus(str(tmp_path / "missing")) == _affinity()
+
+def test_several_workers_need_a_shared_job_backend(monkeypatch, capsys):
+    import sys
+    import pytest
+    from app import serve
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "RECEIPT_JOB_BACKEND", "memory")
+    monkeypatch.setattr(sys, "argv", ["app.serve", "--workers", "2"])
+    monkeypatch.setattr(serve.uvicorn, "run", lambda *args, **kwargs: pytest.fail("should not start"))
+
+    with pytest.raises(SystemExit):
+        serve.main()
+
+    assert "RECEIPT_JOB_BACKEND=memory" in capsys.readouterr().err
+
+def test_image_pools_share_the_cpus_between_workers(monkeypatch):
+    from app.core.config import settings
+    from app.services import image_intake
+    monkeypatch.setattr(image_intake, "available_cpus", lambda: 8)
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 0)
+
+    monkeypatch.setattr(settings, "WEB_WORKERS", 3)
+    assert image_intake.image_pool_size() == 2
+    monkeypatch.setattr(settings, "WEB_WORKERS", 16)
+    assert image_intake.image_pool_size() == 1
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 5)
+    assert image_intake.image_pool_size() == 5
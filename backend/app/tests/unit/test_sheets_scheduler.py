@@ -0,0 +1,139 @@
+# tests/unit/test_sheets_scheduler.py
+import time
+import asyncio
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+from app.tools.sheets_scheduler import ScheduledClientManager, SheetsScheduler, TokenBucket
+
+def _api_error(status_code: int) -> APIError:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b'{"error": {"code": %d, "message": "quota", "status": "RESOURCE_EXHAUSTED"}}' % status_code
+    return APIError(response)
+
+def _scheduler(**overrides):
+    options = dict(
+        user_reads_per_minute=6000, user_writes_per_minute=6000,
+        project_reads_per_minute=6000, project_writes_per_minute=6000,
+        burst=100, max_retries=3, backoff_base=0.001, backoff_max=0.01, max_accounts=10,
+    )
+    options.update(overrides)
+    return SheetsScheduler(**options)
+
+def _manager(scheduler, account="account"):
+    return ScheduledClientManager(lambda: None, scheduler=scheduler, account=account)
+
+def _flaky(failures, status_code=429, name="append_rows", error=None):
+    calls = []
+    def method():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error or _api_error(status_code)
+        return "ok"
+    method.__name__ = name
+    return method, calls
+
+def _connection_refused() -> requests.ConnectionError:
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    return requests.ConnectionError(MaxRetryError(None, "/v4/spreadsheets", NewConnectionError(None, "Connection refused")))
+
+@pytest.mark.asyncio
+async def test_bucket_queues_calls_beyond_the_burst():
+    bucket = TokenBucket(rate_per_minute=600, burst=2) # one token every 0.1 s
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(4)))
+
+    assert time.monotonic() - started >= 0.18
+
+@pytest.mark.asyncio
+async def test_rate_limited_calls_are_retried_then_succeed():
+    scheduler = _scheduler()
+    method, calls = _flaky(failures=2)
+
+    assert await _manager(scheduler)._call(method) == "ok"
+    assert len(calls) == 3
+    assert scheduler.stats()["retries"] == 2
+
+@pytest.mark.asyncio
+async def test_retries_are_bounded():
+    scheduler = _scheduler(max_retries=2)
+    method, calls = _flaky(failures=10, status_code=503, name="get_all_values")
+
+    with pytest.raises(APIError):
+        await _manager(scheduler)._call(method)
+    assert len(calls) == 3
+    assert scheduler.stats()["gave_up"] == 1
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    scheduler = _scheduler()
+    method, calls = _flaky(failures=1, status_code=400)
+
+    with pytest.raises(APIError):
+        await _manager(scheduler)._call(method)
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [_api_error(503), requests.exceptions.ReadTimeout("read timed out")])
+async def test_writes_that_may_have_been_applied_are_not_retried(error):
+    scheduler = _scheduler()
+    method, calls = _flaky(failures=1, error=error)
+
+    with pytest.raises(type(error)):
+        await _manager(scheduler)._call(method)
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_writes_that_were_never_sent_are_retried():
+    scheduler = _scheduler()
+    method, calls = _flaky(failures=1, error=_connection_refused())
+
+    assert await _manager(scheduler)._call(method) == "ok"
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_reads_are_retried_after_a_timeout():
+    scheduler = _scheduler()
+    method, calls = _flaky(failures=1, name="get_all_values", error=requests.exceptions.ReadTimeout("read timed out"))
+
+    assert await _manager(scheduler)._call(method) == "ok"
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_project_quota_is_shared_across_accounts():
+    scheduler = _scheduler(project_writes_per_minute=600, burst=1)
+    method, _ = _flaky(failures=0)
+    started = time.monotonic()
+
+    await asyncio.gather(*(_manager(scheduler, account=f"user-{i}")._call(method) for i in range(3)))
+
+    assert time.monotonic() - started >= 0.18
+    assert scheduler.stats()["calls"] == 3
+    assert scheduler.stats()["max_queue_depth"] >= 2
+
+@pytest.mark.asyncio
+async def test_one_accounts_calls_can_overlap():
+    scheduler = _scheduler()
+    manager = _manager(scheduler)
+
+    def slow_read():
+        time.sleep(0.1)
+        return "ok"
+
+    started = time.monotonic()
+    await asyncio.gather(*(manager._call(slow_read) for _ in range(3)))
+
+    assert time.monotonic() - started < 0.25
+
+def test_quotas_are_split_between_worker_processes(monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "WEB_WORKERS", 4)
+
+    scheduler = SheetsScheduler()
+
+    assert scheduler.user_rates["write"] == settings.SHEETS_USER_WRITES_PER_MINUTE / 4
+    assert scheduler.burst == settings.SHEETS_BUCKET_BURST / 4
+    # Explicit limits are taken as they are
+    assert SheetsScheduler(user_writes_per_minute=60).user_rates["write"] == 60
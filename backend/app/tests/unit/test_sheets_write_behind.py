@@ -0,0 +1,181 @@
+# tests/unit/test_sheets_write_behind.py
+import uuid
+import asyncio
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+from app.tools.sheets_write_behind import AppendJournal, WriteBehindAppender
+
+AUTH_ID = str(uuid.uuid4())
+
+class FakeWorksheetCache:
+    def __init__(self, worksheets=("Expenses", "Fuel")):
+        self.worksheets = worksheets
+
+    async def get_worksheet(self, client, account, spreadsheet_id, worksheet_name):
+        if worksheet_name not in self.worksheets:
+            raise WorksheetNotFound(worksheet_name)
+        return object()
+
+class FakeSheetsWriter:
+    def __init__(self, error=None):
+        self.worksheet_cache = FakeWorksheetCache()
+        self.error = error
+        self.calls = []
+
+    async def tool_config(self, refresh_token):
+        return {"configurable": {"gspread_client": object(), "gspread_account": refresh_token}}
+
+    async def append_rows(self, refresh_token, spreadsheet_id, worksheet_name, data_rows):
+        self.calls.append((refresh_token, worksheet_name, data_rows))
+        if self.error is not None:
+            raise self.error
+        return {"message": "ok"}
+
+class FakeRepository:
+    async def get_decrypted_user(self, auth_id):
+        return {"google_refresh_token": f"token-for-{auth_id}"}
+
+def _appender(tmp_path, writer=None, **overrides):
+    journal = AppendJournal(str(tmp_path / "journal.sqlite3"))
+    return WriteBehindAppender(writer or FakeSheetsWriter(), repository=FakeRepository(), journal=journal, flush_interval=0.01, **overrides)
+
+@pytest.mark.asyncio
+async def test_flush_coalesces_pending_rows_per_worksheet(tmp_path):
+    appender = _appender(tmp_path)
+    for rows in ([["a"]], [["b"], ["c"]]):
+        result = await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", rows)
+        assert result["queued"] is True
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Fuel", [["d"]])
+    assert appender.stats()["backlog_entries"] == 3
+
+    await appender.flush()
+
+    assert sorted(appender.sheets_writer.calls) == [
+        ("token", "Expenses", [["a"], ["b"], ["c"]]),
+        ("token", "Fuel", [["d"]]),
+    ]
+    stats = appender.stats()
+    assert stats["backlog_entries"] == 0
+    assert stats["flushed_rows"] == 4
+    assert stats["flush_calls"] == 2
+
+@pytest.mark.asyncio
+async def test_unknown_worksheet_is_rejected_before_journaling(tmp_path):
+    appender = _appender(tmp_path)
+    with pytest.raises(WorksheetNotFound):
+        await appender.enqueue(AUTH_ID, "token", "sheet", "Nope", [["a"]])
+    assert appender.stats()["backlog_entries"] == 0
+
+@pytest.mark.asyncio
+async def test_journal_is_replayed_by_the_next_process(tmp_path):
+    first = _appender(tmp_path)
+    await first.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+    first.close() # crashed before flushing
+
+    second = _appender(tmp_path)
+    await second.flush()
+
+    # The refresh token is looked up again; it is never written to the journal
+    assert second.sheets_writer.calls == [(f"token-for-{AUTH_ID}", "Expenses", [["a"]])]
+    assert second.stats()["backlog_entries"] == 0
+
+def test_worker_processes_sharing_a_journal_claim_distinct_entries(tmp_path):
+    path = str(tmp_path / "journal.sqlite3")
+    first, second = AppendJournal(path), AppendJournal(path, claim_seconds=0)
+    for row in ("a", "b"):
+        first.add(AUTH_ID, "sheet", "Expenses", [[row]])
+
+    assert [entry[0] for entry in first.due(1)] == [1]
+    assert [entry[0] for entry in second.due(10)] == [2]
+    # A claim that expired (e.g. its process crashed mid-flush) is handed out again
+    assert [entry[0] for entry in first.due(10)] == [2]
+
+@pytest.mark.asyncio
+async def test_transient_failure_is_retried_later(tmp_path):
+    writer = FakeSheetsWriter(error=ConnectionError("reset"))
+    appender = _appender(tmp_path, writer=writer, max_backoff=60)
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+
+    await appender.flush()
+    await appender.flush() # not due yet
+
+    assert len(writer.calls) == 1
+    stats = appender.stats()
+    assert stats["backlog_entries"] == 1
+    assert stats["dead_entries"] == 0
+    assert stats["failed_flushes"] == 1
+
+@pytest.mark.asyncio
+async def test_permanent_failure_marks_entries_dead(tmp_path):
+    writer = FakeSheetsWriter(error=WorksheetNotFound("Expenses"))
+    appender = _appender(tmp_path, writer=writer)
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+
+    await appender.flush()
+    await appender.flush()
+
+    assert len(writer.calls) == 1
+    stats = appender.stats()
+    assert stats["backlog_entries"] == 0
+    assert stats["dead_entries"] == 1
+
+@pytest.mark.asyncio
+async def test_stop_lets_an_append_in_progress_finish(tmp_path):
+    class SlowSheetsWriter(FakeSheetsWriter):
+        async def append_rows(self, *args):
+            self.started.set()
+            await asyncio.sleep(0.2)
+            self.finished = True
+            return await super().append_rows(*args)
+
+    writer = SlowSheetsWriter()
+    writer.started, writer.finished = asyncio.Event(), False
+    appender = _appender(tmp_path, writer=writer)
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+    appender.start()
+    await writer.started.wait()
+
+    await appender.stop(drain_timeout=5)
+
+    assert writer.finished
+    assert len(writer.calls) == 1
+    assert appender.stats()["backlog_entries"] == 0
+
+@pytest.mark.asyncio
+async def test_claim_is_renewed_while_the_append_is_running(tmp_path):
+    class SlowSheetsWriter(FakeSheetsWriter):
+        async def append_rows(self, *args):
+            await asyncio.sleep(0.5)
+            return await super().append_rows(*args)
+
+    path = str(tmp_path / "journal.sqlite3")
+    journal = AppendJournal(path, claim_seconds=0.2)
+    appender = WriteBehindAppender(SlowSheetsWriter(), repository=FakeRepository(), journal=journal, flush_interval=0.01)
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+    other_worker = AppendJournal(path)
+
+    flush = asyncio.create_task(appender.flush())
+    await asyncio.sleep(0.35) # past the original claim
+    assert other_worker.due(10) == []
+    await flush
+
+    assert len(appender.sheets_writer.calls) == 1
+    assert appender.stats()["backlog_entries"] == 0
+
+@pytest.mark.asyncio
+async def test_tokens_are_dropped_once_their_rows_are_written(tmp_path):
+    writer = FakeSheetsWriter(error=ConnectionError("reset"))
+    appender = _appender(tmp_path, writer=writer, max_backoff=60)
+    other = str(uuid.uuid4())
+    await appender.enqueue(AUTH_ID, "token", "sheet", "Expenses", [["a"]])
+
+    await appender.flush()
+    assert AUTH_ID in appender._tokens # still pending
+
+    writer.error = None
+    await appender.enqueue(other, "other-token", "sheet", "Expenses", [["b"]])
+    await appender.flush()
+
+    assert other not in appender._tokens
+    assert AUTH_ID in appender._tokens
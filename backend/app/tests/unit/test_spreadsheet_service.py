@@ -0,0 +1,121 @@
+# tests/unit/test_spreadsheet_service.py
+import pytest
+
+from app.services.spreadsheet_service import SpreadsheetService
+
+def _cell(value, rule=None):
+    cell = {"formattedValue": value}
+    if rule:
+        cell["dataValidation"] = {"condition": rule}
+    return cell
+
+CATEGORY_RULE = {"type": "ONE_OF_LIST", "values": [{"userEnteredValue": "Food"}, {"userEnteredValue": "Travel"}]}
+
+class FakeSpreadsheet:
+    def __init__(self, titles):
+        self.titles = titles
+        self.calls = []
+
+    async def fetch_sheet_metadata(self, params=None):
+        self.calls.append(params)
+        if params.get("includeGridData") != "true":
+            return {"sheets": [{"properties": {"sheetId": i, "title": t}} for i, t in enumerate(self.titles)]}
+        return {"sheets": [
+            {
+                "properties": {"sheetId": i, "title": t},
+                "data": [{"rowData": [
+                    {"values": [_cell("Date"), _cell("Category"), _cell("")]},
+                    {"values": [_cell("2024-01-01"), _cell("Food", CATEGORY_RULE)]},
+                    {},
+                ]}],
+            }
+            for i, t in enumerate(self.titles)
+        ]}
+
+def _service():
+    return SpreadsheetService(repository=object(), llm=object(), gspread_pool=object())
+
+@pytest.mark.asyncio
+async def test_previews_cost_two_calls_whatever_the_number_of_tabs():
+    spreadsheet = FakeSpreadsheet([f"Tab {i}" for i in range(30)] + ["Owner's tab"])
+
+    details = await _service()._fetch_sheet_previews(spreadsheet, preview_range="A1:Z50")
+
+    assert len(spreadsheet.calls) == 2
+    assert len(details) == 31
+    assert spreadsheet.calls[1]["ranges"][-1] == "'Owner''s tab'!A1:Z50"
+
+@pytest.mark.asyncio
+async def test_preview_rows_and_dropdown_rules_are_extracted():
+    details = await _service()._fetch_sheet_previews(FakeSpreadsheet(["Expenses"]), preview_range="A1:Z50")
+
+    assert details == [{
+        "name": "Expenses",
+        "preview": [["Date", "Category"], ["2024-01-01", "Food"]],
+        "validation_rules": {"B": {"first_cell": "B2", "condition": CATEGORY_RULE}},
+    }]
+
+class FakeRepository:
+    def __init__(self):
+        self.sections = None
+        self.writes = 0
+
+    async def user_owns_spreadsheet(self, user_id, spreadsheet_id):
+        return True
+
+    async def get_schema_sections(self, spreadsheet_id):
+        return self.sections
+
+    async def update_schema_summary(self, spreadsheet_id, summary, sections=None):
+        self.sections = sections
+        self.writes += 1
+
+class FakeLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def with_structured_output(self, schema):
+        llm = self
+
+        class Runnable:
+            async def ainvoke(self, prompt):
+                llm.prompts.append(prompt)
+                names = [name for name in ("Expenses", "Income") if f'"name": "{name}"' in prompt]
+                return schema(summaries=[{"worksheet": name, "summary": f"{name} table"} for name in names])
+        return Runnable()
+
+class FakeGspreadPool:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    async def authorize(self, refresh_token):
+        pool = self
+
+        class Client:
+            async def open_by_key(self, key):
+                return pool.spreadsheet
+        return Client()
+
+class FakeUser:
+    id = "user-1"
+    google_refresh_token = "refresh-token"
+
+@pytest.mark.asyncio
+async def test_refresh_only_resummarizes_changed_worksheets():
+    spreadsheet = FakeSpreadsheet(["Expenses", "Income"])
+    repository, llm = FakeRepository(), FakeLLM()
+    service = SpreadsheetService(repository=repository, llm=llm, gspread_pool=FakeGspreadPool(spreadsheet))
+
+    first = await service.refresh_schema_summary("sheet-1", FakeUser())
+    assert first["changed_worksheets"] == ["Expenses", "Income"]
+    assert first["summary"] == "### Worksheet: Expenses\nExpenses table\n\n### Worksheet: Income\nIncome table"
+
+    second = await service.refresh_schema_summary("sheet-1", FakeUser())
+    assert second["changed_worksheets"] == []
+    assert second["summary"] == first["summary"]
+    assert len(llm.prompts) == 1 and repository.writes == 1
+
+    repository.sections["Income"]["fingerprint"] = "stale"
+    third = await service.refresh_schema_summary("sheet-1", FakeUser())
+    assert third["changed_worksheets"] == ["Income"]
+    assert '"name": "Expenses"' not in llm.prompts[-1]
@@ -0,0 +1,65 @@
+# tests/unit/test_supabase_repository.py
+import pytest
+from postgrest.exceptions import APIError
+
+from app.repositories.supabase_repository import SupabaseRepository
+
+MISSING_ON_READ = {"code": "42703", "message": "column spreadsheets.schema_sections does not exist"}
+MISSING_ON_WRITE = {"code": "PGRST204", "message": "Could not find the 'schema_sections' column of 'spreadsheets' in the schema cache"}
+
+class FakeQuery:
+    def __init__(self, client, values=None):
+        self.client, self.values = client, values
+
+    def select(self, *args):
+        return self
+
+    def update(self, values):
+        return FakeQuery(self.client, values)
+
+    def eq(self, *args):
+        return self
+
+    def limit(self, *args):
+        return self
+
+    def execute(self):
+        self.client.executed.append(self.values)
+        if self.client.error and (self.values is None or "schema_sections" in self.values):
+            raise APIError(self.client.error)
+        return type("Response", (), {"data": []})()
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error, self.executed = error, []
+
+    def table(self, name):
+        return FakeQuery(self)
+
+@pytest.mark.asyncio
+async def test_a_missing_sections_column_means_no_stored_sections():
+    repository = SupabaseRepository(client=FakeClient(MISSING_ON_READ), max_concurrency=1)
+    try:
+        assert await repository.get_schema_sections("sheet") is None
+    finally:
+        repository.close()
+
+@pytest.mark.asyncio
+async def test_the_summary_is_saved_without_a_sections_column():
+    client = FakeClient(MISSING_ON_WRITE)
+    repository = SupabaseRepository(client=client, max_concurrency=1)
+    try:
+        await repository.update_schema_summary("sheet", "summary", {"Expenses": {"fingerprint": "f", "summary": "s"}})
+    finally:
+        repository.close()
+
+    assert client.executed[-1] == {"schema_summary": "summary"}
+
+@pytest.mark.asyncio
+async def test_other_errors_are_raised():
+    repository = SupabaseRepository(client=FakeClient({"code": "42501", "message": "permission denied"}), max_concurrency=1)
+    try:
+        with pytest.raises(APIError):
+            await repository.get_schema_sections("sheet")
+    finally:
+        repository.close()
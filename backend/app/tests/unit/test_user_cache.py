@@ -0,0 +1,79 @@
+# tests/unit/test_user_cache.py
+import time
+import uuid
+import jwt
+import pytest
+from datetime import datetime
+
+from app.core.config import settings
+from app.core.user_cache import AuthenticatedUserCache, verify_access_token
+from app.schemas import User
+
+def _user(auth_id=None):
+    return User(
+        id=uuid.uuid4(),
+        auth_id=auth_id or uuid.uuid4(),
+        email="user@example.com",
+        google_refresh_token="refresh-token",
+        created_at=datetime.now(),
+    )
+
+def _token(sub, exp_in=3600):
+    claims = {"sub": str(sub), "aud": "authenticated", "exp": int(time.time()) + exp_in}
+    return jwt.encode(claims, settings.SUPABASE_JWT_SECRET, algorithm="HS256")
+
+def test_cached_user_is_returned_and_hit_rate_reported():
+    cache = AuthenticatedUserCache(max_size=10, ttl_seconds=60)
+    user = _user()
+    token = _token(user.auth_id)
+
+    assert cache.get(token) is None
+    cache.set(token, user)
+
+    assert cache.get(token) == user
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_entry_never_outlives_the_token():
+    cache = AuthenticatedUserCache(max_size=10, ttl_seconds=60)
+    user = _user()
+    expired_token = _token(user.auth_id, exp_in=-5)
+
+    cache.set(expired_token, user)
+
+    assert cache.get(expired_token) is None
+
+def test_invalidate_user_drops_all_of_their_sessions():
+    cache = AuthenticatedUserCache(max_size=10, ttl_seconds=60)
+    user, other = _user(), _user()
+    first, second, other_token = _token(user.auth_id), _token(user.auth_id, exp_in=1800), _token(other.auth_id)
+    for token, cached in ((first, user), (second, user), (other_token, other)):
+        cache.set(token, cached)
+
+    assert cache.invalidate_user(user.auth_id) == 2
+    assert cache.get(first) is None and cache.get(second) is None
+    assert cache.get(other_token) == other
+
+def test_verify_access_token_checks_signature_locally():
+    auth_id = uuid.uuid4()
+    assert verify_access_token(_token(auth_id))["sub"] == str(auth_id)
+
+    forged = jwt.encode({"sub": str(auth_id), "aud": "authenticated", "exp": int(time.time()) + 60}, "not-the-secret-but-long-enough-for-hs256", algorithm="HS256")
+    with pytest.raises(jwt.InvalidTokenError):
+        verify_access_token(forged)
+
+@pytest.mark.asyncio
+async def test_a_token_that_could_not_be_stored_is_reported():
+    from app.services.user_service import UserService
+
+    class FailingRepository:
+        async def update_google_token(self, auth_id, refresh_token):
+            raise ConnectionError("database unavailable")
+
+    cache = AuthenticatedUserCache(max_size=10, ttl_seconds=60)
+    user = _user()
+    token = _token(user.auth_id)
+    cache.set(token, user)
+
+    with pytest.raises(ConnectionError):
+        await UserService(repository=FailingRepository(), user_cache=cache).store_google_refresh_token(user.auth_id, "new-token")
+    assert cache.get(token) is None
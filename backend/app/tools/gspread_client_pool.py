@@ -0,0 +1,93 @@
+# backend/app/tools/gspread_client_pool.py
+import asyncio
+import hashlib
+import structlog
+import gspread_asyncio
+from collections import OrderedDict
+from typing import Any, Dict
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from app.core.config import settings
+from app.tools.gspread_tool import get_creds_for_user
+from app.tools.sheets_scheduler import ScheduledClientManager, SheetsScheduler
+
+log = structlog.get_logger()
+
+class _PooledClient:
+    """One linked Google account: its credentials, client manager and refresh lock."""
+    def __init__(self, refresh_token: str, account: str, scheduler: SheetsScheduler):
+        self.credentials: Credentials = get_creds_for_user(refresh_token)
+        # The manager re-wraps these same credentials on reauth, so a live
+        # access token survives the manager's periodic re-authorization.
+        self.manager = ScheduledClientManager(lambda: self.credentials, scheduler=scheduler, account=account)
+        self.refresh_lock = asyncio.Lock()
+
+class GspreadClientPool:
+    """
+    Process-wide pool of authorized gspread clients, one per linked Google
+    account (keyed by a hash of its refresh token), evicted in LRU order.
+
+    An access token is reused until google-auth considers it close to expiry;
+    concurrent requests for the same account wait on a single refresh instead
+    of each exchanging the refresh token with Google.
+
+    All clients share one SheetsScheduler, which paces their calls against the
+    per-user and per-project Sheets quotas and retries rate-limited calls.
+    """
+    def __init__(self, max_size: int = None, scheduler: SheetsScheduler = None):
+        self.max_size = max_size or settings.GSPREAD_CLIENT_POOL_SIZE
+        self.scheduler = scheduler or SheetsScheduler()
+        self._clients: "OrderedDict[str, _PooledClient]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._token_refreshes = 0
+
+    @staticmethod
+    def account_key(refresh_token: str) -> str:
+        """Stable, non-reversible identifier for a linked Google account."""
+        return hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+
+    def _get_entry(self, key: str, refresh_token: str) -> _PooledClient:
+        entry = self._clients.get(key)
+        if entry is not None:
+            self._hits += 1
+            self._clients.move_to_end(key)
+            return entry
+
+        self._misses += 1
+        entry = self._clients[key] = _PooledClient(refresh_token, key, self.scheduler)
+        while len(self._clients) > self.max_size:
+            self._clients.popitem(last=False)
+        return entry
+
+    async def authorize(self, refresh_token: str) -> gspread_asyncio.AsyncioGspreadClient:
+        """Returns an authorized client for the account, refreshing its access token only when needed."""
+        key = self.account_key(refresh_token)
+        entry = self._get_entry(key, refresh_token)
+
+        if not entry.credentials.valid:
+            async with entry.refresh_lock:
+                # Another request may have refreshed while we waited for the lock
+                if not entry.credentials.valid:
+                    try:
+                        await asyncio.to_thread(entry.credentials.refresh, Request())
+                    except Exception:
+                        # A revoked or invalid refresh token must not stay pooled
+                        self.evict(refresh_token)
+                        raise
+                    self._token_refreshes += 1
+                    await log.adebug("Refreshed Google access token", pooled_clients=len(self._clients))
+
+        return await entry.manager.authorize()
+
+    def evict(self, refresh_token: str):
+        self._clients.pop(self.account_key(refresh_token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._clients),
+            "hits": self._hits,
+            "misses": self._misses,
+            "token_refreshes": self._token_refreshes,
+        }
@@ -0,0 +1,60 @@
+# backend/app/tools/gspread_handle_cache.py
+import gspread_asyncio
+from gspread.exceptions import WorksheetNotFound
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+class WorksheetHandleCache:
+    """
+    TTL cache of spreadsheet and worksheet handles keyed by
+    (account, spreadsheet_id[, worksheet title]), so steady-state appends skip
+    the `open_by_key` and `worksheet()` metadata fetches entirely.
+    The account key keeps one user's handles (and credentials) from ever
+    being handed to another user.
+    """
+    def __init__(self, max_size: int = None, ttl_seconds: float = None):
+        max_size = max_size or settings.GSPREAD_HANDLE_CACHE_SIZE
+        ttl_seconds = settings.GSPREAD_HANDLE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._spreadsheets = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._worksheets = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    async def get_spreadsheet(
+        self, client: gspread_asyncio.AsyncioGspreadClient, account: str, spreadsheet_id: str
+    ) -> gspread_asyncio.AsyncioGspreadSpreadsheet:
+        spreadsheet = self._spreadsheets.get((account, spreadsheet_id))
+        if spreadsheet is None:
+            # gspread_asyncio memoizes handles forever; this cache owns their lifetime instead
+            getattr(client, "_ss_cache_key", {}).pop(spreadsheet_id, None)
+            spreadsheet = await client.open_by_key(spreadsheet_id)
+            self._spreadsheets.set((account, spreadsheet_id), spreadsheet)
+        return spreadsheet
+
+    async def get_worksheet(
+        self, client: gspread_asyncio.AsyncioGspreadClient, account: str, spreadsheet_id: str, worksheet_name: str
+    ) -> gspread_asyncio.AsyncioGspreadWorksheet:
+        worksheet = self._worksheets.get((account, spreadsheet_id, worksheet_name))
+        if worksheet is not None:
+            return worksheet
+
+        spreadsheet = await self.get_spreadsheet(client, account, spreadsheet_id)
+        getattr(spreadsheet, "_ws_cache_title", {}).pop(worksheet_name, None)
+        try:
+            worksheet = await spreadsheet.worksheet(worksheet_name)
+        except WorksheetNotFound:
+            self.invalidate(account, spreadsheet_id, worksheet_name)
+            raise
+        self._worksheets.set((account, spreadsheet_id, worksheet_name), worksheet)
+        return worksheet
+
+    def invalidate(self, account: str, spreadsheet_id: str, worksheet_name: Optional[str] = None):
+        """Forgets a cached worksheet handle, or every handle of the spreadsheet, so the next lookup goes back to the API."""
+        if worksheet_name is not None:
+            self._worksheets.pop((account, spreadsheet_id, worksheet_name))
+            return
+        self._spreadsheets.pop((account, spreadsheet_id))
+        self._worksheets.invalidate_keys(lambda key: key[:2] == (account, spreadsheet_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"spreadsheets": self._spreadsheets.stats(), "worksheets": self._worksheets.stats()}
@@ -1,13 +1,18 @@
 # backend/app/tools/gspread_tool.py
 import gspread
 import gspread_asyncio
+from gspread.exceptions import APIError
 from google.oauth2.credentials import Credentials
+import asyncio
+import requests
 import structlog
-from typing import List, Dict, Any
+from google.auth.exceptions import TransportError
+from typing import List, Dict, Any, Tuple
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
 
 from app.core.config import settings
+from app.core.metrics import span
 
 log = structlog.get_logger()
 
@@ -22,6 +27,14 @@ def get_creds_for_user(refresh_token: str) -> Credentials:
         scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.readonly"]
     )
 
+def classify_error(e: Exception) -> Tuple[str, bool]:
+    """The error's class name, and whether the same call may succeed if tried again later."""
+    if isinstance(e, APIError):
+        code = e.response.status_code
+        return f"{type(e).__name__}({code})", code == 429 or code >= 500
+    # Network trouble; a revoked token (RefreshError) or a missing worksheet is not
+    retryable = isinstance(e, (requests.RequestException, TransportError, asyncio.TimeoutError, ConnectionError))
+    return type(e).__name__, retryable
 
 @tool
 async def batch_append_to_sheet(
@@ -33,11 +46,32 @@ async def batch_append_to_sheet(
     """
     Appends MULTIPLE rows of data to a Google Sheet in a single batch. This should be the final step.
     """
+    with span("sheets_append"):
+        return await _append_rows(spreadsheet_id, worksheet_name, data_rows, config)
+
+async def _append_rows(spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]], config: RunnableConfig) -> Dict[str, str]:
     client = config['configurable'].get("gspread_client")
     if not client:
         raise ValueError("Authorized gspread client not found in config.")
-            
-    spreadsheet = await client.open_by_key(spreadsheet_id)
-    worksheet = await spreadsheet.worksheet(worksheet_name)
-    await worksheet.append_rows(data_rows, value_input_option='USER_ENTERED')
+
+    handle_cache = config['configurable'].get("worksheet_cache")
+    account = config['configurable'].get("gspread_account")
+    if handle_cache is None or account is None:
+        spreadsheet = await client.open_by_key(spreadsheet_id)
+        worksheet = await spreadsheet.worksheet(worksheet_name)
+        await worksheet.append_rows(data_rows, value_input_option='USER_ENTERED')
+        return {"message": f"Successfully appended {len(data_rows)} rows to '{worksheet_name}'."}
+
+    # Steady state: the cached handle makes the append the only Sheets API call
+    worksheet = await handle_cache.get_worksheet(client, account, spreadsheet_id, worksheet_name)
+    try:
+        await worksheet.append_rows(data_rows, value_input_option='USER_ENTERED')
+    except APIError as e:
+        if e.response.status_code != 400:
+            raise
+        # A rejected append writes nothing; the tab may have been renamed or deleted, so look it up again once
+        await log.awarning("Append rejected, refreshing cached worksheet handle", spreadsheet_id=spreadsheet_id, worksheet_name=worksheet_name)
+        handle_cache.invalidate(account, spreadsheet_id, worksheet_name)
+        worksheet = await handle_cache.get_worksheet(client, account, spreadsheet_id, worksheet_name)
+        await worksheet.append_rows(data_rows, value_input_option='USER_ENTERED')
     return {"message": f"Successfully appended {len(data_rows)} rows to '{worksheet_name}'."}
\ No newline at end of file
@@ -0,0 +1,65 @@
+# backend/app/tools/gspread_writer.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+from langchain_core.runnables import RunnableConfig
+
+from app.core.config import settings
+
+from app.tools.gspread_tool import batch_append_to_sheet
+from app.tools.gspread_client_pool import GspreadClientPool
+from app.tools.gspread_handle_cache import WorksheetHandleCache
+
+class SheetsWriter:
+    """
+    Writes rows on behalf of a linked Google account through the shared
+    client pool and worksheet handle cache. Used by the agent's tool node and
+    by callers that append rows outside an agent run (batch uploads).
+
+    At most SHEETS_MAX_CONCURRENT_WRITES_PER_SPREADSHEET writes run against one
+    spreadsheet at a time, however many receipts or tool calls target it.
+    """
+    def __init__(
+        self,
+        gspread_pool: GspreadClientPool = None,
+        worksheet_cache: WorksheetHandleCache = None,
+        max_concurrent_per_spreadsheet: int = None,
+    ):
+        self.gspread_pool = gspread_pool or GspreadClientPool()
+        self.worksheet_cache = worksheet_cache or WorksheetHandleCache()
+        self.max_concurrent_per_spreadsheet = max_concurrent_per_spreadsheet or settings.SHEETS_MAX_CONCURRENT_WRITES_PER_SPREADSHEET
+        # spreadsheet id -> (semaphore, holders + waiters); dropped when nobody uses it
+        self._slots: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    @asynccontextmanager
+    async def spreadsheet_slot(self, spreadsheet_id: str) -> AsyncIterator[None]:
+        semaphore, users = self._slots.get(spreadsheet_id) or (asyncio.Semaphore(self.max_concurrent_per_spreadsheet), 0)
+        self._slots[spreadsheet_id] = (semaphore, users + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self._slots[spreadsheet_id]
+            if users == 1:
+                del self._slots[spreadsheet_id]
+            else:
+                self._slots[spreadsheet_id] = (semaphore, users - 1)
+
+    async def tool_config(self, refresh_token: str) -> RunnableConfig:
+        """RunnableConfig carrying the pooled, authorized client the Sheets tools expect."""
+        agc = await self.gspread_pool.authorize(refresh_token)
+        return RunnableConfig(configurable={
+            "gspread_client": agc,
+            "gspread_account": self.gspread_pool.account_key(refresh_token),
+            "worksheet_cache": self.worksheet_cache,
+        })
+
+    async def append_rows(
+        self, refresh_token: str, spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]]
+    ) -> Dict[str, str]:
+        config = await self.tool_config(refresh_token)
+        async with self.spreadsheet_slot(spreadsheet_id):
+            return await batch_append_to_sheet.ainvoke(
+                {"spreadsheet_id": spreadsheet_id, "worksheet_name": worksheet_name, "data_rows": data_rows},
+                config=config,
+            )
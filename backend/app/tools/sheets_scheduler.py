@@ -0,0 +1,219 @@
+# backend/app/tools/sheets_scheduler.py
+import time
+import random
+import asyncio
+import contextvars
+import structlog
+import gspread
+import gspread_asyncio
+import requests
+import urllib3
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from app.core.config import settings
+
+log = structlog.get_logger()
+
+# gspread method names that count against the write quota; everything else is a read
+_WRITE_PREFIXES = (
+    "append", "update", "batch_update", "batch_clear", "insert", "delete", "del_",
+    "clear", "add_", "values_append", "values_update", "values_batch_update", "values_clear",
+    "format", "resize", "sort", "merge", "unmerge", "copy", "create", "duplicate",
+)
+
+# State of the call currently running on this task: its quota kind and retry count
+_call_kind: contextvars.ContextVar[str] = contextvars.ContextVar("sheets_call_kind", default="read")
+_call_attempt: contextvars.ContextVar[int] = contextvars.ContextVar("sheets_call_attempt", default=0)
+
+def _never_sent(error: requests.RequestException) -> bool:
+    """True if the request failed before reaching the server (DNS, connection refused or timed out)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+class TokenBucket:
+    """
+    Refills at `rate_per_minute`, holds at most `burst` tokens. Waiters are
+    served in arrival order: the lock is held while the head of the line sleeps.
+    """
+    def __init__(self, rate_per_minute: float, burst: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class SheetsScheduler:
+    """
+    Client-side enforcement of the Sheets API quotas, which are counted per
+    minute for each user and for the whole project, separately for reads and
+    writes. Every call waits for a token from its account's bucket and from the
+    project-wide bucket, so a burst turns into queueing instead of 429s.
+
+    Calls that still hit 429 or a 5xx are retried with jittered exponential
+    backoff, up to SHEETS_MAX_RETRIES times, before the error is raised.
+    Writes are not idempotent: a 5xx or a timeout may come after the rows were
+    appended, so they are retried only on 429 and on errors raised before the
+    request was sent.
+    """
+    def __init__(
+        self,
+        user_reads_per_minute: float = None,
+        user_writes_per_minute: float = None,
+        project_reads_per_minute: float = None,
+        project_writes_per_minute: float = None,
+        burst: float = None,
+        max_retries: int = None,
+        backoff_base: float = None,
+        backoff_max: float = None,
+        max_accounts: int = None,
+    ):
+        # The quotas are per user and project, not per process: each worker gets its share
+        share = max(1, settings.WEB_WORKERS)
+        self.user_rates = {
+            "read": user_reads_per_minute or settings.SHEETS_USER_READS_PER_MINUTE / share,
+            "write": user_writes_per_minute or settings.SHEETS_USER_WRITES_PER_MINUTE / share,
+        }
+        self.burst = burst or settings.SHEETS_BUCKET_BURST / share
+        self.max_retries = settings.SHEETS_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = settings.SHEETS_BACKOFF_BASE_SECONDS if backoff_base is None else backoff_base
+        self.backoff_max = settings.SHEETS_BACKOFF_MAX_SECONDS if backoff_max is None else backoff_max
+        self.max_accounts = max_accounts or settings.GSPREAD_CLIENT_POOL_SIZE
+        self._project_buckets = {
+            "read": TokenBucket(project_reads_per_minute or settings.SHEETS_PROJECT_READS_PER_MINUTE / share, self.burst),
+            "write": TokenBucket(project_writes_per_minute or settings.SHEETS_PROJECT_WRITES_PER_MINUTE / share, self.burst),
+        }
+        self._user_buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._waiting = 0
+        self._max_waiting = 0
+        self._calls = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._retries = 0
+        self._gave_up = 0
+
+    def _user_bucket(self, account: str, kind: str) -> TokenBucket:
+        key = (account, kind)
+        bucket = self._user_buckets.get(key)
+        if bucket is None:
+            bucket = self._user_buckets[key] = TokenBucket(self.user_rates[kind], self.burst)
+            while len(self._user_buckets) > 2 * self.max_accounts:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(key)
+        return bucket
+
+    async def acquire(self, account: str, kind: str):
+        """Waits until both the account's and the project's quota allow one more call."""
+        started = time.monotonic()
+        self._waiting += 1
+        self._max_waiting = max(self._max_waiting, self._waiting)
+        try:
+            await self._user_bucket(account, kind).acquire()
+            await self._project_buckets[kind].acquire()
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - started
+        self._calls += 1
+        self._wait_seconds += waited
+        self._max_wait_seconds = max(self._max_wait_seconds, waited)
+        if waited >= 1:
+            await log.ainfo("Sheets call queued for quota", kind=kind, waited_seconds=round(waited, 2), queue_depth=self._waiting)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max, base * 2**attempt)]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def backoff(self, error: Exception, method_name: str):
+        """Sleeps before the next attempt of the current call, or re-raises once retries are spent."""
+        attempt = _call_attempt.get()
+        if attempt >= self.max_retries:
+            self._gave_up += 1
+            await log.aerror("Sheets call failed after retries", method=method_name, attempts=attempt + 1, error=str(error))
+            raise error
+        _call_attempt.set(attempt + 1)
+        self._retries += 1
+        delay = self.backoff_delay(attempt)
+        await log.awarning("Retrying Sheets call", method=method_name, attempt=attempt + 1, delay_seconds=round(delay, 2), error=str(error))
+        await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._waiting,
+            "max_queue_depth": self._max_waiting,
+            "calls": self._calls,
+            "avg_wait_seconds": round(self._wait_seconds / self._calls, 4) if self._calls else 0.0,
+            "max_wait_seconds": round(self._max_wait_seconds, 4),
+            "retries": self._retries,
+            "gave_up": self._gave_up,
+        }
+
+class ScheduledClientManager(gspread_asyncio.AsyncioGspreadClientManager):
+    """
+    gspread_asyncio client manager whose rate limiting and error handling go
+    through a shared SheetsScheduler, replacing the library's fixed per-manager
+    delay, its one-call-at-a-time lock and its retry-forever loop.
+    """
+    def __init__(self, credentials_fn: Callable, scheduler: SheetsScheduler, account: str, **kwargs):
+        super().__init__(credentials_fn, **kwargs)
+        self.scheduler = scheduler
+        self.account = account
+
+    async def _call(self, method, *args, **kwargs):
+        # The base class loop without its per-manager call_lock: the scheduler
+        # already paces every call, so one account's calls may run concurrently
+        name = getattr(method, "__name__", "")
+        is_write = name.startswith(_WRITE_PREFIXES)
+        _call_kind.set("write" if is_write else "read")
+        _call_attempt.set(0)
+        api_call_count = kwargs.pop("api_call_count", 1)
+        while True:
+            try:
+                for _ in range(api_call_count):
+                    await self.delay()
+                await self.before_gspread_call(method, args, kwargs)
+                return await asyncio.to_thread(method, *args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                code = e.response.status_code
+                # Other 4xx are the caller's mistake and will not go away on retry
+                if 400 <= code <= 499 and code != 429:
+                    raise
+                # A write that failed with a 5xx may still have been applied
+                if is_write and code != 429:
+                    raise
+                await self.handle_gspread_error(e, method, args, kwargs)
+            except requests.RequestException as e:
+                # Same for a write whose request was sent: retrying could append the rows twice
+                if is_write and not _never_sent(e):
+                    raise
+                await self.handle_requests_error(e, method, args, kwargs)
+
+    async def delay(self):
+        await self.scheduler.acquire(self.account, _call_kind.get())
+
+    async def handle_gspread_error(self, e, method, args, kwargs):
+        # Only 429 and (for reads) 5xx get here; the rest is raised by _call
+        await self.scheduler.backoff(e, getattr(method, "__name__", ""))
+
+    async def handle_requests_error(self, e: requests.RequestException, method, args, kwargs):
+        await self.scheduler.backoff(e, getattr(method, "__name__", ""))
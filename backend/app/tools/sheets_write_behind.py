@@ -0,0 +1,303 @@
+# backend/app/tools/sheets_write_behind.py
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+import structlog
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.tools.gspread_tool import classify_error
+from app.tools.gspread_writer import SheetsWriter
+
+log = structlog.get_logger()
+
+class AppendJournal:
+    """
+    Durable FIFO of pending appends in a small SQLite file. An entry is deleted
+    only after its rows reached the sheet, so anything still here after a crash
+    or restart is replayed. Entries that can never succeed are kept, marked dead,
+    for inspection.
+
+    Several worker processes may share the file: `due` claims the entries it
+    returns for `claim_seconds`, so no two flushers send the same rows. A
+    flusher renews the claim while its append is still running (the scheduler
+    may be backing off); a claim left by a crashed process simply expires.
+    """
+    def __init__(self, path: str, claim_seconds: float = 300):
+        self._lock = threading.Lock()
+        self.claim_seconds = claim_seconds
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending_appends ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, auth_id TEXT NOT NULL, spreadsheet_id TEXT NOT NULL,"
+            " worksheet_name TEXT NOT NULL, data_rows TEXT NOT NULL, created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0,"
+            " dead INTEGER NOT NULL DEFAULT 0, last_error TEXT)"
+        )
+        self._db.commit()
+
+    def add(self, auth_id: str, spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]]) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO pending_appends (auth_id, spreadsheet_id, worksheet_name, data_rows, created_at) VALUES (?, ?, ?, ?, ?)",
+                (auth_id, spreadsheet_id, worksheet_name, json.dumps(data_rows), time.time()),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def due(self, limit: int) -> List[Tuple]:
+        """Claims the live entries whose next attempt is due, oldest first."""
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front: another process' claim cannot interleave
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                entries = self._db.execute(
+                    "SELECT id, auth_id, spreadsheet_id, worksheet_name, data_rows, created_at, attempts FROM pending_appends"
+                    " WHERE dead = 0 AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE pending_appends SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.claim_seconds, entry[0]) for entry in entries],
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            return entries
+
+    def extend_claim(self, ids: List[int]):
+        """Keeps claimed entries from being handed out again for another `claim_seconds`."""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE pending_appends SET next_attempt_at = ? WHERE id = ? AND dead = 0",
+                [(time.time() + self.claim_seconds, i) for i in ids],
+            )
+            self._db.commit()
+
+    def pending_auth_ids(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT DISTINCT auth_id FROM pending_appends WHERE dead = 0")}
+
+    def delete(self, ids: List[int]):
+        with self._lock:
+            self._db.executemany("DELETE FROM pending_appends WHERE id = ?", [(i,) for i in ids])
+            self._db.commit()
+
+    def retry_later(self, ids: List[int], error: str, delay_seconds: float):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE pending_appends SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(time.time() + delay_seconds, error, i) for i in ids],
+            )
+            self._db.commit()
+
+    def mark_dead(self, ids: List[int], error: str):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE pending_appends SET dead = 1, attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(error, i) for i in ids],
+            )
+            self._db.commit()
+
+    def backlog(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, rows_json_bytes, oldest = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data_rows)), 0), MIN(created_at) FROM pending_appends WHERE dead = 0"
+            ).fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM pending_appends WHERE dead = 1").fetchone()[0]
+        return {"entries": entries, "bytes": rows_json_bytes, "oldest_created_at": oldest, "dead": dead}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class WriteBehindAppender:
+    """
+    Write-behind mode for Sheets appends. `enqueue` checks the worksheet exists
+    (a cached handle lookup), commits the rows to the journal and returns; the
+    caller acknowledges the receipt without waiting on the Sheets API.
+
+    A background flusher wakes every SHEETS_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+    coalesces due entries per (user, spreadsheet, worksheet) into one append
+    each, deletes them once written, and reschedules failures with exponential
+    backoff. Errors that retrying cannot fix (missing worksheet, revoked access)
+    mark the entries dead. Delivery is at-least-once: a crash between a
+    successful append and the journal delete replays those rows.
+    """
+    def __init__(
+        self,
+        sheets_writer: SheetsWriter,
+        repository=None,
+        journal: AppendJournal = None,
+        flush_interval: float = None,
+        batch_size: int = None,
+        max_backoff: float = None,
+    ):
+        self.sheets_writer = sheets_writer
+        # Looks up refresh tokens for entries journaled before a restart
+        self.repository = repository
+        self.journal = journal or AppendJournal(settings.SHEETS_WRITE_BEHIND_JOURNAL_PATH)
+        self.flush_interval = flush_interval or settings.SHEETS_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS
+        self.batch_size = batch_size or settings.SHEETS_WRITE_BEHIND_BATCH_SIZE
+        self.max_backoff = max_backoff or settings.SHEETS_WRITE_BEHIND_MAX_BACKOFF_SECONDS
+        # Auth id -> refresh token seen this process, kept while the user has rows pending
+        self._tokens: Dict[str, str] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._flushed_rows = 0
+        self._flush_calls = 0
+        self._failed_flushes = 0
+        self._last_flush_lag = 0.0
+        # Journal totals as of the last enqueue or flush: stats() runs on the event loop and must not query SQLite
+        self._backlog: Dict[str, Any] = {"entries": 0, "bytes": 0, "oldest_created_at": None, "dead": 0}
+
+    async def enqueue(
+        self, auth_id: str, refresh_token: str, spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]]
+    ) -> Dict[str, Any]:
+        """Journals the rows and returns once they are durable; raises if the worksheet does not exist."""
+        config = await self.sheets_writer.tool_config(refresh_token)
+        configurable = config["configurable"]
+        # Catch a wrong worksheet name now, while the agent can still correct it
+        await self.sheets_writer.worksheet_cache.get_worksheet(
+            configurable["gspread_client"], configurable["gspread_account"], spreadsheet_id, worksheet_name
+        )
+        self._tokens[auth_id] = refresh_token
+        await asyncio.to_thread(self.journal.add, auth_id, spreadsheet_id, worksheet_name, data_rows)
+        self._backlog = await asyncio.to_thread(self.journal.backlog)
+        self._wake.set()
+        return {"message": f"Queued {len(data_rows)} rows for '{worksheet_name}'. They will appear in the sheet shortly.", "queued": True}
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="sheets-write-behind")
+
+    async def stop(self, drain_timeout: float = 10):
+        """
+        Stops the flusher, letting a flush in progress finish (cancelling one
+        could resend rows that were already written), then makes one last
+        attempt to drain what is due; the rest stays journaled. Only what is
+        still running after `drain_timeout` is cancelled.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        deadline = time.monotonic() + drain_timeout
+        # asyncio.wait, unlike wait_for, never cancels what it waits on
+        pending = [self._task]
+        await asyncio.wait(pending, timeout=drain_timeout)
+        if self._task.done():
+            pending.append(asyncio.ensure_future(self.flush()))
+            await asyncio.wait(pending[1:], timeout=max(0.0, deadline - time.monotonic()))
+        if not all(task.done() for task in pending):
+            # Out of time: the rows of an interrupted append stay claimed and are replayed later
+            await log.awarning("Write-behind drain timed out; pending rows will be replayed on restart")
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._task = None
+
+    def close(self):
+        self.journal.close()
+
+    async def _run(self):
+        # Whatever a previous process left in the journal goes out first
+        backlog = self._backlog = await asyncio.to_thread(self.journal.backlog)
+        if backlog["entries"]:
+            await log.ainfo("Replaying write-behind journal", entries=backlog["entries"])
+        while not self._stopping:
+            try:
+                await self.flush()
+            except Exception:
+                await log.aexception("Write-behind flush crashed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Let a burst of enqueues accumulate into the same flush
+            await asyncio.sleep(min(0.5, self.flush_interval))
+            self._wake.clear()
+
+    async def flush(self):
+        """Writes every due entry, one append per (user, spreadsheet, worksheet)."""
+        entries = await asyncio.to_thread(self.journal.due, self.batch_size)
+        groups: "OrderedDict[Tuple[str, str, str], List[Tuple]]" = OrderedDict()
+        for entry in entries:
+            _, auth_id, spreadsheet_id, worksheet_name = entry[:4]
+            groups.setdefault((auth_id, spreadsheet_id, worksheet_name), []).append(entry)
+        await asyncio.gather(*(self._flush_group(key, group) for key, group in groups.items()))
+        self._backlog = await asyncio.to_thread(self.journal.backlog)
+        # Users whose rows are all written need no token; a later enqueue brings a fresh one
+        pending = await asyncio.to_thread(self.journal.pending_auth_ids)
+        for auth_id in [auth_id for auth_id in self._tokens if auth_id not in pending]:
+            del self._tokens[auth_id]
+
+    async def _flush_group(self, key: Tuple[str, str, str], entries: List[Tuple]):
+        auth_id, spreadsheet_id, worksheet_name = key
+        ids = [entry[0] for entry in entries]
+        data_rows = [row for entry in entries for row in json.loads(entry[4])]
+        try:
+            refresh_token = await self._refresh_token(auth_id)
+            await self._append_holding_claim(ids, refresh_token, spreadsheet_id, worksheet_name, data_rows)
+        except Exception as e:
+            self._failed_flushes += 1
+            error_class, retryable = classify_error(e)
+            if not retryable:
+                await log.aerror("Write-behind append cannot succeed, entries marked dead", worksheet_name=worksheet_name, error_class=error_class, error=str(e))
+                await asyncio.to_thread(self.journal.mark_dead, ids, f"{error_class}: {e}")
+                return
+            attempts = max(entry[6] for entry in entries)
+            delay = min(self.max_backoff, self.flush_interval * 2 ** attempts)
+            await log.awarning("Write-behind append failed, will retry", worksheet_name=worksheet_name, retry_in_seconds=delay, error=str(e))
+            await asyncio.to_thread(self.journal.retry_later, ids, f"{error_class}: {e}", delay)
+            return
+
+        await asyncio.to_thread(self.journal.delete, ids)
+        self._flush_calls += 1
+        self._flushed_rows += len(data_rows)
+        self._last_flush_lag = time.time() - min(entry[5] for entry in entries)
+
+    async def _append_holding_claim(self, ids: List[int], refresh_token: str, spreadsheet_id: str, worksheet_name: str, data_rows: List[List[str]]):
+        """Appends the rows, renewing the entries' claim every half claim period until the append returns."""
+        append = asyncio.ensure_future(self.sheets_writer.append_rows(refresh_token, spreadsheet_id, worksheet_name, data_rows))
+        try:
+            while True:
+                done, _ = await asyncio.wait([append], timeout=self.journal.claim_seconds / 2)
+                if done:
+                    return append.result()
+                await asyncio.to_thread(self.journal.extend_claim, ids)
+        finally:
+            # Cancelled from outside (stop() ran out of time): the append goes with it
+            append.cancel()
+
+    async def _refresh_token(self, auth_id: str) -> str:
+        refresh_token = self._tokens.get(auth_id)
+        if refresh_token is None and self.repository is not None:
+            user = await self.repository.get_decrypted_user(uuid.UUID(auth_id))
+            refresh_token = (user or {}).get("google_refresh_token")
+        if not refresh_token:
+            raise LookupError("Google account not linked or token is missing.")
+        self._tokens[auth_id] = refresh_token
+        return refresh_token
+
+    def stats(self) -> Dict[str, Any]:
+        backlog = dict(self._backlog)
+        oldest = backlog.pop("oldest_created_at")
+        return {
+            "backlog_entries": backlog["entries"],
+            "backlog_bytes": backlog["bytes"],
+            "dead_entries": backlog["dead"],
+            "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "last_flush_lag_seconds": round(self._last_flush_lag, 3),
+            "flushed_rows": self._flushed_rows,
+            "flush_calls": self._flush_calls,
+            "failed_flushes": self._failed_flushes,
+        }
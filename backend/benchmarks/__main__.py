@@ -0,0 +1,80 @@
+# benchmarks/__main__.py
+"""
+Offline load test of the API against local stand-ins for Gemini, Supabase and Sheets.
+
+    cd backend && python -m benchmarks --scenario process-receipt --concurrency 1,8,32 --requests 200
+
+Any app setting can be overridden through the environment as usual (e.g.
+RECEIPT_FAST_PATH_ENABLED=false, SHEETS_WRITE_BEHIND_ENABLED=true) to compare
+configurations. Use --json to keep results for regression comparisons.
+"""
+import os
+import json
+import asyncio
+import logging
+import argparse
+import tempfile
+
+# Placeholders for the settings that have no default; nothing here talks to the real services
+_SCRATCH = tempfile.mkdtemp(prefix="receipt-bench-")
+for key, value in {
+    "FRONTEND_URL": "http://localhost:3000",
+    "GSPREAD_CREDENTIALS_PATH": "credentials.json",
+    "GSPREAD_AUTHORIZED_USER_PATH": "authorized_user.json",
+    "GOOGLE_API_KEY": "benchmark-google-api-key",
+    "LANGCHAIN_API_KEY": "benchmark-langchain-api-key",
+    "LANGCHAIN_TRACING_V2": "false",
+    "GOOGLE_CLIENT_ID": "benchmark-client-id",
+    "GOOGLE_CLIENT_SECRET": "benchmark-client-secret",
+    "SUPABASE_URL": "https://benchmark.supabase.co",
+    "SUPABASE_SERVICE_ROLE_KEY": "benchmark-service-role-key",
+    "SUPABASE_JWT_SECRET": "benchmark-jwt-secret-with-enough-length-for-hs256",
+    "PGCRYPTO_SECRET_KEY": "benchmark-pgcrypto-key",
+    "SHEETS_WRITE_BEHIND_JOURNAL_PATH": os.path.join(_SCRATCH, "sheets_write_behind.sqlite3"),
+}.items():
+    os.environ.setdefault(key, value)
+
+from benchmarks.harness import SCENARIOS, BenchmarkConfig, format_table, run_benchmark
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="endpoint to drive (repeatable; default: all)")
+    parser.add_argument("--concurrency", type=_csv(int), default=[1, 8, 32], help="comma-separated in-flight request levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and level")
+    parser.add_argument("--users", type=int, default=8, help="distinct users (each with one canvas) the requests rotate through")
+    parser.add_argument("--llm-ms", type=float, default=800, help="mean Gemini latency per call")
+    parser.add_argument("--sheets-ms", type=float, default=150, help="mean Sheets API latency per call")
+    parser.add_argument("--supabase-ms", type=float, default=30, help="mean Supabase latency per round-trip")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency standard deviation, as a fraction of the mean")
+    parser.add_argument("--llm-failure-rate", type=float, default=0, help="fraction of Gemini calls that time out")
+    parser.add_argument("--sheets-failure-rate", type=float, default=0, help="fraction of Sheets calls answered 429/503")
+    parser.add_argument("--supabase-failure-rate", type=float, default=0, help="fraction of Supabase round-trips that fail")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+    # One line per in-process request drowns the app's own logs
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    config = BenchmarkConfig(
+        scenarios=args.scenario or SCENARIOS,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        users=args.users,
+        llm_ms=args.llm_ms,
+        sheets_ms=args.sheets_ms,
+        supabase_ms=args.supabase_ms,
+        jitter=args.jitter,
+        llm_failure_rate=args.llm_failure_rate,
+        sheets_failure_rate=args.sheets_failure_rate,
+        supabase_failure_rate=args.supabase_failure_rate,
+    )
+    results = asyncio.run(run_benchmark(config))
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump({"config": vars(args), "results": results}, output, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for Gemini, Supabase and Google Sheets with configurable
+latency and failure injection. They replace the network boundary only: the
+agent graph, caches, client scheduler and services around them are the real ones.
+"""
+import re
+import json
+import uuid
+import random
+import asyncio
+import requests
+import jwt as pyjwt
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.schemas import WorksheetSummaries, WorksheetSummary
+from app.tools.sheets_scheduler import SheetsScheduler, _call_attempt
+
+class Latency:
+    """Gaussian delay around `mean_ms`; `failure_rate` of the calls raise the backend's typical transient error."""
+    def __init__(self, mean_ms: float = 0, jitter: float = 0.2, failure_rate: float = 0):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    async def wait(self):
+        if self.mean_ms > 0:
+            await asyncio.sleep(max(0.0, random.gauss(self.mean_ms, self.mean_ms * self.jitter)) / 1000)
+
+    def should_fail(self) -> bool:
+        return self.failure_rate > 0 and random.random() < self.failure_rate
+
+def api_error(status_code: int, message: str = "injected failure") -> APIError:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps({"error": {"code": status_code, "message": message, "status": "UNAVAILABLE"}}).encode()
+    return APIError(response)
+
+# --- Gemini ---
+
+_SPREADSHEET_ID = re.compile(r"has the ID: ([a-zA-Z0-9-_]+)")
+
+class FakeReceiptLLM(BaseChatModel):
+    """
+    Plays both receipt roles of the chat model: with tools bound it asks for one
+    `batch_append_to_sheet` call and then confirms; bound to the extraction JSON
+    schema it returns the rows directly.
+    """
+    latency_ms: float = 0
+    jitter: float = 0.2
+    failure_rate: float = 0
+    worksheet_name: str = "Expenses"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-receipt-llm"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("FakeReceiptLLM is async only")
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        latency = Latency(self.latency_ms, self.jitter, self.failure_rate)
+        await latency.wait()
+        if latency.should_fail():
+            raise asyncio.TimeoutError("injected LLM timeout")
+
+        rows = [[datetime.now(timezone.utc).date().isoformat(), "Coffee", "3.50"]]
+        if kwargs.get("response_json_schema"):
+            message = AIMessage(content=json.dumps({"worksheet_name": self.worksheet_name, "data_rows": rows}))
+        elif isinstance(messages[-1], ToolMessage):
+            message = AIMessage(content=f"Added {len(rows)} rows to '{self.worksheet_name}'.")
+        else:
+            prompt = json.dumps([m.content for m in messages], default=str)
+            spreadsheet_id = _SPREADSHEET_ID.search(prompt).group(1)
+            message = AIMessage(content="", tool_calls=[{
+                "name": "batch_append_to_sheet",
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "args": {"spreadsheet_id": spreadsheet_id, "worksheet_name": self.worksheet_name, "data_rows": rows},
+            }])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+class FakeSummaryLLM:
+    """The summary model's only use: `with_structured_output(WorksheetSummaries).ainvoke(prompt)`."""
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return self
+
+    async def ainvoke(self, prompt: str) -> WorksheetSummaries:
+        self.calls += 1
+        await self.latency.wait()
+        if self.latency.should_fail():
+            raise asyncio.TimeoutError("injected LLM timeout")
+        names = re.findall(r'"name": "([^"]+)"', prompt)
+        return WorksheetSummaries(summaries=[
+            WorksheetSummary(worksheet=name, summary=f"Table at A1 with headers Date, Item, Amount ({name}).") for name in names
+        ])
+
+# --- Supabase ---
+
+class FakeSupabaseRepository:
+    """In-memory SupabaseRepository: users, their spreadsheets and schema sections."""
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self.users: Dict[str, Dict[str, Any]] = {} # auth id -> decrypted user row
+        self.spreadsheets: Dict[str, Dict[str, Any]] = {} # spreadsheet id -> row
+        self.calls = 0
+
+    def add_user(self, spreadsheet_ids: List[str], summary: str) -> Dict[str, Any]:
+        user = {
+            "id": str(uuid.uuid4()),
+            "auth_id": str(uuid.uuid4()),
+            "email": f"user-{len(self.users)}@example.com",
+            "full_name": None,
+            "google_refresh_token": f"refresh-{uuid.uuid4().hex}",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.users[user["auth_id"]] = user
+        for spreadsheet_id in spreadsheet_ids:
+            self.spreadsheets[spreadsheet_id] = {
+                "id": str(uuid.uuid4()),
+                "user_id": user["id"],
+                "spreadsheet_id": spreadsheet_id,
+                "name": f"Canvas {spreadsheet_id[:6]}",
+                "schema_summary": summary,
+                "schema_sections": None,
+            }
+        return user
+
+    async def _round_trip(self):
+        self.calls += 1
+        await self.latency.wait()
+        if self.latency.should_fail():
+            raise ConnectionError("injected Supabase connection reset")
+
+    async def get_auth_user(self, jwt: str):
+        # Remote validation stand-in: the harness mints the tokens, so their subject is trusted
+        await self._round_trip()
+        claims = pyjwt.decode(jwt, options={"verify_signature": False})
+        return SimpleNamespace(id=claims["sub"]) if claims.get("sub") in self.users else None
+
+    async def get_decrypted_user(self, auth_id) -> Optional[Dict]:
+        await self._round_trip()
+        return self.users.get(str(auth_id))
+
+    async def update_google_token(self, auth_id, refresh_token: str):
+        await self._round_trip()
+        self.users[str(auth_id)]["google_refresh_token"] = refresh_token
+
+    def _owned(self, user_id, spreadsheet_id: str) -> Optional[Dict]:
+        row = self.spreadsheets.get(spreadsheet_id)
+        return row if row is not None and row["user_id"] == str(user_id) else None
+
+    async def user_owns_spreadsheet(self, user_id, spreadsheet_id: str) -> bool:
+        await self._round_trip()
+        return self._owned(user_id, spreadsheet_id) is not None
+
+    async def get_owned_spreadsheet(self, user_id, spreadsheet_id: str) -> Optional[Dict]:
+        await self._round_trip()
+        row = self._owned(user_id, spreadsheet_id)
+        return {"id": row["id"], "schema_summary": row["schema_summary"]} if row else None
+
+    async def upsert_spreadsheet(self, user_id, spreadsheet_id: str, name: str) -> List[Dict]:
+        await self._round_trip()
+        row = self.spreadsheets.setdefault(spreadsheet_id, {
+            "id": str(uuid.uuid4()), "user_id": str(user_id), "spreadsheet_id": spreadsheet_id,
+            "schema_summary": None, "schema_sections": None,
+        })
+        row["name"] = name
+        return [row]
+
+    async def list_spreadsheets(self, user_id) -> List[Dict]:
+        await self._round_trip()
+        return [
+            {"spreadsheet_id": row["spreadsheet_id"], "name": row["name"]}
+            for row in self.spreadsheets.values() if row["user_id"] == str(user_id)
+        ]
+
+    async def get_schema_sections(self, spreadsheet_id: str) -> Optional[Dict[str, Dict]]:
+        await self._round_trip()
+        row = self.spreadsheets.get(spreadsheet_id)
+        return row["schema_sections"] if row else None
+
+    async def update_schema_summary(self, spreadsheet_id: str, summary: str, sections: Dict[str, Dict] = None):
+        await self._round_trip()
+        row = self.spreadsheets[spreadsheet_id]
+        row["schema_summary"], row["schema_sections"] = summary, sections
+
+    async def ping(self):
+        await self._round_trip()
+
+    def close(self):
+        pass
+
+# --- Google Sheets ---
+
+class FakeSheets:
+    """
+    Every spreadsheet has the same worksheets. Calls are paced by the shared
+    SheetsScheduler and retried on injected 429/503s, like ScheduledClientManager
+    does for real ones; only the HTTP round-trip is simulated.
+    """
+    def __init__(self, scheduler: SheetsScheduler, latency: Latency = None, worksheets: List[str] = ("Expenses", "Fuel")):
+        self.scheduler = scheduler
+        self.latency = latency or Latency()
+        self.worksheets = list(worksheets)
+        self.appended_rows = 0
+        self.calls = 0
+
+    async def call(self, account: str, kind: str, fn=None):
+        _call_attempt.set(0)
+        while True:
+            await self.scheduler.acquire(account, kind)
+            self.calls += 1
+            await self.latency.wait()
+            if not self.latency.should_fail():
+                return fn() if fn else None
+            # Sleeps with jitter, or raises once SHEETS_MAX_RETRIES are spent
+            await self.scheduler.backoff(api_error(random.choice((429, 503))), "fake")
+
+class FakeWorksheet:
+    def __init__(self, sheets: FakeSheets, account: str, title: str):
+        self.sheets, self.account, self.title = sheets, account, title
+
+    async def append_rows(self, values, value_input_option=None):
+        def append():
+            self.sheets.appended_rows += len(values)
+        await self.sheets.call(self.account, "write", append)
+
+class FakeSpreadsheet:
+    def __init__(self, sheets: FakeSheets, account: str, spreadsheet_id: str):
+        self.sheets, self.account, self.id = sheets, account, spreadsheet_id
+
+    async def worksheet(self, title: str) -> FakeWorksheet:
+        await self.sheets.call(self.account, "read")
+        if title not in self.sheets.worksheets:
+            raise WorksheetNotFound(title)
+        return FakeWorksheet(self.sheets, self.account, title)
+
+    async def worksheets(self) -> List[FakeWorksheet]:
+        await self.sheets.call(self.account, "read")
+        return [FakeWorksheet(self.sheets, self.account, title) for title in self.sheets.worksheets]
+
+    async def fetch_sheet_metadata(self, params=None) -> Dict[str, Any]:
+        await self.sheets.call(self.account, "read")
+        sheets = []
+        for index, title in enumerate(self.sheets.worksheets):
+            sheet = {"properties": {"sheetId": index, "title": title}}
+            if params and params.get("includeGridData"):
+                header = {"values": [{"formattedValue": value} for value in ("Date", "Item", "Amount")]}
+                sheet["data"] = [{"startRow": 0, "startColumn": 0, "rowData": [header]}]
+            sheets.append(sheet)
+        return {"sheets": sheets}
+
+class FakeClient:
+    def __init__(self, sheets: FakeSheets, account: str):
+        self.sheets, self.account = sheets, account
+
+    async def open_by_key(self, spreadsheet_id: str) -> FakeSpreadsheet:
+        await self.sheets.call(self.account, "read")
+        return FakeSpreadsheet(self.sheets, self.account, spreadsheet_id)
+
+class FakeGspreadPool:
+    """GspreadClientPool over FakeSheets; authorizing is free (no token refresh round-trip)."""
+    def __init__(self, sheets: FakeSheets):
+        self.sheets = sheets
+        self.scheduler = sheets.scheduler
+        self._clients: Dict[str, FakeClient] = {}
+
+    @staticmethod
+    def account_key(refresh_token: str) -> str:
+        return f"account-{refresh_token[-12:]}"
+
+    async def authorize(self, refresh_token: str) -> FakeClient:
+        key = self.account_key(refresh_token)
+        if key not in self._clients:
+            self._clients[key] = FakeClient(self.sheets, key)
+        return self._clients[key]
+
+    def evict(self, refresh_token: str):
+        self._clients.pop(self.account_key(refresh_token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"clients": len(self._clients), "sheets_calls": self.sheets.calls, "appended_rows": self.sheets.appended_rows}
@@ -0,0 +1,227 @@
+# benchmarks/harness.py
+"""
+Runs the FastAPI app in-process (httpx ASGI transport, real lifespan) with
+the registry's network-facing dependencies replaced by the stand-ins in
+`benchmarks.fakes`, drives endpoints at fixed concurrency levels and reports
+latency percentiles, throughput, event-loop lag and memory.
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import itertools
+import resource
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import jwt
+import httpx
+from PIL import Image
+
+from benchmarks.fakes import FakeGspreadPool, FakeReceiptLLM, FakeSheets, FakeSummaryLLM, FakeSupabaseRepository, Latency
+
+SCENARIOS = ("process-receipt", "canvases", "refresh-schema")
+
+class BenchmarkConfig:
+    def __init__(
+        self,
+        scenarios=SCENARIOS,
+        concurrency=(1, 8, 32),
+        requests: int = 100,
+        users: int = 8,
+        llm_ms: float = 800,
+        sheets_ms: float = 150,
+        supabase_ms: float = 30,
+        jitter: float = 0.2,
+        llm_failure_rate: float = 0,
+        sheets_failure_rate: float = 0,
+        supabase_failure_rate: float = 0,
+    ):
+        self.scenarios = list(scenarios)
+        self.concurrency = list(concurrency)
+        self.requests = requests
+        self.users = users
+        self.llm = Latency(llm_ms, jitter, llm_failure_rate)
+        self.sheets = Latency(sheets_ms, jitter, sheets_failure_rate)
+        self.supabase = Latency(supabase_ms, jitter, supabase_failure_rate)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), falling back to the peak."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class LoopLagMonitor:
+    """Samples how late a short, periodic sleep wakes up: time the event loop spent blocked."""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        samples = sorted(self.samples)
+        return {
+            "loop_lag_p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            "loop_lag_max_ms": round((samples[-1] if samples else 0.0) * 1000, 2),
+        }
+
+def receipt_image(seed: int) -> bytes:
+    """A small PNG that differs per request, so duplicate detection does not short-circuit the run."""
+    image = Image.new("RGB", (640, 960), (255, 255, 255))
+    image.putpixel((seed % 640, (seed // 640) % 960), (seed % 251, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@asynccontextmanager
+async def benchmark_app(config: BenchmarkConfig) -> AsyncIterator["BenchmarkApp"]:
+    """The app wired to fakes, inside its lifespan. The process-wide registry is reset on exit."""
+    from app.main import app
+    from app.core.registry import registry
+    from app.core.config import settings
+    from app.core.context_cache import LocalContextCacheBackend, PromptContextCache
+    from app.schemas import ReceiptExtraction
+    from app.services.receipt_result_cache import ReceiptResultCache
+    from app.tools.sheets_scheduler import SheetsScheduler
+
+    repository = FakeSupabaseRepository(config.supabase)
+    sheets = FakeSheets(SheetsScheduler(), config.sheets)
+    registry._repository = repository
+    registry._gspread_pool = FakeGspreadPool(sheets)
+    registry._summary_llm = FakeSummaryLLM(config.llm)
+    # The Gemini cache backend would call the real API; the local one keeps the bookkeeping
+    registry._prompt_cache, registry._prompt_cache_built = PromptContextCache(LocalContextCacheBackend()), True
+    if settings.RECEIPT_DEDUP_ENABLED:
+        registry._result_cache = ReceiptResultCache(path=":memory:")
+
+    fake_llm = FakeReceiptLLM(latency_ms=config.llm.mean_ms, jitter=config.llm.jitter, failure_rate=config.llm.failure_rate)
+    agent = registry.receipt_agent
+    agent.llm = fake_llm
+    agent.llm_with_tools = fake_llm.bind_tools([])
+    agent.extraction_llm = fake_llm.bind(response_mime_type="application/json", response_json_schema=ReceiptExtraction.model_json_schema())
+
+    bench = BenchmarkApp(app, repository, sheets, config.users)
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                bench.client = client
+                yield bench
+    finally:
+        # Everything above was installed on the shared registry; the next run starts clean
+        registry.__init__()
+
+class BenchmarkApp:
+    def __init__(self, app, repository: FakeSupabaseRepository, sheets: FakeSheets, users: int):
+        from app.core.config import settings
+
+        self.app = app
+        self.repository = repository
+        self.sheets = sheets
+        self.client: httpx.AsyncClient = None
+        self.sessions = []
+        self._images = itertools.count() # unique across levels, or repeats would hit the duplicate cache
+        summary = "### Worksheet: Expenses\nTable at A1 with headers Date, Item, Amount.\n\n### Worksheet: Fuel\nTable at A1 with headers Date, Litres, Amount."
+        for index in range(users):
+            spreadsheet_id = f"{index:04d}".ljust(44, "x")
+            user = repository.add_user([spreadsheet_id], summary)
+            token = jwt.encode(
+                {"sub": user["auth_id"], "aud": "authenticated", "exp": int(time.time()) + 24 * 3600},
+                settings.SUPABASE_JWT_SECRET,
+                algorithm="HS256",
+            )
+            self.sessions.append({"headers": {"Authorization": f"Bearer {token}"}, "spreadsheet_id": spreadsheet_id})
+
+    async def request(self, scenario: str, index: int) -> httpx.Response:
+        session = self.sessions[index % len(self.sessions)]
+        headers, spreadsheet_id = session["headers"], session["spreadsheet_id"]
+        if scenario == "process-receipt":
+            return await self.client.post(
+                "/process-receipt",
+                headers=headers,
+                data={"spreadsheet_id": spreadsheet_id, "worksheet_name": "Expenses"},
+                files={"image": ("receipt.png", receipt_image(next(self._images)), "image/png")},
+            )
+        if scenario == "canvases":
+            return await self.client.get("/canvases", headers=headers)
+        if scenario == "refresh-schema":
+            return await self.client.post(f"/canvases/{spreadsheet_id}/refresh-schema", headers=headers)
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+async def run_level(bench: BenchmarkApp, scenario: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    """`requests` calls to one scenario with `concurrency` of them in flight at any time."""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    next_index = iter(range(requests))
+
+    async def worker():
+        for index in next_index:
+            started = time.perf_counter()
+            try:
+                status = (await bench.request(scenario, index)).status_code
+            except Exception:
+                status = 0 # the app raised instead of answering
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_before = rss_bytes()
+    with LoopLagMonitor() as lag:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if 200 <= status < 300)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": ok,
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        **lag.stats(),
+        "rss_mb": round(rss_bytes() / 2**20, 1),
+        "rss_delta_mb": round((rss_bytes() - rss_before) / 2**20, 1),
+    }
+
+async def run_benchmark(config: BenchmarkConfig) -> List[Dict[str, Any]]:
+    results = []
+    async with benchmark_app(config) as bench:
+        for scenario in config.scenarios:
+            for concurrency in config.concurrency:
+                results.append(await run_level(bench, scenario, concurrency, config.requests))
+    return results
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    columns = ["scenario", "concurrency", "ok", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "loop_lag_p99_ms", "loop_lag_max_ms", "rss_mb"]
+    rows = [columns] + [[str(result[column]) for column in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)